@@ -34,9 +34,7 @@
     DB connections to providers.
 """
 import os
-import shutil
-from zipfile import ZipFile
-from zipfile import BadZipfile
+from botocore.exceptions import ClientError
 from django.conf import settings
 from django.db import models
 from django.db.models.signals import pre_delete
@@ -51,12 +49,13 @@ from mpframework.common.tasks import run_queue_function
 from mpframework.common.utils import join_urls
 from mpframework.common.utils import join_paths
 from mpframework.common.utils.file import create_file_from_post
-from mpframework.common.utils.file import create_local_folder
 from mpframework.common.deploy.server import mp_shutdown
 from mpframework.common.logging.timing import mpTiming
 from mpframework.foundation.tenant.models.base.provider import ProviderModel
 from mpextend.user.usercontent.models import UserItem
 
+from ..mount import PackageMount
+from ..mount import mount_progress
 from .manager import PackageManager
 
 
@@ -168,8 +167,8 @@ class Package( ProviderModel ):
         Package file upload/unzip/mount management
 
         ZIP file is loaded to S3 (or local area) either directly or via
-        normal post. The mounting happens by copying archive to a working
-        folder to unzip, and then LMS files are moved to locations.
+        normal post. The mounting streams members from the archive into
+        their run locations, without a local copy of the archive or files.
         This supports both production and local dev cases.
     """
 
@@ -202,67 +201,60 @@ class Package( ProviderModel ):
 
     def _mount_archive( self ):
         """
-        Download archive to server, unzip it, then push the pieces back up
+        Stream archive members into the run location
         """
+        mount = PackageMount( self.pk, self.archive_path, self._runpath(),
+                    local_archive=self._source_archive(),
+                    local_run=self._local_run_name )
+        log.info2("MOUNTING PACKAGE: %s\n  archive: %s\n path: %s, run url: %s",
+                self, mount.local_archive or self.archive_path,
+                self._runpath(), self._runurl )
+        try:
+            names = self._run_mount( mount )
+        except Exception:
+            log.exception("Error in Package mount, ending mounting process: %s",
+                            self.archive_name)
+            names = None
+            mount.progress['failed'] += 1
+
+        if names is None or mount.progress['failed']:
+            self.run_ready = False
+            self.mounting = False
+            self.save()
+            return
 
-        # Get file from download location; if this fails nowhere to go
-        local_package = self._download_package()
-        if not local_package:
-            # HACK - the package may be getting copied to S3, try once more
-            mp_shutdown().wait( _package_retry_time )
-            local_package = self._download_package()
-            if not local_package:
-                log.warning("Error in Package download, ending mounting process: %s",
-                                self.archive_name)
-                self.run_ready = False
-                self.mounting = False
-                self.save()
-                return
-
-        # Use local protected folder for unzipping files if necessary. The files can
-        # then be uploaded to S3 or hosted directly
-        local_expand_path = self._local_run_name
-        create_local_folder( local_expand_path )
-
-        log.info2("MOUNTING PACKAGE: %s\n  local_expand: %s\n path: %s, run url: %s",
-                local_package, local_expand_path, self._runpath(), self._runurl )
-
-        # Try to unzip the file
-        if not self._unzip_to_run_location( local_package, local_expand_path ):
-
-            # If this isn't a zip file, try to push the file from the archive location to protected,
-            # which will fail if local protected hosting is set, in which case the
-            # file should be copied from archive to protected location
-            if self._push_to_s3( local_package, self.archive_name ):
-                log.debug("Package not zip file, pushed to S3: %s -> %s", local_package, self.archive_name)
-            else:
-                log.debug("Package not zip file, local copy: %s -> %s", local_package, local_expand_path)
-                shutil.copy( local_package, local_expand_path )
-
-        self._set_launch_type( local_expand_path )
-
-        # Clean the uploaded file off the local server (don't kill test fixtures)
-        if not self._is_test_fixture:
-
-            log.debug("Removing local package upload file: %s -> %s", self, local_package)
-            os.remove( local_package )
-
-            log.debug("Removing local package unzipped files: %s -> %s", self, local_expand_path)
-            try:
-                shutil.rmtree( local_expand_path )
-            except Exception:
-                log.exception("Exception removing unzipped package file: %s -> %s", self, local_expand_path)
+        self._set_launch_type( names )
 
         # Mark the package as ready for use
         self.run_ready = True
         self.mounting = False
         self.save()
 
-    def _set_launch_type( self, files_path ):
+    def _run_mount( self, mount ):
+        """
+        Returns names of files placed in run location, or None if the
+        archive could not be found
+        """
+        try:
+            names = mount.run()
+        except ( IOError, ClientError ):
+            # HACK - the package may be getting copied to S3, try once more
+            mp_shutdown().wait( _package_retry_time )
+            names = mount.run()
+
+        # If this isn't a zip file, place the archive file itself
+        if names is None:
+            log.debug("Package not zip file, copying: %s -> %s", self, self._runpath())
+            mount.copy_archive( self.archive_name )
+            names = [ self.archive_name ]
+        return names
+
+    def _set_launch_type( self, names ):
         """
-        Auto-detect and set the launch file if needed
+        Auto-detect and set the launch file from package file names if needed
         """
-        log.debug("Auto-detecting package launch file: %s -> %s", self, files_path)
+        log.debug("Auto-detecting package launch file: %s -> %s files", self, len(names))
+        names = set( names )
 
         for lms_type, launch_files in _launch_config.items():
 
@@ -273,87 +265,51 @@ class Package( ProviderModel ):
             if self.lms_type in ['A', lms_type]:
                 for file in launch_files:
                     log.debug2("Checking for launch file: %s -> %s, %s", self, lms_type, file)
-                    if os.path.exists( join_paths( files_path, file ) ):
+                    if file in names:
                         self.lms_type = lms_type
                         self.launch_file = file
                         break
 
         log.info("No launch file set during package mounting: %s", self)
 
-    def _download_package( self ):
+    def _source_archive( self ):
         """
-        Tries to download package from S3 for expansion (or handle test fixtures in dev)
-        Returns the local path to package if successful
+        Local archive to mount from, or None to read it from S3
         """
         if self._is_test_fixture:
             log.debug("PACKAGE mounting test fixture: %s", self)
             # TEST HACK - In the test fixture scenario, file already exists locally on the server,
-            # so skip download archive step and expand from test fixture location
+            # so expand from test fixture location
             # This is a divergence in test path but that gap will be covered by automated testing
             # that uploads packages like a staff user would
-            local_path = self._test_fixture_archive()
-        else:
-            local_path = self._local_archive_path
-            local_folder, _file = os.path.split( local_path )
-
-            # If using S3, bring file down to the local server
-            s3key = s3.protected_bucket()
-            if s3key:
-                try:
-                    s3key.key = self.archive_path
-                    log.debug("PACKAGE download: %s -> %s", s3key.key, local_path)
-
-                    create_local_folder( local_folder )
-
-                    with open( local_path, 'wb') as local_file:
-                        s3key.get_contents_to_file( local_file )
+            return self._test_fixture_archive()
+        if not settings.MP_CLOUD:
+            # If not using S3, file is already in place on local server
+            log.debug("PACKAGE LOCAL upload: %s", self)
+            return self._local_archive_path
 
-                except Exception as e:
-                    log.info2("Problem downloading package from S3: %s -> %s => %s",
-                                s3key.key, local_path, e )
-                    os.remove( local_path )
-                    local_path = None
-
-            # if not using S3, file is already in place on local server
-            else:
-                log.debug("PACKAGE LOCAL upload: %s", self)
-
-        return local_path
+    @property
+    def mount_progress( self ):
+        """
+        Counts of files placed while mounting, or None if not mounting
+        """
+        return mount_progress( self.pk )
 
-    def _unzip_to_run_location( self, local_path, protected_path ):
+    def remove_files( self, dry_run=False ):
         """
-        Locally unzip package and move the files up to S3
-        Returns false if the file is not a valid zip file
+        Remove mounted run files, unless another package in the provider
+        (e.g., a clone) runs from the same location.
+        Returns BulkS3 with counts and dry-run manifest.
         """
-        try:
-            # Best way to test for valid zip is to open as zip and test
-            zip = ZipFile( local_path, 'r' )
-            valid_zip = zip.testzip() is None
-        except BadZipfile:
-            valid_zip = False
-        if not valid_zip:
-            return False
-
-        # Unzip files into the local location and then push to S3 if needed
-        log.debug("UNZIPPING, then uploading package files: %s => %s => S3", local_path, protected_path)
-
-        # Avoid use of extractall to guard against malformed zip attacks
-        for item in zip.namelist():
-            path = join_paths( protected_path, str(item) )
-            if item.endswith('/'):
-                create_local_folder( path )
-            else:
-                log.debug2("Extracting file: %s", item)
-                zip.extract( item, protected_path )
-
-                # If S3 not enabled, this fails, and files will be hosted from server
-                self._push_to_s3( path, item )
-
-        zip.close()
-        return True
-
-    def _push_to_s3( self, path, filename='' ):
-        return s3.upload_protected( path, self._runpath( filename ) )
+        if not self.package_root or not self.run_name:
+            return
+        if Package.objects.filter( _provider_id=self._provider_id,
+                    run_name=self.run_name ).exclude( pk=self.pk ).exists():
+            log.info("Package run files shared, not removing: %s", self)
+            return
+        bulk = s3.BulkS3( 'protected', dry_run=dry_run )
+        bulk.delete_prefix( self._runpath() + '/' )
+        return bulk
 
     def _test_fixture_archive( self ):
         """
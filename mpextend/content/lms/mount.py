@@ -0,0 +1,228 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Streaming package mount
+
+    Zip members are read directly from the archive (ranged reads from
+    S3, or the local file) and pushed to the run location by a bounded
+    pool of upload threads, so archives are not downloaded or expanded
+    on local disk before upload.
+    Small members are read in the mount thread and put in one request;
+    large members are streamed by a pool thread into a multipart upload.
+
+    Members already at the destination with the same content are skipped,
+    so remounts and retries of partial mounts only move what changed.
+    Small members are matched on MD5 against the S3 ETag; multipart
+    ETags are not content hashes, so large members carry the zip CRC
+    in their metadata.
+
+    Progress for each package is kept in the default cache.
+"""
+import os
+import shutil
+import hashlib
+import threading
+from zipfile import ZipFile
+from zipfile import BadZipfile
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import caches
+
+from mpframework.common import log
+from mpframework.common.aws import s3
+from mpframework.common.utils import join_paths
+from mpframework.common.utils.file import create_local_folder
+
+
+_cache = caches['default']
+
+_SETTINGS = settings.MP_CONTENT.get( 'LMS_MOUNT', {} )
+_UPLOADS = _SETTINGS.get( 'UPLOADS', 8 )
+_PART_SIZE = _SETTINGS.get( 'PART_SIZE', 16 * 1024 * 1024 )
+_READ_AHEAD = _SETTINGS.get( 'READ_AHEAD', 4 * 1024 * 1024 )
+_PROGRESS_TIMEOUT = _SETTINGS.get( 'PROGRESS_TIMEOUT', 86400 )
+
+_COPY_SIZE = 1024 * 1024
+
+
+def mount_progress( package_id ):
+    """
+    Returns dict of mount counts for package, or None if not mounting
+    """
+    return _cache.get( _progress_key( package_id ) )
+
+def _progress_key( package_id ):
+    return 'lms_mount_{}'.format( package_id )
+
+
+class PackageMount:
+    """
+    Mount one package archive into its run location.
+    Archive is a local path, or an S3 protected key if local is None.
+    Run location is an S3 protected key prefix, or local folder if no S3.
+    """
+
+    def __init__( self, package_id, archive_key, run_key, local_archive=None,
+                  local_run=None ):
+        self.package_id = package_id
+        self.archive_key = archive_key
+        self.run_key = run_key
+        self.local_archive = local_archive
+        self.local_run = local_run
+        self.cloud = settings.MP_CLOUD
+        self.progress = dict.fromkeys(
+                    ( 'total', 'done', 'skipped', 'failed', 'bytes' ), 0 )
+        self._lock = threading.Lock()
+
+    def run( self ):
+        """
+        Mount archive members; returns list of member names, or None
+        if the archive is not a zip file
+        """
+        source = self._open()
+        try:
+            zip = ZipFile( source, 'r' )
+        except BadZipfile:
+            source.close()
+            return
+        try:
+            members = []
+            for info in zip.infolist():
+                name = _safe_name( info.filename )
+                if name is None:
+                    log.info("SUSPECT - Package member name skipped: %s -> %s",
+                                self.archive_key, info.filename)
+                elif not info.is_dir():
+                    members.append( ( name, info ) )
+            self.progress['total'] = len( members )
+            self._report()
+            log.info2("MOUNTING PACKAGE %s: %s members -> %s", self.package_id,
+                        len(members), self.run_key)
+            if self.cloud:
+                self._upload( zip, members )
+            else:
+                self._extract( zip, members )
+            return [ name for name, _info in members ]
+        finally:
+            zip.close()
+            source.close()
+            _cache.delete( _progress_key( self.package_id ) )
+            log.info2("MOUNTED PACKAGE %s: %s", self.package_id, self.progress)
+
+    def copy_archive( self, name ):
+        """
+        Place non-zip archive in the run location as-is
+        """
+        if self.cloud and not self.local_archive:
+            s3.copy_file( 'protected', self.archive_key, self._key( name ) )
+        elif self.cloud:
+            s3.upload_protected( self.local_archive, self._key( name ) )
+        else:
+            create_local_folder( self.local_run )
+            shutil.copy( self.local_archive, self.local_run )
+
+    def _open( self ):
+        if self.local_archive:
+            return open( self.local_archive, 'rb' )
+        return s3.RangeReader( self.archive_key, _READ_AHEAD )
+
+    def _key( self, name ):
+        return join_paths( self.run_key, name )
+
+    def _extract( self, zip, members ):
+        """
+        Stream members into local run folder
+        """
+        for name, info in members:
+            path = join_paths( self.local_run, name )
+            create_local_folder( os.path.dirname( path ) )
+            with zip.open( info ) as src, open( path, 'wb' ) as dest:
+                shutil.copyfileobj( src, dest, _COPY_SIZE )
+            self._count( 'done', info.file_size )
+
+    def _upload( self, zip, members ):
+        """
+        Push members to S3 with bounded upload pool; the semaphore limits
+        member data read into memory ahead of the uploads
+        """
+        existing = s3.protected_objects( self.run_key + '/' )
+        slots = threading.Semaphore( _UPLOADS * 2 )
+        with ThreadPoolExecutor( max_workers=_UPLOADS,
+                    thread_name_prefix='lms_mount' ) as pool:
+            for name, info in members:
+                key = self._key( name )
+                current = existing.get( key )
+                slots.acquire()
+                try:
+                    if info.file_size <= _PART_SIZE:
+                        data = zip.read( info )
+                        if current and current == ( len( data ),
+                                    hashlib.md5( data ).hexdigest() ):
+                            self._count( 'skipped', len( data ) )
+                            slots.release()
+                            continue
+                        task = pool.submit( self._put, key, data )
+                    else:
+                        task = pool.submit( self._put_large, key, info, current )
+                except Exception:
+                    slots.release()
+                    raise
+                task.add_done_callback( lambda _task: slots.release() )
+
+    def _put( self, key, data ):
+        try:
+            s3.put_protected( key, data )
+            self._count( 'done', len( data ) )
+        except Exception:
+            log.exception("LMS mount put: %s", key)
+            self._count('failed')
+
+    def _put_large( self, key, info, current ):
+        """
+        Pool threads open their own view of the archive so large members
+        are streamed concurrently with the main read
+        """
+        crc = '{:08x}'.format( info.CRC )
+        try:
+            if current and current[0] == info.file_size and \
+                    s3.protected_metadata( key ).get('crc') == crc:
+                self._count( 'skipped', info.file_size )
+                return
+            upload = s3.MultipartUpload( key, _PART_SIZE, protected=True,
+                                         metadata={ 'crc': crc } )
+            try:
+                with self._open() as source:
+                    with ZipFile( source, 'r' ) as zip:
+                        with zip.open( info ) as member:
+                            while True:
+                                data = member.read( _COPY_SIZE )
+                                if not data:
+                                    break
+                                upload.write( data )
+                upload.finish()
+            except Exception:
+                upload.abort()
+                raise
+            self._count( 'done', info.file_size )
+        except Exception:
+            log.exception("LMS mount multipart: %s", key)
+            self._count('failed')
+
+    def _count( self, name, size=0 ):
+        with self._lock:
+            self.progress[ name ] += 1
+            self.progress['bytes'] += size
+        self._report()
+
+    def _report( self ):
+        _cache.set( _progress_key( self.package_id ), dict( self.progress ),
+                    _PROGRESS_TIMEOUT )
+
+def _safe_name( name ):
+    """
+    Member path relative to run location, or None if it would escape it
+    """
+    name = name.replace( '\\', '/' )
+    parts = [ part for part in name.split('/') if part not in ( '', '.' ) ]
+    if not parts or name.startswith('/') or '..' in parts or ':' in parts[0]:
+        return
+    return '/'.join( parts ) + ( '/' if name.endswith('/') else '' )
@@ -40,6 +40,7 @@ def package_leaf_cleanup( log, sandbox, commit, limit, constraint ):
 
         log.info("%s %s", "CLEANING" if commit else "WOULD CLEAN", package)
         try:
+            _remove_files( log, package, commit )
             if commit:
 
                 package.delete()
@@ -54,3 +55,13 @@ def package_leaf_cleanup( log, sandbox, commit, limit, constraint ):
 
     log.info("PACKAGE LEAF CLEANUP COMPLETE")
 
+def _remove_files( log, package, commit ):
+    """
+    Remove package run files, or report what would be removed
+    """
+    bulk = package.remove_files( dry_run=not commit )
+    if bulk:
+        removed = len( bulk.manifest ) if bulk.dry_run else bulk.counts['deleted']
+        log.info("&nbsp;&nbsp;%s %s files", "Removed" if commit else "Would remove", removed)
+        if bulk.counts['failed']:
+            log.info("&nbsp;&nbsp;Failed removing %s files", bulk.counts['failed'])
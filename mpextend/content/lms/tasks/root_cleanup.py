@@ -5,6 +5,7 @@
 
 from ..models import PackageRoot
 from . import task_queryset
+from .leaf_cleanup import _remove_files
 
 
 def package_root_cleanup( log, sandbox, commit, limit, constraint ):
@@ -28,6 +29,8 @@ def package_root_cleanup( log, sandbox, commit, limit, constraint ):
 
         log.info("%s %s", "CLEANING" if commit else "WOULD CLEAN", root)
         try:
+            for package in root.packages.all():
+                _remove_files( log, package, commit )
             if commit:
 
                 root.delete()
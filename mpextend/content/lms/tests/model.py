@@ -5,13 +5,21 @@
 
 import os
 import time
+import hashlib
+import tempfile
+from zipfile import ZipFile
+from unittest import mock
 
 from django.conf import settings
 from django.core.files.uploadedfile import UploadedFile
 
+from mpframework.common.aws import s3
 from mpframework.testing.framework import ModelTestCase
 from mpframework.testing.framework import requires_normal_db
 
+from ..mount import PackageMount
+from ..mount import mount_progress
+from ..mount import _safe_name
 from ..models import Package
 from ..models import PackageRoot
 
@@ -24,6 +32,13 @@ class ModelTests( ModelTestCase ):
         run_name = Package._run_name("test/archive/test path.zip")
         self.assertTrue( "test path" in run_name )
 
+        # Member names can't escape the run location
+        self.assertEqual( _safe_name('a/./b\\index.html'), 'a/b/index.html' )
+        self.assertEqual( _safe_name('res/'), 'res/' )
+        self.assertIsNone( _safe_name('../outside.html') )
+        self.assertIsNone( _safe_name('/abs/file.html') )
+        self.assertIsNone( _safe_name('C:/file.html') )
+
         # Get package from test data
         package = Package.objects.get( id=1 )
         self.l( package )
@@ -48,6 +63,55 @@ class ModelTests( ModelTestCase ):
 
         self.assertTrue( package.lms_type == 'A' )
 
+    def test_mount(self):
+
+        with tempfile.TemporaryDirectory() as folder:
+            archive = os.path.join( folder, 'package.zip' )
+            with ZipFile( archive, 'w' ) as zip:
+                zip.writestr( 'index.html', '<html></html>' )
+                zip.writestr( 'res/', '' )
+                zip.writestr( 'res/app.js', 'var a = 1;' )
+                zip.writestr( '../outside.html', 'escape' )
+
+            self.l("Extracting package to local run folder")
+            run = os.path.join( folder, 'run' )
+            mount = PackageMount( 'test_mount', 'package.zip', 'run',
+                                  local_archive=archive, local_run=run )
+            mount.cloud = False
+            members = mount.run()
+            self.assertEqual( sorted( members ), [ 'index.html', 'res/app.js' ] )
+            self.assertTrue( os.path.exists( os.path.join( run, 'res', 'app.js' ) ) )
+            self.assertFalse( os.path.exists( os.path.join( folder, 'outside.html' ) ) )
+            self.assertEqual( mount.progress['total'], 2 )
+            self.assertEqual( mount.progress['done'], 2 )
+            self.assertEqual( mount.progress['bytes'], 23 )
+            self.assertIsNone( mount_progress('test_mount') )
+
+            self.l("Uploading package, skipping unchanged members")
+            index = b'<html></html>'
+            existing = { 'run/index.html': ( len(index), hashlib.md5(index).hexdigest() ) }
+            put = []
+            mount = PackageMount( 'test_mount', 'package.zip', 'run',
+                                  local_archive=archive )
+            mount.cloud = True
+            with mock.patch.multiple( s3,
+                        protected_objects=lambda prefix: existing,
+                        put_protected=lambda key, data: put.append( key ) ):
+                members = mount.run()
+            self.assertEqual( len( members ), 2 )
+            self.assertEqual( put, [ 'run/res/app.js' ] )
+            self.assertEqual( mount.progress['skipped'], 1 )
+            self.assertEqual( mount.progress['done'], 1 )
+            self.assertEqual( mount.progress['failed'], 0 )
+
+            self.l("Non-zip archive is not mounted")
+            other = os.path.join( folder, 'package.pdf' )
+            with open( other, 'wb' ) as f:
+                f.write( b'%PDF-1.4' )
+            mount = PackageMount( 'test_mount', 'package.pdf', 'run',
+                                  local_archive=other, local_run=run )
+            self.assertIsNone( mount.run() )
+
     @requires_normal_db
     def test_create(self):
         """
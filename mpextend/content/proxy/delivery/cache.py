@@ -0,0 +1,244 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Shared cache for proxy responses
+
+    Proxy responses configured with response_cache_share are cached as
+    status, a whitelist of headers, and body bytes, rather than pickled
+    Django responses, under a hashed key.
+    Upstream Cache-Control and validators are honored; stale entries with
+    an ETag or Last-Modified are revalidated with a conditional request.
+
+    Small bodies are shared across servers in the default cache. If a
+    disk path is configured, larger bodies are kept in a local disk tier
+    bounded by total size with LRU eviction. Each process has its own
+    folder under the disk path, with DISK_SIZE bytes, so disk use is
+    bounded by processes times DISK_SIZE.
+"""
+import os
+import re
+import time
+import shutil
+import threading
+from hashlib import sha1
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from mpframework.common import log
+from mpframework.common.utils.collections import LruCache
+
+
+_cache = caches['default']
+
+_SETTINGS = settings.MP_PROXY.get( 'RESPONSE_CACHE', {} )
+
+# Default freshness if upstream doesn't provide max-age, and how long
+# entries are kept for revalidation
+_FRESH = _SETTINGS.get( 'FRESH', 3600 )
+_TIMEOUT = _SETTINGS.get( 'TIMEOUT', 86400 )
+
+# Largest body placed in the shared cache
+_SHARED_MAX = _SETTINGS.get( 'SHARED_MAX_BYTES', 256 * 1024 )
+
+# Optional local disk tier for larger bodies; size is per process
+_DISK_PATH = _SETTINGS.get('DISK_PATH')
+_DISK_MAX = _SETTINGS.get( 'DISK_MAX_BYTES', 16 * 1024 * 1024 )
+_DISK_SIZE = _SETTINGS.get( 'DISK_SIZE', 1024 * 1024 * 1024 )
+
+# Headers kept with cached responses; custom response headers are added
+# when each cached response is delivered
+_HEADERS = (
+    'content-type',
+    'content-language',
+    'content-disposition',
+    'cache-control',
+    'expires',
+    'etag',
+    'last-modified',
+    'access-control-allow-origin',
+    )
+
+
+def proxy_cache_key( sandbox_id, url, cache_options ):
+    """
+    Hash of the url and all values that could change the response
+    """
+    key = sha1( '{}{}'.format( url, sorted( cache_options.items() ) ).encode() )
+    return 'PROXY_s{}_{}'.format( sandbox_id, key.hexdigest() )
+
+def proxy_cache_get( key ):
+    """
+    Return cached entry, or None; body may be in the disk tier
+    """
+    entry = _cache.get( key )
+    if entry is None and _DISK_PATH:
+        entry = _disk_index.get( key )
+        if entry:
+            body = _disk_read( key )
+            if body is None:
+                _disk_index.pop( key )
+                return
+            entry = dict( entry, body=body )
+    return entry
+
+def proxy_cache_set( key, response, upstream ):
+    """
+    Cache a final Django response, based on upstream caching headers.
+    Returns the cached entry, or None if not cacheable.
+    """
+    if response is None or response.streaming or response.status_code != 200:
+        return
+    control = _cache_control( upstream.headers.get( 'cache-control', '' ) )
+    if 'no-store' in control or 'private' in control:
+        return
+    max_age = control.get( 's-maxage', control.get('max-age') )
+    fresh = _FRESH if max_age is None else max_age
+    if 'no-cache' in control:
+        fresh = 0
+    entry = {
+        'status': response.status_code,
+        'headers': { k: v for k, v in response.items() if k.lower() in _HEADERS },
+        'body': response.content,
+        'etag': upstream.headers.get('etag'),
+        'modified': upstream.headers.get('last-modified'),
+        'expires': time.time() + fresh,
+        }
+    if not fresh and not ( entry['etag'] or entry['modified'] ):
+        return
+    _store( key, entry )
+    return entry
+
+def proxy_cache_refresh( key, entry, upstream ):
+    """
+    Revalidated entry (304 from upstream) is fresh again
+    """
+    control = _cache_control( upstream.headers.get( 'cache-control', '' ) )
+    max_age = control.get( 's-maxage', control.get('max-age') )
+    entry['expires'] = time.time() + ( _FRESH if max_age is None else max_age )
+    _store( key, entry )
+
+def is_fresh( entry ):
+    return entry['expires'] > time.time()
+
+def revalidate_headers( entry ):
+    """
+    Conditional request headers for a stale entry, or None if the entry
+    can't be revalidated
+    """
+    rv = {}
+    if entry.get('etag'):
+        rv['If-None-Match'] = entry['etag']
+    if entry.get('modified'):
+        rv['If-Modified-Since'] = entry['modified']
+    return rv or None
+
+def cached_response( entry ):
+    """
+    Django response from cache entry
+    """
+    rv = HttpResponse( entry['body'], status=entry['status'] )
+    for key, value in entry['headers'].items():
+        rv[ key ] = value
+    return rv
+
+def _store( key, entry ):
+    size = len( entry['body'] )
+    if size <= _SHARED_MAX:
+        _cache.set( key, entry, _TIMEOUT )
+    elif _DISK_PATH and size <= _DISK_MAX:
+        if _disk_write( key, entry['body'] ):
+            meta = dict( entry )
+            meta.pop('body')
+            _disk_index.set( key, meta, size )
+    else:
+        log.debug("PROXY CACHE skip large: %s -> %s", key, size)
+
+def _cache_control( value ):
+    rv = {}
+    for directive in value.lower().split(','):
+        name, _, arg = directive.strip().partition('=')
+        if name:
+            rv[ name ] = int( arg ) if _digits.match( arg ) else arg
+    return rv
+
+_digits = re.compile( r'^\d+$' )
+
+#--------------------------------------------------------------------
+# Local disk tier; each process manages its own LRU index of files in
+# a folder named with its pid. When a process first uses the tier it
+# removes folders left by processes that are gone (e.g., from before
+# a restart), so their files aren't orphaned.
+
+def _disk_file( key ):
+    return os.path.join( _disk_folder(), key )
+
+def _disk_folder():
+    global _disk_pid
+    pid = os.getpid()
+    folder = os.path.join( _DISK_PATH, str( pid ) )
+    if _disk_pid != pid:
+        # Index may have been inherited from a parent process
+        _disk_pid = pid
+        _disk_index.clear()
+        _disk_cleanup( pid )
+        os.makedirs( folder, exist_ok=True )
+    return folder
+
+_disk_pid = None
+
+def _disk_cleanup( pid ):
+    """
+    Remove this process's old folder, folders of processes that are
+    not running, and files from before folders were used
+    """
+    try:
+        names = os.listdir( _DISK_PATH )
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join( _DISK_PATH, name )
+        if name.isdigit():
+            if int( name ) != pid and _process_running( int( name ) ):
+                continue
+            shutil.rmtree( path, ignore_errors=True )
+        elif name.startswith('PROXY_'):
+            try:
+                os.remove( path )
+            except OSError:
+                pass
+    log.info2("PROXY CACHE disk cleanup: %s", _DISK_PATH)
+
+def _process_running( pid ):
+    try:
+        os.kill( pid, 0 )
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _disk_read( key ):
+    try:
+        with open( _disk_file( key ), 'rb' ) as f:
+            return f.read()
+    except OSError:
+        return
+
+def _disk_write( key, body ):
+    try:
+        temp = '{}.{}'.format( _disk_file( key ), threading.get_ident() )
+        with open( temp, 'wb' ) as f:
+            f.write( body )
+        os.replace( temp, _disk_file( key ) )
+        return True
+    except OSError:
+        log.exception("PROXY CACHE disk write: %s", key)
+
+def _disk_evict( key, _meta ):
+    try:
+        os.remove( _disk_file( key ) )
+    except OSError:
+        pass
+
+_disk_index = LruCache( _SETTINGS.get( 'DISK_ENTRIES', 4096 ), _DISK_SIZE,
+                        on_evict=_disk_evict )
@@ -1,10 +1,17 @@
 #--- Mesa Platform, Copyright 2021 Vueocity, LLC
 """
     Calls to external endpoints made from here with requests library
+
+    Calls share one requests Session per process, whose adapter keeps
+    connection pools for each proxy host, so repeated calls to the same
+    host reuse connections instead of paying TCP/TLS setup each time.
 """
 import re
+import threading
 import requests
-from django.core.cache import caches
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from django.conf import settings
 from django.template.response import TemplateResponse
 
 from mpframework.common import log
@@ -15,9 +22,14 @@ from mpframework.content.mpcontent.delivery import parse_session_path
 from . import full_url
 from .request import request_options
 from .response import fixup_response
-
-
-_cache = caches['default']
+from .response import add_response_headers
+from .cache import proxy_cache_key
+from .cache import proxy_cache_get
+from .cache import proxy_cache_set
+from .cache import proxy_cache_refresh
+from .cache import is_fresh
+from .cache import revalidate_headers
+from .cache import cached_response
 
 
 def get_proxy_response( request, orig_url, options ):
@@ -96,33 +108,50 @@ def _get_response( request, url, options, orig_host, shared_caching ):
 
     # Check the cache if caching configured for this url
     cache_key = None
+    entry = None
     if shared_caching:
         cache_key = _shared_cache_key( request, url, roptions, options )
         if cache_key:
-            response = _cache.get( cache_key )
-    if response:
+            entry = proxy_cache_get( cache_key )
+    if entry and is_fresh( entry ):
         log.info2("PROXY CACHE: %s -> %s", request.mpipname, cache_key)
+        response = cached_response( entry )
+        add_response_headers( request, response, options )
 
     # If no cache call the external server
     else:
+        # Stale entries are revalidated if possible
+        revalidate = entry and revalidate_headers( entry )
+        if revalidate:
+            roptions['headers'] = dict( roptions.get( 'headers', {} ), **revalidate )
+
         if log.info_on() > 1:
             rt = request.mptiming
             log.debug("PROXY CALL %s, %s: %s %s %s c%s", rt, request.mpipname,
                         request.method, url, str(roptions), str(cache_key))
             rt.mark()
         try:
-            response = requests.request( request.method, url, **roptions )
+            upstream = _session().request( request.method, url,
+                                            stream=True, **roptions )
 
             log.debug("PROXY RETURN %s, %s: %s %s", request.mptiming, request.mpipname,
-                        response, url)
-
-            response = fixup_response( request, response, options, orig_host )
+                        upstream, url)
+
+            if revalidate and upstream.status_code == 304:
+                log.info2("PROXY CACHE revalidated: %s -> %s", request.mpipname, cache_key)
+                upstream.close()
+                proxy_cache_refresh( cache_key, entry, upstream )
+                response = cached_response( entry )
+                add_response_headers( request, response, options )
+            else:
+                # Responses to be cached need content in the response
+                response = fixup_response( request, upstream, options, orig_host,
+                                            stream=not cache_key )
 
-            # Cache the Django HttpResponse
-            # Proxy responses should only be cached if there will be NO changes
-            # in response from any header information sent to the external server
-            if cache_key and response and response.status_code in [ 200 ]:
-                _cache.set( cache_key, response )
+                # Proxy responses should only be cached if there will be NO changes
+                # in response from any header information sent to the external server
+                if cache_key:
+                    proxy_cache_set( cache_key, response, upstream )
 
             if log.info_on() > 1:
                 log.info2("PROXY(%s) %s -> %s %s %s", rt.log_recent(), request.mpipname,
@@ -141,6 +170,29 @@ def _get_response( request, url, options, orig_host, shared_caching ):
                                 'timeout': roptions.get('timeout') })
     return response
 
+def _session():
+    """
+    Lazily create the shared session, after any process forking.
+    Cookies from proxy servers are blocked, as they would otherwise be
+    shared by all users; proxy cookies are not supported.
+    """
+    global _proxy_session
+    if not _proxy_session:
+        with _session_lock:
+            if not _proxy_session:
+                session = requests.Session()
+                session.cookies.set_policy( DefaultCookiePolicy( allowed_domains=[] ) )
+                adapter = HTTPAdapter(
+                            pool_connections=settings.MP_PROXY.get( 'POOL_HOSTS', 32 ),
+                            pool_maxsize=settings.MP_PROXY.get( 'POOL_SIZE', 8 ) )
+                session.mount( 'http://', adapter )
+                session.mount( 'https://', adapter )
+                _proxy_session = session
+    return _proxy_session
+
+_proxy_session = None
+_session_lock = threading.Lock()
+
 def _shared_cache_key( request, url, roptions, options ):
     """
     Used for responses from proxy that can be safely cached depending on options.
@@ -162,7 +214,7 @@ def _shared_cache_key( request, url, roptions, options ):
     if options.get('cache_user'):
         cache_options['user'] = request.user.pk
 
-    return "PROXY_s{}_{}_{}".format( request.sandbox.pk, url, cache_options )
+    return proxy_cache_key( request.sandbox.pk, url, cache_options )
 
 def _host( url ):
     # Returns url path without scheme, if exists
@@ -0,0 +1,234 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Compiled proxy response rules
+
+    The response_text_replace options are compiled once per process into
+    a rule program, so path and replacement regexes are not recompiled
+    for every response.
+    Replacement templates ({session_url}, {host_root}, etc.) are expanded
+    once per access session, and consecutive literal replacements that
+    can't affect each other are combined into one alternation regex, so
+    large responses are scanned once instead of once per rule.
+"""
+import re
+from hashlib import sha1
+from django.conf import settings
+from django.urls import reverse
+
+from mpframework.common import log
+from mpframework.common.utils import join_urls
+from mpframework.common.utils.collections import LruCache
+from mpframework.content.mpcontent.delivery import parse_session_path
+
+from . import full_url
+
+
+REGEX_PREFIX = '__re__'
+
+
+def proxy_rules( options ):
+    """
+    Returns the compiled rule program for proxy options
+    """
+    replace = options.get( 'response_text_replace', {} )
+    key = sha1( repr(( replace, options.get('tags'),
+                       options.get('host_cache_id') )).encode() ).hexdigest()
+    rv = _programs.get( key )
+    if rv is None:
+        rv = ProxyRules( replace, options )
+        _programs.set( key, rv )
+    return rv
+
+_programs = LruCache( settings.MP_PROXY.get( 'RULE_PROGRAMS', 128 ) )
+
+def host_url( request, *path ):
+    """
+    Returns URL to access proxy URL through the platform
+    """
+    return full_url( request, request.host, *path ).strip('/')
+
+
+class ProxyRules:
+    """
+    Path-matched fixups from one set of proxy options
+    """
+
+    def __init__( self, replace, options ):
+        self.fixups = []
+        for name, fixup in replace.items():
+            try:
+                path_match = re.compile( fixup['path_regex'],
+                                            re.VERBOSE | re.IGNORECASE )
+                self.fixups.append( ( path_match, ProxyFixup( name, fixup, options ) ) )
+            except Exception as e:
+                log.info("CONFIG - Proxy fixup exception: %s -> %s, %s",
+                                e, name, fixup)
+
+    def match( self, request ):
+        """
+        Returns the FIRST fixup that matches the request path, if any
+        """
+        for path_match, fixup in self.fixups:
+            if path_match.search( request.path ):
+                return fixup
+
+
+class ProxyFixup:
+    """
+    Compiled replacements for one fixup; request-dependent templates
+    are finished and combined into passes for each session.
+    """
+
+    def __init__( self, name, fixup, options ):
+        self.name = name
+        self.encoding = fixup.get('encoding')
+        self.rules = []
+        self.uses_path = False
+        for match, replacement in ( fixup.get('replacements') or {} ).items():
+            try:
+                rule = _compile_rule( match, replacement, options )
+                self.uses_path = self.uses_path or rule[2] in _PATH_KINDS
+                self.rules.append( rule )
+            except Exception as e:
+                log.info("CONFIG - Proxy rule bad: %s -> %s, %s",
+                                e, match, replacement)
+        self._passes = LruCache( settings.MP_PROXY.get( 'RULE_SESSIONS', 64 ) )
+
+    def apply( self, request, html, orig_host ):
+        """
+        Run the replacement passes over response html
+        """
+        session, path = parse_session_path( request.path )
+        key = ( orig_host, session, request.scheme, request.host,
+                request.path if self.uses_path else '' )
+        passes = self._passes.get( key )
+        if passes is None:
+            passes = self._session_passes( request, session, path, orig_host )
+            self._passes.set( key, passes )
+        for fn in passes:
+            try:
+                html = fn( html )
+            except Exception as e:
+                log.info("CONFIG - Proxy rule bad: %s: %s -> %s",
+                                request.mpipname, e, self.name)
+        return html
+
+    def _session_passes( self, request, session, path, orig_host ):
+        """
+        Expand templates for the session and build replacement passes.
+        Literal replacements are grouped only while no match can be
+        affected by an earlier replacement in the group, so the single
+        pass gives the same result as replacing in order.
+        """
+        rv = []
+        literals = {}
+        for match, replacement, kind in self.rules:
+            try:
+                replacement = _expand( replacement, kind, request, session, path )
+            except Exception as e:
+                log.info("CONFIG - Proxy rule bad: %s: %s -> %s, %s",
+                                request.mpipname, e, match, replacement)
+                continue
+            if match is None:
+                match = orig_host
+                if not match:
+                    continue
+            if isinstance( match, str ):
+                if literals and _literal_conflict( literals, match, replacement ):
+                    rv.append( _literal_pass( literals ) )
+                    literals = {}
+                literals[ match ] = replacement
+            else:
+                if literals:
+                    rv.append( _literal_pass( literals ) )
+                    literals = {}
+                rv.append( _regex_pass( match, replacement ) )
+        if literals:
+            rv.append( _literal_pass( literals ) )
+        log.debug("PROXY rules compiled %s: %s -> %s passes", request.mpipname,
+                    self.name, len(rv))
+        return rv
+
+def _compile_rule( match, replacement, options ):
+    """
+    Returns (match, replacement, kind) with option-only templates expanded.
+    Match is None for the original host, a string for literal swaps,
+    or a compiled regex.
+    """
+    # General replacement tags
+    for m in re.finditer( _tag_match, replacement ):
+        tag = m.group(1)
+        value = options['tags'][ tag ]
+        tag_replacement = {}
+        tag_replacement[ 'tag_{}'.format( tag ) ] = value
+        replacement = replacement.format( **tag_replacement )
+
+    # Tag for adding url for caching
+    if '{host_cache}' in replacement:
+        replacement = replacement.format( host_cache=_host_cache(
+                                            options['host_cache_id'] ) )
+
+    # Only one request template is expanded, in this order
+    kind = None
+    for name in _REQUEST_KINDS:
+        if '{' + name + '}' in replacement:
+            kind = name
+            break
+
+    # Replace host with MPF request host
+    if 'replace_host' == match:
+        match = None
+    elif match.startswith( REGEX_PREFIX ):
+        match = re.compile( match.replace( REGEX_PREFIX, '' ) )
+
+    return match, replacement, kind
+
+_REQUEST_KINDS = ( 'host_root', 'host_proxy', 'session_url', 'path_url' )
+_PATH_KINDS = ( 'host_proxy', 'path_url' )
+
+def _expand( replacement, kind, request, session, path ):
+    if 'host_root' == kind:
+        return replacement.format( host_root=host_url( request ) )
+    if 'host_proxy' == kind:
+        return replacement.format( host_proxy=host_url( request, request.path ) )
+    if 'session_url' == kind:
+        return replacement.format( session_url=session )
+    if 'path_url' == kind:
+        return replacement.format( path_url=path )
+    return replacement
+
+def _literal_conflict( literals, match, replacement ):
+    """
+    True if match could be created or consumed by replacements already
+    in the group, or if any overlap with their matches
+    """
+    if not replacement:
+        return True
+    for m, r in literals.items():
+        if not r or _overlaps( match, m ) or _overlaps( match, r ):
+            return True
+
+def _overlaps( a, b ):
+    if a in b or b in a:
+        return True
+    for k in range( 1, min( len(a), len(b) ) ):
+        if a[ -k: ] == b[ :k ] or b[ -k: ] == a[ :k ]:
+            return True
+    return False
+
+def _literal_pass( literals ):
+    if len( literals ) == 1:
+        ( match, replacement ), = literals.items()
+        return lambda html: html.replace( match, replacement )
+    table = dict( literals )
+    pattern = re.compile( '|'.join( re.escape( m ) for m in table ) )
+    return lambda html: pattern.sub( lambda m: table[ m.group(0) ], html )
+
+def _regex_pass( match, replacement ):
+    return lambda html: match.sub( replacement, html )
+
+def _host_cache( cache_id ):
+    proxy_url = reverse( 'protected_proxy_cache', kwargs={ 'cache_id': cache_id } )
+    return join_urls( '{{host_root}}/{}'.format( proxy_url ) )
+
+_tag_match = re.compile( r'{tag_(.+)}', re.IGNORECASE )
@@ -2,9 +2,14 @@
 """
     Optimized DB access for data organized by users; this is used
     for the bulk of reporting.
+
+    Usage rows for a block are read in pages ordered by user, and
+    users are yielded as soon as their usage is complete, so only one
+    page of rows and the current user's usage are held in memory.
 """
 from collections import defaultdict
 from django.conf import settings
+from django.db.models import Q
 from django.db.utils import OperationalError
 from django.contrib.contenttypes.models import ContentType
 
@@ -21,6 +26,28 @@ def define_user_blocks( sandbox_id, size, start=None ):
     """
     Return list of id blocks for all sandbox users active since start
     """
+    user_ids = _users_qs( sandbox_id, start ).values_list( 'id', flat=True )
+    return get_blocks( user_ids, size )
+
+def define_apa_blocks( sandbox_id, size ):
+    """
+    Return list of ( first, last ) id ranges for blocks of activated APAs
+    """
+    apa_ids = list( _apas_qs( sandbox_id ).order_by('id')
+                        .values_list( 'id', flat=True ) )
+    return [ ( ids[0], ids[-1] ) for ids in get_blocks( apa_ids, size ) ]
+
+def apa_block_user_ids( sandbox_id, apa_range, start=None ):
+    """
+    Return ids of users whose account has an APA in the id range
+    """
+    account_ids = _apas_qs( sandbox_id ).filter( id__range=apa_range )\
+                    .values( 'account_id' )
+    user_qs = _users_qs( sandbox_id, start )\
+                    .filter( account_user__primary_account_id__in=account_ids )
+    return list( user_qs.values_list( 'id', flat=True ) )
+
+def _users_qs( sandbox_id, start ):
     user_qs = mpUser.objects.mpusing('read_replica')\
                    .filter( _sandbox_id=sandbox_id )\
                    .filter( _staff_level__isnull=True )\
@@ -28,26 +55,30 @@ def define_user_blocks( sandbox_id, size, start=None ):
     if start:
         start_date = timedelta_past( days=int(start) )
         user_qs = user_qs.filter( tracking__last_update__gte=start_date )
-    user_ids = user_qs.values_list( 'id', flat=True )
-    return _get_blocks( user_ids, size )
+    return user_qs
+
+def _apas_qs( sandbox_id ):
+    return APA.objects.mpusing('read_replica')\
+                .filter( sandbox_id=sandbox_id, is_activated=True )
 
 def get_account_user_blocks( account, size ):
     """
     Return list of id blocks for all group account users
     """
     user_ids = account.group_account.users.all().values_list( 'user_id', flat=True )
-    return _get_blocks( user_ids, size )
+    return get_blocks( user_ids, size )
 
-def _get_blocks( ids, size ):
+def get_blocks( ids, size ):
     """
     Break down list of ids into a list of lists chunked by size
     """
     return [ ids[ pos:pos + size ] for pos in
                 range( 0, len( ids ), size ) ]
 
-def get_user_block_info( sandbox_id, user_ids=None, timing=None, detailed=False ):
+def iter_user_block( sandbox_id, user_ids=None, timing=None, apa_range=None ):
     """
-    Returns dict with a block of user objects indexed by user id
+    Yields block user objects in id order.
+    If apa_range is provided, only APAs in the id range are added.
     These user objects include additional dicts and lists with expensive
     information related to usage, accounts, and apas for all user reporting.
 
@@ -65,19 +96,20 @@ def get_user_block_info( sandbox_id, user_ids=None, timing=None, detailed=False
                   .select_related( 'account_user',
                                    'account_user__primary_account',
                                    'tracking' )\
-                  .filter( _sandbox_id=sandbox_id )
+                  .filter( _sandbox_id=sandbox_id )\
+                  .order_by('id')
     if user_ids:
         user_qs = user_qs.filter( id__in=user_ids )
 
-    users = {}
+    users = []
     grp_account_ids = set()
     indv_account_ids = set()
 
-    # Make first pass through the users to setup user dict and populate account info
+    # Make first pass through the users to setup user list and populate account info
     for user in user_qs.iterator():
         log.debug_on() and log.detail3("adding user: %s -> %s", user.pk, user.email)
 
-        users[ user.pk ] = user
+        users.append( user )
 
         # Add account to user and account sets
         user.account = None
@@ -106,20 +138,26 @@ def get_user_block_info( sandbox_id, user_ids=None, timing=None, detailed=False
 
     log.debug_on() and log.debug2("ADDED BLOCK USERS: %s -> %s users", timing, len(users))
 
-    # Get APA and useritem instances for every account
-    _, apas_account = _get_users_apas( sandbox_id, user_ids,
-                                       grp_account_ids, indv_account_ids )
-    tops, items, mins = _get_users_useritems( sandbox_id, user_ids )
+    # Get APA instances for every account
+    _, apas_account = _get_users_apas( sandbox_id, grp_account_ids,
+                                       indv_account_ids, apa_range )
     log.debug_on() and log.debug2("PREPARED USER INFO: %s -> %s users", timing, len(users))
 
-    # Make second pass to add usage and APA information
-    for user in users.values():
+    # Make second pass to add usage and APA information as each user's
+    # usage is read; both users and usage are in user id order
+    usage = _iter_users_useritems( sandbox_id, user_ids )
+    next_usage = next( usage, None )
+    for user in users:
         log.debug_on() and log.detail3("adding user info: %s -> %s", user.pk, user.email)
 
         # Usage information
-        user.usertops = tops[ user.pk ]
-        user.useritems = items[ user.pk ]
-        user.total_mins = mins[ user.pk ]
+        while next_usage and next_usage[0] < user.pk:
+            next_usage = next( usage, None )
+        if next_usage and next_usage[0] == user.pk:
+            _, user.usertops, user.useritems, user.total_mins = next_usage
+            next_usage = next( usage, None )
+        else:
+            user.usertops, user.useritems, user.total_mins = [], [], 0
 
         # APAs, indexed by account
         user_apas = {}
@@ -137,19 +175,20 @@ def get_user_block_info( sandbox_id, user_ids=None, timing=None, detailed=False
                    user_apas[ apa.pk ] = apa
         user.apas = user_apas
 
-    log.debug_on() and log.debug("USER BLOCK PREPARED: %s -> %s users", timing, len(users))
-    return {
-        'users': users,
-        'ga_ids': grp_account_ids,
-        'ia_ids': indv_account_ids,
-        }
+        yield user
+
+    log.debug_on() and log.debug("USER BLOCK DONE: %s -> %s users", timing, len(users))
 
-def _get_users_useritems( sandbox_id, user_ids ):
+def _iter_users_useritems( sandbox_id, user_ids ):
     """
-    Return dict of all usage rows for both top and sub items
-    for the given users.
+    Yields ( user_id, tops, items, minutes ) with usage rows for both top
+    and sub items for each user with usage, in user id order.
     Tops returns top-level collections AND items used with no collection.
-    If false, returns items that are inside collections.
+    Items are inside collections.
+
+    Rows are read in pages keyed on ( user_id, id ) rather than holding
+    a cursor open for the whole block, since MySQL drivers buffer
+    entire result sets.
 
     HACK - for performance, only the information needed for useritems is
     retrieved, and it is placed in a dict instead of models, and different
@@ -169,48 +208,76 @@ def _get_users_useritems( sandbox_id, user_ids ):
     qs = UserItem.objects.mpusing('read_replica')\
                 .select_related( *_ui_related )\
                 .filter( **filter )\
+                .order_by( 'cu__user_id', 'id' )\
                 .values( *_ui_values )
-    usertops = defaultdict( list )
-    useritems = defaultdict( list )
-    totalmins = defaultdict( int )
-    for ui in qs.iterator():
-        try:
+    ctypes = _ctype_models()
+
+    current = None
+    last = None
+    rows = 0
+    while True:
+        page_qs = qs
+        if last:
+            page_qs = qs.filter( Q( cu__user_id__gt=last[0] ) |
+                                 Q( cu__user_id=last[0], id__gt=last[1] ) )
+        page = list( page_qs[ :_USAGE_PAGE ] )
+        for ui in page:
             userid = ui['cu__user_id']
-            tops = not bool( ui['top_tree_id'] )
-            ui['ctype'] = ContentType.objects.get_for_id(
-                        ui['item___django_ctype_id'] ).model
-            ui['is_tree'] = bool( 'tree' == ui['ctype'] )
-            log.debug_on() and log.detail3("adding user%s %s: %s -> %s",
-                        "top" if tops else "item", ui['id'], ui['ctype'], userid)
-
-            # Make convenient short names for reporting
-            ui['name'] = ui['item___name']
-            ui['tag'] = ui['item__tag'] or ''
-            ui['internal'] = ui['item__internal_tags'] or ''
-            ui['is_complete'] = ui['progress'] in 'CA'
-            ui['minutes_used'] = seconds_to_minutes( ui['seconds_used'] )
-            ui['portal_type'] = ui['item__portal_type___name'] or ''
-            if ui['is_tree']:
-                totalmins[ userid ] += ui['minutes_used']
-            else:
-                ui['top_id'] = ui['item_id'] if tops else ui['top_tree__item_id']
-                ui['top_name'] = '' if tops else ui['top_tree__item___name']
-                ui['size'] = ui['item__size'] or 0
-                ui['points'] = ui['item___points'] or 1
-
-            (usertops if tops else useritems)[ userid ].append( ui )
-
-        except OperationalError:
-            # Most likely DB connection needs reset, let caller manage
-            raise
-        except Exception:
-            log.exception_quiet("Exception packing useritem: %s", ui )
-            if settings.MP_TESTING:
+            if not current or current[0] != userid:
+                if current:
+                    yield tuple( current )
+                current = [ userid, [], [], 0 ]
+            try:
+                tops = not bool( ui['top_tree_id'] )
+                ui['ctype'] = ctypes[ ui['item___django_ctype_id'] ]
+                ui['is_tree'] = bool( 'tree' == ui['ctype'] )
+                log.debug_on() and log.detail3("adding user%s %s: %s -> %s",
+                            "top" if tops else "item", ui['id'], ui['ctype'], userid)
+
+                # Make convenient short names for reporting
+                ui['name'] = ui['item___name']
+                ui['tag'] = ui['item__tag'] or ''
+                ui['internal'] = ui['item__internal_tags'] or ''
+                ui['is_complete'] = ui['progress'] in 'CA'
+                ui['minutes_used'] = seconds_to_minutes( ui['seconds_used'] )
+                ui['portal_type'] = ui['item__portal_type___name'] or ''
+                if ui['is_tree']:
+                    current[3] += ui['minutes_used']
+                else:
+                    ui['top_id'] = ui['item_id'] if tops else ui['top_tree__item_id']
+                    ui['top_name'] = '' if tops else ui['top_tree__item___name']
+                    ui['size'] = ui['item__size'] or 0
+                    ui['points'] = ui['item___points'] or 1
+
+                current[ 1 if tops else 2 ].append( ui )
+
+            except OperationalError:
+                # Most likely DB connection needs reset, let caller manage
                 raise
+            except Exception:
+                log.exception_quiet("Exception packing useritem: %s", ui )
+                if settings.MP_TESTING:
+                    raise
+
+        rows += len( page )
+        if len( page ) < _USAGE_PAGE:
+            break
+        last = ( page[-1]['cu__user_id'], page[-1]['id'] )
+        spool_breathe()
 
-    log.debug_on() and log.debug("Got content usage, users in tops and items: %s, %s",
-                                len(usertops), len(useritems))
-    return usertops, useritems, totalmins
+    if current:
+        yield tuple( current )
+
+    log.debug_on() and log.debug("Got content usage rows: %s", rows)
+
+_USAGE_PAGE = settings.MP_REPORT.get( 'USAGE_PAGE_SIZE', 2000 )
+
+def _ctype_models():
+    """
+    Map of all content type ids to model names, loaded once per block
+    instead of looking up each usage row
+    """
+    return dict( ContentType.objects.values_list( 'id', 'model' ) )
 
 _ui_values = ( 'id', 'progress', 'seconds_used', 'uses', 'feedback', 'apa_id',
             'last_used', 'hist_created', 'completed', 'progress_update',
@@ -223,48 +290,44 @@ _ui_values = ( 'id', 'progress', 'seconds_used', 'uses', 'feedback', 'apa_id',
 _ui_related = ( 'cu', 'item', 'item__portal_type',
             'top_tree', 'top_tree__item' )
 
-def _get_users_apas( sandbox_id, user_ids, grp_account_ids, indv_account_ids ):
+def _get_users_apas( sandbox_id, grp_account_ids, indv_account_ids, apa_range=None ):
     """
     Returns dicts of APA object lists, one indexed by id, and one by account id
+    APAs for all accounts are read in one query, and group users for
+    all the APAs in another.
     """
     spool_breathe()
-    log.debug_on() and log.debug("Getting APAs for users: users(%s) -> grp(%s), indv(%s)",
-                        len(user_ids), len(grp_account_ids), len(indv_account_ids))
+    log.debug_on() and log.debug("Getting APAs for users: grp(%s), indv(%s), %s",
+                        len(grp_account_ids), len(indv_account_ids), apa_range)
     apas_id = {}
     apas_account = defaultdict( list )
 
-    def set_rv( apa ):
+    qs = _apas_qs( sandbox_id )\
+                .filter( account_id__in=grp_account_ids | indv_account_ids )
+    if apa_range:
+        qs = qs.filter( id__range=apa_range )
+
+    # Group APAs that are limited to specific users
+    group_users = apa_group_user_ids( qs.filter( account_id__in=grp_account_ids ) )
+
+    for apa in qs.select_related( 'pa', 'account' ).iterator():
+        apa.group = apa.account_id in grp_account_ids
+        apa.group_users = apa.group and group_users.get( apa.pk ) or False
         apas_id[ apa.pk ] = apa
         apas_account[ apa.account_id ].append( apa )
 
-    apa_qs = APA.objects.mpusing('read_replica')\
-                .select_related( 'pa', 'account' )
-
-    # Individual accounts
-    qs = apa_qs.filter( sandbox_id=sandbox_id, is_activated=True,
-                account_id__in=indv_account_ids )
-    for apa in qs.iterator():
-        apa.group = False
-        apa.group_users = False
-        set_rv( apa )
-
-    # All-user group accounts
-    qs = apa_qs.filter( sandbox_id=sandbox_id, is_activated=True,
-                account_id__in=grp_account_ids, ga_users__isnull=True )
-    for apa in qs.iterator():
-        apa.group = True
-        apa.group_users = False
-        set_rv( apa )
-
-    # Specific user group accounts
-    qs = apa_qs.filter( sandbox_id=sandbox_id, is_activated=True,
-                account_id__in=grp_account_ids )
-    if user_ids:
-        qs = qs.filter( ga_users__user_id__in=user_ids )
-    for apa in qs.iterator():
-        apa.group = True
-        apa.group_users = [ gu.user_id for gu in apa.ga_users.all() ]
-        set_rv( apa )
-
     log.debug_on() and log.debug("Got user block APAs: %s", len(apas_id))
     return apas_id, apas_account
+
+def apa_group_user_ids( apa_qs ):
+    """
+    Returns dict of user id lists for APAs in the queryset that have
+    group users, from one query instead of ga_users for each APA
+    """
+    rv = defaultdict( list )
+    rows = apa_qs.filter( ga_users__isnull=False )\
+                .values_list( 'id', 'ga_users__user_id' )
+    for apa_id, user_id in rows.iterator():
+        if user_id:
+            rv[ apa_id ].append( user_id )
+    return rv
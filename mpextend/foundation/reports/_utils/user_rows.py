@@ -9,13 +9,19 @@ from mpframework.common import log
 from mpframework.common.logging.timing import mpTiming
 from mpframework.common.tasks import spool_breathe
 
-from ..report_writer import report_writer_string
-from .._utils.user_block import get_user_block_info
+from ..report_writer import ReportChunk
+from .._utils.user_block import iter_user_block
+from .._utils.user_block import apa_block_user_ids
+from .._utils.user_block import get_blocks
 
 
 def user_rows_factory( user_row_fn ):
     """
     Factory code for creating per-user report output
+    Rows are written to a compressed chunk as each user is read, and
+    the chunk reference is returned as task output.
+    Tasks are either given a block of user_ids, or an apa_range whose
+    users are read in blocks.
     """
     def user_rows_fn( **kwargs ):
         task = kwargs['my_task']
@@ -32,18 +38,21 @@ def user_rows_factory( user_row_fn ):
         t = mpTiming()
 
         sandbox_id = kwargs['sandbox_id']
-        user_ids = kwargs['user_ids']
+        apa_range = kwargs.get('apa_range')
         data = task.job.data
         name = data['name']
 
-        user_info = get_user_block_info( sandbox_id, user_ids, t, data.get('detailed') )
-        users = user_info['users']
+        if apa_range:
+            blocks = get_blocks( apa_block_user_ids( sandbox_id, apa_range,
+                            data.get('start') ), settings.MP_REPORT['USER_BLOCK_SIZE'] )
+        else:
+            blocks = [ kwargs['user_ids'] ]
 
-        writer = report_writer_string()
+        writer = ReportChunk( task )
 
         errors = False
         user_num = 1
-        for user in users.values():
+        for user in _block_users( sandbox_id, blocks, t, apa_range ):
             spool_breathe( user_num )
             try:
                 log.detail3("Creating %s row: %s -> %s", name, user_num, user)
@@ -63,8 +72,13 @@ def user_rows_factory( user_row_fn ):
 
             user_num += 1
         errors and log.warning_quiet("Report errors %s: %s", name, task.job.report['mpname'])
-        log.info2("<= %s %s block: %s users -> %s", t, name, len(users), task)
+        log.info2("<= %s %s block: %s users -> %s", t, name, user_num - 1, task)
 
-        return writer.output.getvalue()
+        return writer.save()
 
     return user_rows_fn
+
+def _block_users( sandbox_id, blocks, timing, apa_range ):
+    for user_ids in blocks:
+        if user_ids:
+            yield from iter_user_block( sandbox_id, user_ids, timing, apa_range )
@@ -6,9 +6,11 @@
 from mpframework.common.tasks import mp_async
 from mpframework.common.utils.strings import wb
 from mpframework.common.api import respond_api_call
+from mpextend.product.account.models import APA
 from mpextend.product.account.group import group_admin_view
 
 from ..users.summary import u2_report
+from .._utils.user_block import apa_group_user_ids
 from .._utils.user_rows import user_rows_factory
 from ._shared import start_ga_report
 
@@ -36,9 +38,13 @@ def ga_purchases_csv( request, account ):
 
         # Do one-time get of all apa and user-relation information
         apas = list( account.get_apas() )
+        account_users = account.user_ids
+        group_users = apa_group_user_ids( APA.objects.mpusing('read_replica')
+                        .filter( id__in=[ apa.id for apa in apas ] ) )
         apa_users = {}
         for apa in apas:
-            apa_users.update({ apa.id: apa.user_ids })
+            apa_users.update({ apa.id: account_users if apa.ga_license else
+                                        group_users[ apa.id ] })
         data = {
             'apas': apas,
             'apa_users': apa_users,
@@ -11,6 +11,7 @@ from mpframework.common.tasks import get_module_name
 from mpframework.common.tasks.output import get_task_output
 from mpframework.common.tasks.output import process_job_output_if_done
 from mpframework.common.tasks.output import JOB_INCOMPLETE
+from mpframework.common.tasks.output import JOB_FINALIZED
 from mpframework.common.tasks.spooler import ASYNC_RETRY
 from mpframework.common.utils import timedelta_future
 from mpframework.common.utils.time_utils import timestamp
@@ -30,17 +31,17 @@ MAX_MINUTES = 60
 def _complete_report( **kwargs ):
     """
     If the entire report job is complete, the Job process that completed the
-    report aggregation will have a local copy of the report on its disk.
-    Move this to S3 and then notify user it is ready.
+    report aggregation will have uploaded the report, so notify user it is ready.
     """
     job = kwargs['my_task']
 
-    filename = process_job_output_if_done( **kwargs )
-    if filename == JOB_INCOMPLETE:
+    location = process_job_output_if_done( **kwargs )
+    if location == JOB_INCOMPLETE:
         return ASYNC_RETRY
+    if location == JOB_FINALIZED:
+        return
 
     sandbox = Sandbox.objects.get( id=job.sandbox_id )
-    location = report_writer.push_report_to_s3( sandbox, filename )
 
     # TBD - make report email pretty
 
@@ -55,7 +56,7 @@ def _complete_report( **kwargs ):
     send_email_user( user, "Report is ready",
             "\nYour report is ready:\n{}\n{}".format( url, info )  )
 
-    log.info("<= COMPLETED REPORT: %s -> %s", job.report['sandbox'], filename)
+    log.info("<= COMPLETED REPORT: %s -> %s", sandbox, location)
 
 
 class SandboxReportJob( Job ):
@@ -109,10 +110,10 @@ class SandboxReportJob( Job ):
 
     def process_output( self ):
         """
-        Override base output to get output from task sessions
-        and write to local csv file whose filename is returned.
+        Override base output to stream task chunks in order into the
+        final csv report upload.
         ASSUMES JOB IS COMPLETE
-        Returns the name of the local aggregated file.
+        Returns the location of the uploaded report.
         """
         log.info("Report job output: %s", self)
 
@@ -121,22 +122,41 @@ class SandboxReportJob( Job ):
                     self.report['user'], self.report['name'],
                     timestamp( fmt='%Y-%m%d-%H%M%S' ) )
 
-        # Create local csv file
-        with report_writer.get_report_file( filename ) as file:
-            writer = report_writer.report_writer_file( file )
-            writer.writerow( self.report['header'] )
+        upload = report_writer.ReportUpload( filename )
+        try:
+            header = report_writer.report_writer_string()
+            header.writerow( self.report['header'] )
+            upload.write( header.output.getvalue().encode() )
 
-            # Write the session chunks
+            # Write the session chunks; tasks that don't use chunks may
+            # return their csv text directly
             for task_session in self.task_keys:
                 output = get_task_output( self.cache, task_session )
-                if output:
-                    file.write( output )
-
-                    # Automated test check - ASSUMES ONE BLOCK/TASK!!!
+                if not output:
+                    continue
+                if report_writer.is_report_chunk( output ):
+                    for data in report_writer.read_report_chunk( output ):
+                        upload.write( data )
+                        if settings.MP_TESTING:
+                            self._check_output( data.decode() )
+                else:
+                    upload.write( output.encode() )
                     if settings.MP_TESTING:
-                        text = self.report['success_text']
-                        if text not in output:
-                            raise Exception("BAD REPORT SUCCESS TEXT: %s -> %s\n%s" %
-                                             (self, text, output))
+                        self._check_output( output )
+
+            location = upload.finish()
+        except Exception:
+            upload.abort()
+            raise
+        finally:
+            report_writer.remove_report_chunks( self.cache_key )
+
         self.cleanup()
-        return filename
+        return location
+
+    def _check_output( self, output ):
+        # Automated test check - ASSUMES ONE BLOCK/TASK!!!
+        text = self.report['success_text']
+        if text not in output:
+            raise Exception("BAD REPORT SUCCESS TEXT: %s -> %s\n%s" %
+                             (self, text, output))
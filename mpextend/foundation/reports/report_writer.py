@@ -1,9 +1,20 @@
 #--- Mesa Platform, Copyright 2021 Vueocity, LLC
 """
     CSV report writing support
+
+    Report tasks write their rows as compressed chunks to storage shared
+    by all servers (protected S3 in cloud, local work folder in dev),
+    so only a chunk reference is placed in the task output cache.
+    When the job is done, chunks are streamed in order into a multipart
+    upload of the final report; the full report is never held in memory
+    or cache, or written to local disk in cloud.
 """
 import csv
 import io
+import os
+import gzip
+import shutil
+import tempfile
 from django.conf import settings
 from django.http import HttpResponse
 
@@ -16,6 +27,19 @@ from mpframework.common.deploy.paths import work_path
 
 
 REPORT_STORAGE_PATH = '_reports'
+CHUNK_STORAGE_PATH = '_chunks'
+
+_SETTINGS = settings.MP_REPORT
+
+# Task chunks are spooled in memory up to this size before using temp file
+_SPOOL_SIZE = _SETTINGS.get( 'CHUNK_SPOOL_SIZE', 1024 * 1024 )
+
+# Chunks are stored compressed, favoring speed over size
+_COMPRESS_LEVEL = _SETTINGS.get( 'CHUNK_COMPRESS_LEVEL', 3 )
+
+# Size of multipart upload parts for final report
+_PART_SIZE = _SETTINGS.get( 'UPLOAD_PART_SIZE', 8 * 1024 * 1024 )
+_READ_SIZE = 256 * 1024
 
 
 def get_report_path( *args ):
@@ -35,28 +59,106 @@ class CsvWriter:
         self.writer.writerow([ str( col ) for col in columns ])
 
 
-def report_writer_string():
-    return CsvWriter( io.StringIO() )
+class ReportChunk( CsvWriter ):
+    """
+    Writes one task's rows compressed into a spooled temp file;
+    save places the chunk in shared storage and returns its reference.
+    """
+
+    def __init__( self, task ):
+        self.key = _chunk_key( task.job.cache_key, '{}.csv.gz'.format( task.key ) )
+        self.spool = tempfile.SpooledTemporaryFile( max_size=_SPOOL_SIZE )
+        self.gzip = gzip.GzipFile( fileobj=self.spool, mode='wb',
+                                   compresslevel=_COMPRESS_LEVEL )
+        super().__init__( io.TextIOWrapper( self.gzip, encoding='utf-8', newline='' ) )
+
+    def save( self ):
+        self.output.close()
+        self.spool.seek( 0 )
+        try:
+            if settings.MP_CLOUD:
+                s3.upload_protected_fileobj( self.spool, self.key )
+            else:
+                path = _local_path( self.key )
+                create_local_folder( os.path.dirname( path ) )
+                with open( path, 'wb' ) as file:
+                    shutil.copyfileobj( self.spool, file )
+        finally:
+            self.spool.close()
+        log.debug("Saved report chunk: %s", self.key)
+        return self.key
 
-def get_report_file( filename ):
+def is_report_chunk( output ):
+    return isinstance( output, str ) and output.startswith( _chunk_key() )
+
+def read_report_chunk( key ):
     """
-    Open/create given report file, if exists, will append
+    Yields uncompressed csv bytes from a saved chunk
     """
-    log.debug("Creating file report: %s", filename)
-    create_local_folder( get_report_path() )
-    return open( get_report_path( filename ), 'a+' )
+    if settings.MP_CLOUD:
+        raw = s3.read_protected( key )
+    else:
+        raw = open( _local_path( key ), 'rb' )
+    try:
+        with gzip.GzipFile( fileobj=raw, mode='rb' ) as file:
+            while True:
+                data = file.read( _READ_SIZE )
+                if not data:
+                    break
+                yield data
+    finally:
+        raw.close()
+
+def remove_report_chunks( job_key ):
+    if settings.MP_CLOUD:
+        s3.remove_protected_prefix( _chunk_key( job_key ) + '/' )
+    else:
+        shutil.rmtree( _local_path( _chunk_key( job_key ) ), ignore_errors=True )
+
+def _chunk_key( *args ):
+    return join_urls( REPORT_STORAGE_PATH, CHUNK_STORAGE_PATH, *args )
 
-def report_writer_file( file ):
-    return CsvWriter( file )
+def _local_path( key ):
+    return work_path( settings.MP_PLAYPEN_STORAGE, *key.split('/') )
 
-def push_report_to_s3( sandbox, filename ):
+
+class ReportUpload:
     """
-    Move the report to location on S3 where it can be accessed
+    Assemble final report from bytes written in order; multipart
+    S3 upload in cloud, local report file in dev.
     """
-    log.info2("Uploading report to S3: %s -> %s", sandbox, filename)
-    s3key = join_urls( REPORT_STORAGE_PATH, filename )
-    s3.upload_public( get_report_path( filename ), s3key )
-    return s3key
+
+    def __init__( self, filename ):
+        self.s3key = join_urls( REPORT_STORAGE_PATH, filename )
+        log.info2("Starting report upload: %s", self.s3key)
+        if settings.MP_CLOUD:
+            self.upload = s3.MultipartUpload( self.s3key, _PART_SIZE )
+            self.file = None
+        else:
+            create_local_folder( get_report_path() )
+            self.file = open( get_report_path( filename ), 'wb' )
+
+    def write( self, data ):
+        if self.file:
+            self.file.write( data )
+        else:
+            self.upload.write( data )
+
+    def finish( self ):
+        if self.file:
+            self.file.close()
+        else:
+            self.upload.finish()
+        return self.s3key
+
+    def abort( self ):
+        if self.file:
+            self.file.close()
+        else:
+            self.upload.abort()
+
+def report_writer_string():
+    return CsvWriter( io.StringIO() )
 
 def report_writer_response( request, name ):
     """
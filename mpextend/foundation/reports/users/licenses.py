@@ -12,7 +12,7 @@ from mpframework.common.view import staff_required
 from mpframework.common.api import respond_api_call
 
 from ..jobs import SandboxReportJob
-from .._utils.user_block import define_user_blocks
+from .._utils.user_block import define_apa_blocks
 from .._utils.user_rows import user_rows_factory
 from .summary import u1_report
 from .summary import u2_report
@@ -53,7 +53,9 @@ def users_licenses_csv( request, start=None ):
     """
     This report combines licenses and users, so there is one row for
     every user/license combination
-    It is organized by APAs, with expansion of all user/group relationships
+    It is organized by APAs, with expansion of all user/group relationships;
+    tasks are split by APA id ranges, so sandboxes with many licenses
+    are spread across tasks.
     """
     def handler( _get ):
         log.info("START USER PURCHASE REPORT %s: %s -> %s", request.mptiming,
@@ -69,11 +71,11 @@ def users_licenses_csv( request, start=None ):
         job = SandboxReportJob( name, request, header, _user_licenses_rows_fn,
                                 data=data )
 
-        log.debug("Creating user blocks for license report: %s", job)
-        blocks = define_user_blocks( job.sandbox_id,
-                    settings.MP_REPORT['USER_BLOCK_SIZE'], start )
-        for user_ids in blocks:
-            job.add_report_task( user_ids=user_ids )
+        log.debug("Creating APA blocks for license report: %s", job)
+        blocks = define_apa_blocks( job.sandbox_id,
+                    settings.MP_REPORT.get( 'APA_BLOCK_SIZE', 2000 ) )
+        for apa_range in blocks:
+            job.add_report_task( apa_range=apa_range )
 
         job.start()
 
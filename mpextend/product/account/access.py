@@ -4,7 +4,7 @@
 """
 
 from mpframework.common import log
-from mpframework.common.tags import tag_match
+from mpframework.common.tags import tag_index
 from mpframework.common.utils import tz_strip
 from mpframework.common.utils import DATETIME_FUTURE
 from mpframework.common.utils import json_dump
@@ -14,6 +14,7 @@ from mpextend.product.catalog.utils import free_pa_content
 
 from .models import APA
 from .utils import get_au
+from .entitlements import item_relationships
 
 
 def _check_existing_license( item, user ):
@@ -106,13 +107,14 @@ def quick_access_check( user, item, content_tags=False ):
                 continue
             if not apa.room_for_item( item ):
                 continue
-            if apa.includes_all:
-                apas.append( apa )
-                continue
-            for tag in content_tags:
-                if tag_match( tag, apa.tags ):
-                    apas.append( apa )
-                    continue
+            apas.append( apa )
+        # Compiled index of APA tags finds matches for all content tags
+        if apas:
+            index = tag_index( () if apa.includes_all else apa.tags
+                                for apa in apas )
+            matches = set( index.match( content_tags ) )
+            apas = [ apa for n, apa in enumerate( apas )
+                        if apa.includes_all or n in matches ]
         rv = apas if apas else rv
 
     log.debug2("quick_access_check: %s -> %s, %s", user, rv, item)
@@ -247,64 +249,16 @@ def _product_relationships( content_item, user ):
 
 def _find_apas_and_pas( content_item, au, available_pas ):
     """
-    Add PAs and APAs for an item and any tree nodes it belongs to
+    Add PAs and APAs for an item and any tree nodes it belongs to,
+    using the user's cached item entitlements
     """
-    apas = set()
-    pas = set()
-    tags_to_skip = []
-    if log.debug_on():
-        depth = []
-
-    def _process( item ):
-        # If this is a tree node, recurse through any parent nodes first
-        if item.is_collection:
-            item = item.downcast_model
-            log.detail3("PARENT RELATIONSHIP: %s -> %s", item, item.parent)
-            _recurse( item.parent )
-        # If a content item, recurse any tree node relationships first
-        else:
-            log.detail3("NODE RELATIONSHIP: %s -> %s", item, item.my_tree_nodes)
-            for node in item.my_tree_nodes:
-                _recurse( node )
-
-        # To limit overlapping checking during recursion, keep track of tags
-        # that have already been considered
-        if item.tag in tags_to_skip:
-            log.debug2("Content tag considered, skipping: %s", item.tag)
-            return
-        tags_to_skip.append( item.tag )
-
-        # Add any available PAs and active APAs that match content tag
-        pas.update([ pa for pa in available_pas if pa.matches_tag( item.tag ) ])
-        apas.update( au.active_apas( (item.tag,) ) if au else [] )
-
-    def _recurse( next_item ):
-        # Recurse to next dependent item, handle base case
-        if not next_item:
-            return
-        if log.debug_on():
-            t = mpTiming()
-            depth.append( next_item )
-            log.debug2("---> Start item (depth=%s): %s", len(depth), next_item)
-
-        _process( next_item )
-
-        if log.debug_on():
-            log.debug2("<--- Finish item %s: %s", t.log_total, depth.pop())
-
-    # Search from the item up the tree, adding apas and pas
-    _recurse( content_item )
+    apas, pas = item_relationships( content_item, au, available_pas )
 
     if content_item.sb_options['portal.no_trials']:
         # Remove trial items if content doesn't allow trial access
-        # Do this at the end instead of during processing to keep things simple
-        # regarding the potential dependency relationships
         log.debug("Removing trial apas and pas: %s -> %s", au, content_item)
         apas = [ apa for apa in apas if not apa.is_trial ]
         pas = [ pa for pa in pas if not pa.is_trial ]
-    else:
-        apas = list( apas )
-        pas = list( pas )
 
     return apas, pas
 
@@ -0,0 +1,108 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Per-user entitlement cache
+
+    Deep access checks walk up an item's tree relationships and match
+    each tag against the user's APAs and available PAs. The matching APA
+    and PA ids for each item are cached for the user, one key per item,
+    so repeat checks are one small get instead of the recursive walk,
+    and concurrent checks for different items don't overwrite each other.
+
+    Item keys are tied to the user's cache group and include a hash of
+    versions for everything the matching depends on:
+      - content group, for tree membership and tag changes
+      - catalog group, for PA changes
+      - the user's APA ids and tag matches, and available PA ids
+    so any change starts a new set of keys, filled in as items are used.
+    APA active state and trial options change independently of tags,
+    so are checked on each lookup against current APA objects.
+"""
+from hashlib import sha1
+from django.core.cache import caches
+
+from mpframework.common import log
+from mpframework.common.cache import cache_version
+from mpframework.common.cache.utils import make_full_key
+from mpframework.common.tags import tag_index
+from mpframework.content.mpcontent.cache import cache_group_content_sandbox
+from mpextend.product.catalog.cache import cache_group_catalog
+
+
+_cache = caches['default']
+
+def item_relationships( content_item, au, available_pas ):
+    """
+    Returns ( apas, pas ) lists of active APAs and available PAs that
+    match the item or any tree node above it
+    """
+    all_apas = au.my_apas if au else []
+    key, version = _item_key( content_item, au, all_apas, available_pas )
+    ids = key and _cache.get( key, version=version )
+
+    if ids is None:
+        tags = item_tags( content_item )
+        ids = ( _matches( all_apas, tags ), _matches( available_pas, tags ) )
+        log.debug2("Entitlement add %s: %s -> %s", au, content_item, ids)
+        if key:
+            _cache.set( key, ids, version=version )
+
+    apa_ids, pa_ids = ids
+    apas = [ apa for apa in ( au.active_apas() if au else [] )
+                if apa.pk in apa_ids ]
+    pas = [ pa for pa in available_pas if pa.pk in pa_ids ]
+    return apas, pas
+
+def item_tags( content_item ):
+    """
+    Tags for an item and all tree nodes above it
+    """
+    tags = []
+
+    def _walk( item ):
+        if not item:
+            return
+        # If this is a tree node, recurse through any parent nodes first
+        if item.is_collection:
+            item = item.downcast_model
+            log.detail3("PARENT RELATIONSHIP: %s -> %s", item, item.parent)
+            _walk( item.parent )
+        # If a content item, recurse any tree node relationships first
+        else:
+            log.detail3("NODE RELATIONSHIP: %s -> %s", item, item.my_tree_nodes)
+            for node in item.my_tree_nodes:
+                _walk( node )
+        if item.tag not in tags:
+            tags.append( item.tag )
+
+    _walk( content_item )
+    return tags
+
+def _matches( objs, tags ):
+    """
+    Ids of APAs or PAs whose tags match any of the content tags
+    """
+    if not objs:
+        return []
+    tags = [ str( tag ).strip().lower() for tag in tags ]
+    index = tag_index( () if obj.includes_all else obj.tags for obj in objs )
+    matches = set( index.match( tags ) )
+    return [ obj.pk for n, obj in enumerate( objs )
+                if obj.includes_all or n in matches ]
+
+def _item_key( content_item, au, apas, pas ):
+    """
+    Returns ( key, version ) for the user's item entry, or ( None, None )
+    """
+    if not au:
+        return None, None
+    user = au.user
+    sandbox = content_item.sandbox
+    versions = '{}|{}|{}|{}'.format(
+                cache_group_content_sandbox( sandbox ),
+                cache_version( cache_group_catalog( sandbox.pk ) ),
+                sorted( ( apa.pk, apa.tag_matches ) for apa in apas ),
+                sorted( pa.pk for pa in pas ),
+                )
+    key = make_full_key( 'entitle', user.pk, '{}|{}'.format(
+                sha1( versions.encode() ).hexdigest(), content_item.pk ) )
+    return key, cache_version( user.cache_group )
@@ -2,9 +2,14 @@
 """
     User tracking Model tests
 """
+from datetime import timedelta
+
+from mpframework.common.utils import now
 from mpframework.testing.framework import ModelTestCase
 
+from .. import tracking_update
 from ..models import UserTracking
+from ..models import VisitorTracking
 
 
 class ModelTests( ModelTestCase ):
@@ -51,3 +56,41 @@ class ModelTests( ModelTestCase ):
 
         self.assertTrue( len(all_sessions) == 3 )
         self.assertTrue( len(active_sessions) == 1 )
+
+    def test_tracking_batch( self ):
+
+        user = self.login_user()
+        tracking = UserTracking.objects.get( user_id=user.pk )
+        modified = tracking.hist_modified
+
+        self.l("Testing batched tracking")
+
+        # Requests are reduced to one entry per user or visitor
+        time_now = now()
+        values = {
+            'user_id': user.pk,
+            'sandbox_id': user.sandbox.pk,
+            'ip': '10.1.1.1',
+            'user_agent': 'batch test',
+            'session': 'batch_session',
+            'time_now': time_now,
+            }
+        tracking_update._buffer_request( values )
+        tracking_update._buffer_request( dict( values,
+                    time_now=time_now + timedelta( seconds=30 ) ) )
+        tracking_update._buffer_request( dict( values, user_id=None,
+                    ip='10.1.1.2', session=None ) )
+        self.assertTrue( len( tracking_update._buffer ) == 2 )
+
+        tracking_update.flush_tracking()
+        self.assertFalse( tracking_update._buffer )
+
+        tracking = UserTracking.objects.get( pk=tracking.pk )
+        self.assertTrue( tracking.ip_address == '10.1.1.1' )
+        self.assertTrue( 'batch_session' in tracking.sessions )
+        self.assertTrue( tracking.seconds >= 30 )
+        self.assertTrue( tracking.hist_modified > modified )
+
+        visitor = VisitorTracking.objects.get( sandbox_id=user.sandbox.pk,
+                    ip_address='10.1.1.2' )
+        self.assertTrue( visitor.requests == 1 )
@@ -2,19 +2,29 @@
 """
     Asynchronous update of user tracking.
 
+    Tracking for normal requests is coalesced in each process by
+    user (or visitor IP) and sent as one batched task per sandbox, which
+    reduces SQS messages and DB writes from tracking to one per user
+    per batch.
+    New logins are sent immediately to support session reduction.
+
     This module needs to be loadable by the spooler, so some
     imports are in functions to allow import from parent.
 """
+import os
+import threading
 from django.conf import settings
 
 from mpframework.common import log
 from mpframework.common import sys_options
 from mpframework.common import constants as mc
 from mpframework.common.logging.timing import mpTiming
+from mpframework.common.deploy.server import add_shutdown_handler
 from mpframework.common.tasks import mp_async
 from mpframework.common.tasks import run_queue_function
 from mpframework.common.utils import dt
 from mpframework.common.utils import now
+from mpframework.common.utils import timedelta_seconds
 from mpextend.common.request_info import get_ip_info
 from mpextend.common.request_info import safe_user_agent
 from mpextend.common.request_info import get_device_info
@@ -61,7 +71,113 @@ def update_for_request( request, new_login=False ):
         'url': request.uri[ :mc.CHAR_LEN_PATH ],
         'referrer': request.referrer,
         }
-    run_queue_function( _update_for_request, sandbox, values=values )
+    if new_login or not _batch_seconds or settings.MP_TESTING:
+        run_queue_function( _update_for_request, sandbox, values=values )
+    else:
+        _buffer_request( values )
+
+def flush_tracking():
+    """
+    Send any tracking buffered in this process
+    """
+    global _timer, _events
+    with _lock:
+        entries = list( _buffer.values() )
+        _buffer.clear()
+        _events = 0
+        if _timer and _timer is not threading.current_thread():
+            _timer.cancel()
+        _timer = None
+    if not entries:
+        return
+    log.debug("Tracking batch flush: %s entries", len(entries))
+
+    # Group batches by sandbox, so they aren't serialized in one queue group
+    sandboxes = {}
+    for entry in entries:
+        sandboxes.setdefault( entry['sandbox_id'], [] ).append( entry )
+    for sandbox_id, sandbox_entries in sandboxes.items():
+        try:
+            run_queue_function( _update_for_requests,
+                        '{}_{}'.format( _BATCH_GROUP, sandbox_id ),
+                        entries=sandbox_entries )
+        except Exception:
+            log.exception("Tracking batch flush: %s", len(sandbox_entries))
+            if settings.MP_DEV_EXCEPTION:
+                raise
+
+"""--------------------------------------------------------------------
+    Per-process buffer
+
+    Values for each user or visitor are reduced to one entry holding the
+    active time between its requests, the latest time, IP, and device,
+    and the latest time for each session.
+    The buffer is sent when the process exits or is recycled; it is lost
+    if a process is killed, which is acceptable for this non-critical data.
+"""
+
+_batch_seconds = settings.MP_TRACKING['BATCH_SECONDS']
+_batch_events = settings.MP_TRACKING['BATCH_EVENTS']
+_BATCH_GROUP = 'DEFAULT_TRACKING'
+
+_buffer = {}
+_events = 0
+_lock = threading.Lock()
+_timer = None
+
+def _reset_after_fork():
+    # Forked workers start with no buffered tracking or held lock
+    global _lock, _timer, _events
+    _lock = threading.Lock()
+    _buffer.clear()
+    _events = 0
+    _timer = None
+
+os.register_at_fork( after_in_child=_reset_after_fork )
+
+# Timer is a daemon thread, so exit doesn't wait on it to flush
+add_shutdown_handler( flush_tracking )
+
+def _buffer_request( values ):
+    global _timer, _events
+    key = ( values['sandbox_id'], values['user_id'] or values['ip'] )
+    time_now = values['time_now']
+    session = values['session']
+    with _lock:
+        entry = _buffer.get( key )
+        if entry:
+            entry['seconds'] += _active_seconds( entry['last_time'], time_now )
+            entry['last_time'] = time_now
+            entry['requests'] += 1
+            entry['ip'] = values['ip']
+            entry['user_agent'] = values['user_agent']
+        else:
+            entry = {
+                'user_id': values['user_id'],
+                'sandbox_id': values['sandbox_id'],
+                'ip': values['ip'],
+                'user_agent': values['user_agent'],
+                'first_time': time_now,
+                'last_time': time_now,
+                'seconds': 0,
+                'requests': 1,
+                'sessions': {},
+                }
+            _buffer[ key ] = entry
+        if session:
+            entry['sessions'][ session ] = {
+                'last_time': time_now,
+                'last_ip': values['ip'],
+                }
+        _events += 1
+        flush = _events >= _batch_events
+        if not flush and not _timer:
+            _timer = threading.Timer( _batch_seconds, flush_tracking )
+            _timer.name = 'tracking'
+            _timer.daemon = True
+            _timer.start()
+    if flush:
+        flush_tracking()
 
 @mp_async
 def _update_for_request( **kwargs ):
@@ -125,3 +241,98 @@ def _update_for_request( **kwargs ):
 
     if not settings.MP_TEST_NO_LOG:
         log.info("<- %s User request tracking: %s", t, tracking)
+
+@mp_async
+def _update_for_requests( **kwargs ):
+    """
+    Task to apply a batch of coalesced tracking entries.
+    Tracking rows for the batch are loaded together and saved with
+    bulk updates; entries from other processes for the same user may
+    arrive in any order, so time and latest values only move forward.
+    """
+    from .models import UserTracking
+    from .models import VisitorTracking
+    t = mpTiming()
+    entries = kwargs.pop('entries')
+    log.timing("%s Starting batch request tracking: %s", t, len(entries))
+
+    user_entries = {}
+    visitor_entries = {}
+    for entry in entries:
+        if entry['user_id']:
+            user_entries[ entry['user_id'] ] = entry
+        else:
+            visitor_entries[ ( entry['sandbox_id'], entry['ip'] ) ] = entry
+
+    if user_entries:
+        users = []
+        for tracking in UserTracking.objects.filter(
+                    user_id__in=list( user_entries ) ):
+            entry = user_entries[ tracking.user_id ]
+            if entry['first_time'] > tracking.last_update:
+                tracking.seconds += _active_seconds( tracking.last_update,
+                            entry['first_time'] )
+            tracking.seconds += entry['seconds']
+            _update_tracking( tracking, entry )
+            users.append( tracking )
+        UserTracking.objects.bulk_update( users, _USER_FIELDS )
+
+    if visitor_entries:
+        visitors = []
+        for tracking in VisitorTracking.objects.filter(
+                    sandbox_id__in={ key[0] for key in visitor_entries },
+                    ip_address__in={ key[1] for key in visitor_entries } ):
+            entry = visitor_entries.pop(
+                        ( tracking.sandbox_id, tracking.ip_address ), None )
+            if entry:
+                tracking.requests += entry['requests']
+                _update_tracking( tracking, entry )
+                visitors.append( tracking )
+        VisitorTracking.objects.bulk_update( visitors, _VISITOR_FIELDS )
+
+        # New visitors are created individually
+        for entry in visitor_entries.values():
+            tracking = VisitorTracking( sandbox_id=entry['sandbox_id'],
+                        ip_address=entry['ip'], requests=entry['requests'] )
+            _update_tracking( tracking, entry )
+            tracking.save()
+
+    if not settings.MP_TEST_NO_LOG:
+        log.info("<- %s Batch request tracking: %s users, %s visitors", t,
+                    len(user_entries), len(entries) - len(user_entries))
+
+# Bulk updates skip BaseModel.save, so hist_modified is set with the batch
+_TRACKING_FIELDS = [ 'last_update', 'ip_address', 'sessions', 'ips', 'devices',
+                     'hist_modified' ]
+_USER_FIELDS = _TRACKING_FIELDS + [ 'seconds' ]
+_VISITOR_FIELDS = _TRACKING_FIELDS + [ 'requests' ]
+
+def _update_tracking( tracking, entry ):
+    """
+    Shared user and visitor updates from a buffered entry
+    """
+    tracking.hist_modified = now()
+    ip = entry['ip']
+    for key, session in entry['sessions'].items():
+        current = tracking.sessions.get( key ) or {}
+        tracking.sessions[ key ] = {
+            # Don't reactivate sessions removed by session reduction
+            'active': current.get( 'active', True ),
+            'last_time': dt( session['last_time'] ),
+            'last_ip': session['last_ip'],
+            }
+    if entry['last_time'] >= tracking.last_update:
+        tracking.ip_address = ip
+        tracking.ips[ ip ] = get_ip_info( ip )
+        tracking.devices[ ip ] = get_device_info( entry['user_agent'] )
+        tracking.last_update = entry['last_time']
+
+def _active_seconds( start, end ):
+    """
+    Seconds between requests, using the same inactivity limit as
+    UserTracking.set_time
+    """
+    seconds = timedelta_seconds( end - start )
+    if seconds > sys_options.tracking_inactive_delta():
+        seconds = sys_options.tracking_inactive_placeholder()
+    return max( seconds, 0 )
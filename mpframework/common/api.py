@@ -26,14 +26,23 @@
     and the content type is always JSON.
 """
 import json
+import gzip
+from hashlib import sha1
 from django.conf import settings
 from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 
 from . import log
 from .utils import json_dump
 from .utils import safe_int
 
+# Brotli is optional; if not installed only gzip is used
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 class mpApiArgsNullIdException( Exception ):
     """
@@ -82,6 +91,122 @@ def respond_api( data=None, error=None, status=None, cache=False, **kwargs ):
     log.debug_values("respond_api: %s", response)
     return response
 
+"""
+    Pre-encoded API responses
+    For large cached responses, encoding the JSON and compressing it can
+    take more time than getting data from the cache. These support caching
+    the final response bytes, with compressed variants and an ETag,
+    which are then sent without any serialization.
+    The ETag is weak, since it is shared by the identity and compressed
+    variants, which are equivalent but not byte-identical.
+"""
+_COMPRESS_MIN = 1024
+
+def encode_api_response( data ):
+    """
+    Returns dict with JSON bytes, compressed variants, and ETag for
+    data, which can be cached and sent with respond_api_encoded.
+    """
+    content = json_dump( data if data else {} ).encode( 'utf-8' )
+    rv = {
+        'etag': 'W/"{}"'.format( sha1( content ).hexdigest() ),
+        'content': content,
+        }
+    if len( content ) > _COMPRESS_MIN:
+        rv['gzip'] = gzip.compress( content, compresslevel=6 )
+        if brotli:
+            rv['br'] = brotli.compress( content, quality=5 )
+    return rv
+
+def respond_api_encoded( request, encoded, cache=False ):
+    """
+    Response from encode_api_response data, using compressed variant
+    the client accepts, and 304 if the client has the current ETag.
+    """
+    etag = encoded['etag']
+    if _etag_matches( etag, request.META.get( 'HTTP_IF_NONE_MATCH', '' ) ):
+        response = HttpResponseNotModified()
+    else:
+        content = encoded['content']
+        encoding = None
+        accept = _accept_encodings( request.META.get( 'HTTP_ACCEPT_ENCODING', '' ) )
+        for option in ( 'br', 'gzip' ):
+            if encoded.get( option ) and accept.get( option, accept.get('*', 0) ) > 0:
+                content = encoded[ option ]
+                encoding = option
+                break
+        response = HttpResponse( content, content_type='application/json' )
+        if encoding:
+            response['content-encoding'] = encoding
+
+    # Both full and 304 responses vary with encoding
+    if encoded.get('gzip'):
+        response['vary'] = 'Accept-Encoding'
+    response['etag'] = etag
+    if cache:
+        age = settings.MP_CACHE_AGE['BROWSER'] if cache is True else cache
+        response['cache-control'] = 'max-age={}'.format( age )
+
+    log.debug_values("respond_api_encoded: %s", response)
+    return response
+
+def _accept_encodings( accept ):
+    """
+    Dict of codings in Accept-Encoding with their q-values;
+    codings with q=0 are refused
+    """
+    rv = {}
+    for item in accept.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float( value )
+                except ValueError:
+                    q = 0
+        rv[ coding ] = q
+    return rv
+
+def _etag_matches( etag, if_none_match ):
+    """
+    If-None-Match uses weak comparison against a list of ETags
+    """
+    if not if_none_match:
+        return False
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or ( tag[2:] if tag.startswith('W/') else tag ) == etag:
+            return True
+    return False
+
+def respond_api_encoded_call( request, encoded_fn, cache=False, methods=None ):
+    """
+    Version of respond_api_call for GET handlers that return
+    encode_api_response data (usually cached).
+    """
+    request.mpinfo['response_type'] = 'api'
+    error = u"We've experienced a network problem"
+    try:
+        methods = methods or ['GET']
+        if request.method not in methods:
+            log.info("SUSPECT API - %s bad method: %s -> %s",
+                        encoded_fn.__name__, request.mpipname, request.method)
+        else:
+            return respond_api_encoded( request, encoded_fn(), cache )
+
+    except Http404:
+        log.info2("API 404: %s -> %s", request.mpipname, request.uri)
+    except mpApiArgsNullIdException as e:
+        log.info("SUSPECT API: %s, %s -> %s", e, request.mpipname, request.uri)
+
+    return respond_api( {}, error=error, cache=cache )
+
 def respond_api_call( request, handler_or_payload=None, cache=False, methods=None ):
     """
     MPF supports GET, POST, PUT, and PATCH for API calls.
@@ -4,37 +4,31 @@
 
     This code only interacts with CF to generate signed URLs;
     configuration of CF is done with TerraForm.
+
+    Custom policies are signed with RSA-SHA1 through OpenSSL (cryptography),
+    with the private key loaded once per process.
+    Policy expiration is rounded up to a time bucket, so the same resource
+    signed within a bucket window has an identical policy, and the signed
+    policy is reused from a per-process LRU instead of being signed again.
 """
-import rsa
-from botocore.signers import CloudFrontSigner
+import json
+import time
+from base64 import b64encode
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding
 from django.conf import settings
 
 from .. import log
-from ..utils import timedelta_future
-
+from ..utils.collections import LruCache
 
-def cf_signer():
-    """
-    Cache creation of CloudFrontSigner.
-    """
-    global _cf_signer
-    if not _cf_signer:
-        key_id = settings.MP_ROOT_AWS['CF_KEY_ID']
-        log.debug("Caching new CF signer: %s", key_id)
 
-        key = rsa.PrivateKey.load_pkcs1( settings.MP_ROOT_AWS['CF_KEY'] )
+_SETTINGS = settings.MP_TUNING.get( 'CF_SIGNING', {} )
 
-        def rsa_signer( message ):
-            # CF requires bytes and SHA-1; due to different paths through
-            # CloudFrontSigner, message may have already been converted
-            if not isinstance( message, bytes ):
-                message = message.encode()
-            return rsa.sign( message, key, 'SHA-1' )
-
-        _cf_signer = CloudFrontSigner( key_id, rsa_signer )
-
-    return _cf_signer
-_cf_signer = None
+# Largest number of seconds expiration is extended to share policies;
+# for short timeouts the bucket is limited to a fraction of the timeout
+_BUCKET = _SETTINGS.get( 'BUCKET_SECONDS', 60 )
+_BUCKET_FRACTION = 10
 
 
 def get_signed_url( url, seconds, ip=None ):
@@ -42,29 +36,65 @@ def get_signed_url( url, seconds, ip=None ):
     Returns a ready-to-go signed URL based on root CF setup, the folder
     associated with the URL, and seconds/ip options.
     """
-    policy = _custom_policy( url, seconds )
-
-    rv = cf_signer().generate_presigned_url( url, policy=policy )
+    policy, signature = _signed_policy( url, seconds )
+    rv = '{}{}Policy={}&Signature={}&Key-Pair-Id={}'.format(
+                url, '&' if '?' in url else '?', policy, signature, _key_id() )
 
-    log.aws("Created CF signed url: %s, %s => %s", url, policy, rv)
+    log.aws("Created CF signed url: %s => %s", url, rv)
     return rv
 
 def get_signed_cookies( url, seconds, ip=None ):
     """
     Returns cookies for protected URL based on root CF and options.
     """
-    signer = cf_signer()
-    policy = _custom_policy( url, seconds )
-    signature = signer.rsa_signer( policy )
+    policy, signature = _signed_policy( url, seconds )
     cookies = {
-        'CloudFront-Policy': signer._url_b64encode( policy.encode() ).decode(),
-        'CloudFront-Signature': signer._url_b64encode( signature ).decode(),
-        'CloudFront-Key-Pair-Id': signer.key_id,
+        'CloudFront-Policy': policy,
+        'CloudFront-Signature': signature,
+        'CloudFront-Key-Pair-Id': _key_id(),
         }
-    log.aws("Created CF signed cookies: %s, %s => %s", url, policy, cookies)
+    log.aws("Created CF signed cookies: %s => %s", url, cookies)
     return cookies
 
+def _signed_policy( url, seconds ):
+    """
+    Returns encoded ( policy, signature ), reusing signature for
+    the url within the time bucket
+    """
+    bucket = max( 1, min( _BUCKET, int( seconds ) // _BUCKET_FRACTION ) )
+    expire = -( -( int( time.time() ) + int( seconds ) ) // bucket ) * bucket
+    key = ( url, expire )
+    rv = _signatures.get( key )
+    if rv is None:
+        policy = json.dumps( { 'Statement': [ {
+                    'Resource': url,
+                    'Condition': { 'DateLessThan': { 'AWS:EpochTime': expire } },
+                    } ] }, separators=( ',', ':' ) ).encode()
+        rv = ( _url_b64( policy ), _url_b64( _sign( policy ) ) )
+        _signatures.set( key, rv )
+        log.debug2("CF policy signed: %s, %s", url, expire)
+    return rv
+
+_signatures = LruCache( _SETTINGS.get( 'SIGNATURES', 4096 ) )
+
+def _sign( message ):
+    # CF requires SHA-1 with PKCS1 v1.5 padding
+    return _private_key().sign( message, padding.PKCS1v15(), hashes.SHA1() )
+
+def _private_key():
+    global _key
+    if _key is None:
+        log.debug("Loading CF signing key: %s", _key_id())
+        key = settings.MP_ROOT_AWS['CF_KEY']
+        _key = serialization.load_pem_private_key(
+                    key.encode() if isinstance( key, str ) else key, password=None )
+    return _key
+_key = None
+
+def _key_id():
+    return settings.MP_ROOT_AWS['CF_KEY_ID']
 
-def _custom_policy( url, seconds ):
-    expire = timedelta_future( seconds=seconds )
-    return cf_signer().build_policy( url, expire )
+def _url_b64( data ):
+    # CF variant of base64 that is safe in urls
+    return b64encode( data ).replace( b'+', b'-' ).replace(
+                b'=', b'_' ).replace( b'/', b'~' ).decode()
@@ -17,10 +17,12 @@ from ..utils.http import cache_control_dict
 from ..utils.http import attachment_string
 from ..utils.http import append_querystring
 from . import get_resource
+from .s3_bulk import BulkS3
 
 
 # May need to tune copy concurrency based on server and usage
-_copy_config = TransferConfig( max_concurrency=2 )
+_copy_config = TransferConfig( max_concurrency=settings.MP_TUNING.get(
+                    'S3_BULK', {} ).get( 'TRANSFER_THREADS', 4 ) )
 
 
 def get_s3():
@@ -88,6 +90,177 @@ def upload_protected( filepath, s3key, extra=_protected_extra ):
         log.exception("S3 protected upload: %s -> %s", filepath, s3key)
     return rv
 
+def upload_protected_fileobj( fileobj, s3key, extra=None ):
+    """
+    Upload from open binary file object, such as a spooled temp file
+    """
+    if not settings.MP_CLOUD:
+        return
+    log.info3("S3 PROTECTED UPLOAD fileobj: %s", s3key)
+    protected_bucket().upload_fileobj( fileobj, s3key, ExtraArgs=extra or {} )
+    return True
+
+def read_protected( s3key ):
+    """
+    Returns streaming body for the protected key, which can be read in
+    pieces without loading the object into memory
+    """
+    if not settings.MP_CLOUD:
+        return
+    return protected_bucket().Object( s3key ).get()['Body']
+
+def remove_protected_prefix( prefix ):
+    """
+    Remove all protected keys under the prefix; only use for temporary
+    work folders, as there is no sanity check on the number of keys
+    """
+    if not settings.MP_CLOUD or not prefix:
+        return
+    log.info3("S3 PROTECTED remove prefix: %s", prefix)
+    try:
+        protected_bucket().objects.filter( Prefix=prefix ).delete()
+    except Exception:
+        log.exception("S3 remove prefix: %s", prefix)
+
+
+def put_protected( s3key, data, metadata=None ):
+    """
+    Upload bytes already in memory
+    """
+    if not settings.MP_CLOUD:
+        return
+    log.debug2("S3 PROTECTED put: %s", s3key)
+    extra = _guess_type( s3key, _protected_extra )
+    protected_bucket().put_object( Key=s3key, Body=data,
+                Metadata=metadata or {}, **extra )
+    return True
+
+def protected_objects( prefix ):
+    """
+    Returns dict of protected keys under prefix with ( size, etag )
+    """
+    if not settings.MP_CLOUD:
+        return {}
+    return { obj.key: ( obj.size, obj.e_tag.strip('"') ) for obj in
+                protected_bucket().objects.filter( Prefix=prefix ) }
+
+def protected_metadata( s3key ):
+    try:
+        return protected_bucket().Object( s3key ).metadata
+    except Exception:
+        return {}
+
+
+class MultipartUpload:
+    """
+    Write a large object in parts as data is produced, so the
+    whole object is never held in memory or written to local disk.
+    S3 requires parts (except the last) to be at least 5MB.
+    """
+    MIN_PART = 5 * 1024 * 1024
+
+    def __init__( self, s3key, part_size=None, extra=_public_extra,
+                  protected=False, metadata=None ):
+        self.s3key = s3key
+        self.part_size = max( part_size or 0, self.MIN_PART )
+        self.parts = []
+        self.buffer = bytearray()
+        bucket = protected_bucket() if protected else public_bucket()
+        self.object = bucket.Object( s3key )
+        extra = _guess_type( s3key, _protected_extra if protected else extra )
+        if metadata:
+            extra = dict( extra, Metadata=metadata )
+        self.upload = self.object.initiate_multipart_upload( **extra )
+        log.info3("S3 multipart start: %s", s3key)
+
+    def write( self, data ):
+        self.buffer += data
+        while len( self.buffer ) >= self.part_size:
+            self._upload_part( self.buffer[ :self.part_size ] )
+            del self.buffer[ :self.part_size ]
+
+    def finish( self ):
+        if self.buffer or not self.parts:
+            self._upload_part( self.buffer )
+            self.buffer = bytearray()
+        self.upload.complete( MultipartUpload={ 'Parts': self.parts } )
+        log.info3("S3 multipart done: %s -> %s parts", self.s3key, len(self.parts))
+
+    def abort( self ):
+        try:
+            self.upload.abort()
+        except Exception:
+            log.exception("S3 multipart abort: %s", self.s3key)
+
+    def _upload_part( self, data ):
+        number = len( self.parts ) + 1
+        part = self.upload.Part( number )
+        response = part.upload( Body=bytes( data ) )
+        self.parts.append({ 'PartNumber': number, 'ETag': response['ETag'] })
+
+
+class RangeReader:
+    """
+    Read-only, seekable file over a protected object, using ranged
+    GETs with read-ahead; allows zip archives to be read in place.
+    Not thread safe; use a reader for each thread.
+    """
+
+    def __init__( self, s3key, read_ahead=4 * 1024 * 1024 ):
+        self.object = protected_bucket().Object( s3key )
+        self.size = self.object.content_length
+        self.read_ahead = read_ahead
+        self.pos = 0
+        self.buffer = b''
+        self.buffer_pos = 0
+
+    def seekable( self ):
+        return True
+
+    def readable( self ):
+        return True
+
+    def tell( self ):
+        return self.pos
+
+    def seek( self, offset, whence=0 ):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max( 0, offset )
+        return self.pos
+
+    def read( self, size=-1 ):
+        if size is None or size < 0:
+            size = self.size - self.pos
+        size = min( size, self.size - self.pos )
+        if size <= 0:
+            return b''
+        start = self.pos - self.buffer_pos
+        if start < 0 or start + size > len( self.buffer ):
+            self._fill( size )
+            start = 0
+        rv = self.buffer[ start:start + size ]
+        self.pos += len( rv )
+        return rv
+
+    def close( self ):
+        self.buffer = b''
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def _fill( self, size ):
+        end = min( self.size, self.pos + max( size, self.read_ahead ) ) - 1
+        response = self.object.get( Range='bytes={}-{}'.format( self.pos, end ) )
+        self.buffer = response['Body'].read()
+        self.buffer_pos = self.pos
+
+
 def copy_file( bucket, source_key, dest_key ):
     """
     Copy a file within public or protected bucket
@@ -124,12 +297,9 @@ def _guess_type( filepath, extra ):
     return rv
 
 
-# Largest number of granular keys that can be deleted at one time
-DELETE_MAX = 500
-
-def remove_folder_or_file( bucket, *args ):
+def remove_folder_or_file( bucket, *args, dry_run=False ):
     """
-    Remove the given key from S3
+    Remove the given key from 'public' or 'protected' bucket
 
     THIS WILL REMOVE ALL ITEMS UNDER A FOLDER
     This is intended for automated maintenance at a fine granularity,
@@ -137,6 +307,7 @@ def remove_folder_or_file( bucket, *args ):
 
     If bucket is configured for versioning, this will just
     create delete markers, so items could be recovered.
+    Returns BulkS3 with counts and dry-run manifest.
     """
 
     # If any args do not have values, abort, as it could cause
@@ -145,15 +316,8 @@ def remove_folder_or_file( bucket, *args ):
         log.error("S3 DELETE called with empty path arg: %s", args)
         return
 
-    if bucket:
-        key_prefix = join_urls( settings.MP_PLAYPEN, *args )
-        keys_to_remove = [ key for key in bucket.list( prefix = key_prefix ) ]
-
-        if len( keys_to_remove ) > DELETE_MAX:
-            log.error("S3 DELETE called on too many keys")
-            return
-
-        if keys_to_remove:
-            log.info("Removing %s keys from S3: %s", len( keys_to_remove ), keys_to_remove[:8])
-            bucket.delete_keys( keys_to_remove )
-            return True
+    bulk = BulkS3( bucket, dry_run=dry_run )
+    key_prefix = join_urls( settings.MP_PLAYPEN, *args )
+    log.info("Removing S3 keys %s: %s", bulk, key_prefix)
+    bulk.delete_prefix( key_prefix )
+    return bulk
@@ -0,0 +1,238 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Bulk S3 operations
+
+    Listing, copying, uploading, and deleting large numbers of keys is
+    run as a pipeline; keys are listed page by page and fed to a bounded
+    pool of threads, so work starts with the first page and memory does
+    not grow with the number of keys.
+
+    S3 rate limits by prefix, so large operations can see SlowDown and
+    other throttle errors. These are retried with backoff, and a throttle
+    seen by one thread pauses all threads of the operation.
+
+    In dry-run mode nothing is changed; each operation that would be run
+    is added to a manifest, so maintenance tasks can report what they
+    would do before committing.
+
+    The boto3 client is passed in for testing with a local stand-in.
+"""
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+
+from .. import log
+from . import get_client
+
+
+_SETTINGS = settings.MP_TUNING.get( 'S3_BULK', {} )
+_PARALLEL = _SETTINGS.get( 'PARALLEL', 16 )
+_RETRIES = _SETTINGS.get( 'RETRIES', 6 )
+_BACKOFF = _SETTINGS.get( 'BACKOFF', 0.2 )
+_BACKOFF_MAX = _SETTINGS.get( 'BACKOFF_MAX', 20 )
+
+# Objects larger than single-request copy limit use managed copy
+_COPY_MAX = 5 * 1024 * 1024 * 1024
+_transfer_config = TransferConfig( max_concurrency=_SETTINGS.get( 'TRANSFER_THREADS', 4 ) )
+
+# Most keys that can be deleted in one request
+DELETE_MAX = 1000
+
+_THROTTLE_CODES = (
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+    'ServiceUnavailable', 'InternalError', 'RequestTimeout', '503',
+    )
+
+
+def bucket_name( bucket ):
+    """
+    Support 'public' and 'protected' names along with bucket names
+    """
+    if bucket == 'protected':
+        return settings.MP_AWS_BUCKET_PROTECTED
+    if bucket == 'public':
+        return settings.MP_AWS_BUCKET_PUBLIC
+    return bucket
+
+
+class BulkS3:
+    """
+    Pipelines for one bucket; counts and manifest accumulate over
+    all operations run with the instance.
+    """
+
+    def __init__( self, bucket='protected', parallel=None, dry_run=False,
+                  client=None ):
+        self.bucket = bucket_name( bucket )
+        self.client = client or get_client('s3')
+        self.parallel = parallel or _PARALLEL
+        self.dry_run = dry_run
+        self.manifest = []
+        self.counts = dict.fromkeys( ( 'listed', 'copied', 'uploaded',
+                                       'deleted', 'failed', 'retries' ), 0 )
+        self._lock = threading.Lock()
+        self._pause_until = 0
+
+    def __str__( self ):
+        return "s3bulk({}{})".format( self.bucket, ' DRY' if self.dry_run else '' )
+
+    @property
+    def available( self ):
+        return bool( self.client )
+
+    def list( self, prefix, bucket=None ):
+        """
+        Generator of ( key, size ) under the prefix
+        """
+        kwargs = { 'Bucket': bucket_name( bucket ) or self.bucket, 'Prefix': prefix }
+        while True:
+            page = self._call( self.client.list_objects_v2, **kwargs )
+            for obj in page.get( 'Contents', [] ):
+                self._count('listed')
+                yield obj['Key'], obj['Size']
+            if not page.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    def delete_prefix( self, prefix ):
+        """
+        Remove ALL KEYS UNDER PREFIX; if bucket is versioned this
+        creates delete markers, so items could be recovered.
+        """
+        if not prefix or not prefix.strip('/'):
+            log.error("S3 BULK delete called with empty prefix: %s", self)
+            return
+        return self.delete_keys( key for key, _size in self.list( prefix ) )
+
+    def delete_keys( self, keys ):
+        return self._pipeline( self._delete, _batches( keys, DELETE_MAX ) )
+
+    def copy_prefix( self, source_prefix, target_prefix, target_bucket=None ):
+        """
+        Copy keys under source prefix to the same relative keys
+        under target prefix
+        """
+        start = len( source_prefix )
+        return self.copy_keys( ( ( key, target_prefix + key[ start: ], size )
+                    for key, size in self.list( source_prefix ) ),
+                    target_bucket=target_bucket )
+
+    def copy_keys( self, items, target_bucket=None ):
+        """
+        Copy ( source, target ) or ( source, target, size ) items
+        """
+        target_bucket = bucket_name( target_bucket ) or self.bucket
+        return self._pipeline( lambda item: self._copy( target_bucket, *item ), items )
+
+    def upload_files( self, items ):
+        """
+        Upload ( local_path, key ) or ( local_path, key, extra ) items
+        """
+        return self._pipeline( lambda item: self._upload( *item ), items )
+
+    def _pipeline( self, fn, items ):
+        """
+        Feed items to pool, keeping a bounded number queued ahead
+        """
+        if not self.available and not self.dry_run:
+            log.debug("Skipping S3 bulk, client not available: %s", self)
+            return
+        slots = threading.BoundedSemaphore( self.parallel * 2 )
+        with ThreadPoolExecutor( max_workers=self.parallel,
+                    thread_name_prefix='s3bulk' ) as pool:
+            for item in items:
+                slots.acquire()
+                task = pool.submit( self._run, fn, item )
+                task.add_done_callback( lambda _task: slots.release() )
+        log.info2("S3 BULK %s: %s", self, self.counts)
+        return self.counts
+
+    def _run( self, fn, item ):
+        try:
+            fn( item )
+        except Exception:
+            log.exception("S3 BULK %s: %s", self, item)
+            self._count('failed')
+
+    def _delete( self, keys ):
+        if self._plan( 'delete', keys ):
+            return
+        response = self._call( self.client.delete_objects, Bucket=self.bucket,
+                    Delete={ 'Objects': [ { 'Key': key } for key in keys ],
+                             'Quiet': True } )
+        errors = response.get( 'Errors', [] )
+        if errors:
+            log.info("S3 BULK delete errors %s: %s -> %s", self, len(errors), errors[:4])
+        self._count( 'deleted', len( keys ) - len( errors ) )
+        self._count( 'failed', len( errors ) )
+
+    def _copy( self, target_bucket, source, target, size=None ):
+        if self._plan( 'copy', [ source, target, target_bucket ] ):
+            return
+        source_arg = { 'Bucket': self.bucket, 'Key': source }
+        if size is None or size > _COPY_MAX:
+            self._call( self.client.copy, source_arg, target_bucket, target,
+                        Config=_transfer_config )
+        else:
+            self._call( self.client.copy_object, CopySource=source_arg,
+                        Bucket=target_bucket, Key=target )
+        self._count('copied')
+
+    def _upload( self, path, key, extra=None ):
+        if self._plan( 'upload', [ path, key ] ):
+            return
+        self._call( self.client.upload_file, path, self.bucket, key,
+                    ExtraArgs=extra, Config=_transfer_config )
+        self._count('uploaded')
+
+    def _plan( self, operation, args ):
+        """
+        In dry run, add operation to manifest and return True
+        """
+        if self.dry_run:
+            with self._lock:
+                if operation == 'delete':
+                    self.manifest.extend( ( operation, key ) for key in args )
+                else:
+                    self.manifest.append( ( operation, *args ) )
+            return True
+
+    def _call( self, fn, *args, **kwargs ):
+        """
+        Call client with retries on throttling, pausing all threads
+        """
+        attempt = 0
+        while True:
+            delay = self._pause_until - time.time()
+            if delay > 0:
+                time.sleep( delay )
+            try:
+                return fn( *args, **kwargs )
+            except ClientError as e:
+                code = e.response.get( 'Error', {} ).get('Code')
+                if code not in _THROTTLE_CODES or attempt >= _RETRIES:
+                    raise
+            attempt += 1
+            delay = min( _BACKOFF_MAX, _BACKOFF * 2 ** attempt ) * random.uniform( 0.5, 1 )
+            with self._lock:
+                self._pause_until = max( self._pause_until, time.time() + delay )
+                self.counts['retries'] += 1
+            log.info2("S3 BULK throttled %s, retry %s: %s", self, attempt, code)
+
+    def _count( self, name, value=1 ):
+        with self._lock:
+            self.counts[ name ] += value
+
+def _batches( items, size ):
+    batch = []
+    for item in items:
+        batch.append( item )
+        if len( batch ) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -20,17 +20,26 @@ def get_sqs():
     return get_resource('sqs')
 
 def get_queue( name ):
+    """
+    Returns queue resource for the thread; queue urls are cached for
+    the process so the queue is only looked up by name once.
+    """
     if settings.MP_CLOUD:
         try:
             sqs = get_sqs()
             if name.startswith('http'):
                 return sqs.Queue( name )
-            else:
-                name = get_name( name )
-                return sqs.get_queue_by_name( QueueName=name )
+            url = _queue_urls.get( name )
+            if url:
+                return sqs.Queue( url )
+            queue = sqs.get_queue_by_name( QueueName=get_name( name ) )
+            _queue_urls[ name ] = queue.url
+            return queue
         except Exception as e:
             log.warning_quiet("SQS error getting: %s -> %s", name, e)
 
+_queue_urls = {}
+
 def get_name( name ):
     return '{}_{}.fifo'.format( settings.MP_PLAYPEN_SQS['NAME'], name )
 
@@ -0,0 +1,159 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Cache invalidation bus
+
+    Local buffers (and per-process registries) can't be cleared on other
+    servers by deleting keys, so without the bus, other servers keep
+    using buffered versions until the buffer timeout expires.
+    Invalidation of keys is published on the bus, and each process has
+    a listener thread that removes the buffered keys, so most
+    invalidation is seen by all servers almost immediately.
+
+    The bus is best effort; buffer timeouts are still the upper bound
+    on staleness if a message is lost (e.g., during a Redis failover).
+
+    In cloud, Redis pub/sub on the version cache connection is used.
+    For dev and test a local in-process bus is used; the current process
+    already removes its keys, so it only passes messages to test listeners.
+"""
+import os
+import json
+import threading
+from django.conf import settings
+from django.core.cache import caches
+
+from .. import log
+from ..deploy.server import mp_shutdown
+
+
+_enabled = settings.MP_TUNING['CACHE_INVALIDATION_BUS']
+_channel = 'mpinv:{}'.format( settings.MP_PLAYPEN_CACHE )
+
+# Handlers called with buffer keys on invalidation
+_handlers = []
+
+_LISTEN_WAIT = 2
+_RETRY_WAIT = 8
+
+
+def publish_invalidation( buffer_keys, buffer=None ):
+    """
+    Tell other processes to remove buffer_keys from local buffers.
+    If buffer isn't provided, all local buffers are tried.
+    """
+    for handler in _handlers:
+        handler( buffer_keys )
+    if not _enabled:
+        return
+    try:
+        message = json.dumps({
+            'sender': _sender(),
+            'keys': buffer_keys,
+            'buffer': buffer,
+            })
+        _bus.publish( message )
+        log.cache2("INVALIDATE BUS publish: %s", message)
+    except Exception:
+        log.exception("CACHE BUS publish: %s", buffer_keys)
+        if settings.MP_DEV_EXCEPTION:
+            raise
+
+def add_invalidation_handler( fn ):
+    """
+    Register process function to call with invalidated buffer keys,
+    both for invalidation in this process and from the bus.
+    """
+    _handlers.append( fn )
+
+def start_invalidation_listener():
+    """
+    Start listening for invalidation in this process; the listener
+    thread is a no-op for the local bus.
+    """
+    if _enabled and _bus.threaded:
+        thread = threading.Timer( 0, _listen )
+        thread.name = 'invalidate'
+        log.info("Starting cache invalidation listener: %s", os.getpid())
+        thread.start()
+
+def _listen():
+    while not mp_shutdown().started():
+        try:
+            _bus.listen( _handle_message )
+        except Exception:
+            log.exception("CACHE BUS listen")
+        mp_shutdown().wait( _RETRY_WAIT )
+    log.debug("Exiting cache invalidation listener")
+
+def _handle_message( message ):
+    try:
+        message = json.loads( message )
+        if message['sender'] == _sender():
+            return
+        buffer_keys = message['keys']
+        buffer = message.get('buffer')
+        buffers = [ buffer ] if buffer else [
+                    'local_small', 'local_medium', 'local_large' ]
+        for name in buffers:
+            caches[ name ].delete_many( buffer_keys )
+        for handler in _handlers:
+            handler( buffer_keys )
+        log.cache2("INVALIDATE BUS received: %s", message)
+    except Exception:
+        log.exception("CACHE BUS message: %s", message)
+
+def _sender():
+    # Identify this process so it can ignore its own messages; pid is
+    # checked on each call since workers may be forked after import
+    return '{}-{}'.format( settings.MP_IP_PRIVATE, os.getpid() )
+
+#--------------------------------------------------------------------
+
+class RedisBus:
+    """
+    Redis pub/sub using the version cache connection pool
+    """
+    threaded = True
+
+    def __init__( self ):
+        from django_redis import get_redis_connection
+        self._connection = get_redis_connection('version')
+
+    def publish( self, message ):
+        self._connection.publish( _channel, message )
+
+    def listen( self, handler ):
+        pubsub = self._connection.pubsub( ignore_subscribe_messages=True )
+        pubsub.subscribe( _channel )
+        try:
+            # Register thread for shutdown join, and wake up periodically
+            # to check for shutdown
+            mp_shutdown().wait( 0 )
+            while not mp_shutdown().started():
+                message = pubsub.get_message( timeout=_LISTEN_WAIT )
+                if message and message['type'] == 'message':
+                    data = message['data']
+                    handler( data.decode() if isinstance( data, bytes ) else data )
+        finally:
+            pubsub.close()
+
+
+class LocalBus:
+    """
+    In-process stand-in for dev and testing; messages are passed
+    immediately in the calling thread to any handlers added with listen.
+    """
+    threaded = False
+
+    def __init__( self ):
+        self._listeners = []
+
+    def publish( self, message ):
+        for handler in self._listeners:
+            handler( message )
+
+    def listen( self, handler ):
+        self._listeners.append( handler )
+
+
+_bus = RedisBus() if settings.MP_CLOUD else LocalBus()
@@ -3,8 +3,8 @@
     Implementation for MPF memoization caching/buffering,
     which is the primary mechanism for caching results.
 
-    Dill is used explicitly here to avoid serialization issues
-    with the default Pickle implementation.
+    Values are packed with the cache codec (see codec.py), so the same
+    bytes are placed in the distributed cache and local buffer.
 
     SECURE - Using pickle for caching (and queue/spooling) should
     be safe since there is no vector to replace the bitstream that
@@ -24,26 +24,33 @@
     to another unique cached value. The value for version_key is used
     in the key the version string for the main value to be returned.
 
-    The downside is TWO CACHE GETS are needed for retrievals (or more
-    if dependency chains of versions are used).
-    This overhead is offset by local buffering.
+    The downside is TWO CACHE GETS are needed for retrievals.
+    This overhead is offset by local buffering and the per-request version
+    memo; chained groups are resolved with one get_many (see groups.py).
 
     Caching has overhead so is intended for larger chunks vs. many
     fine-grained items. What to cache should be driven by measurement.
 """
-import pickle
 from django.conf import settings
 from django.core.cache import caches
 
 from .. import log
+from .codec import cache_encode
+from .codec import cache_decode
 from .version import cache_version
+from .l1 import L1_ENABLED
+from .l1 import l1_get
+from .l1 import l1_set
+from .stampede import Stamped
+from .stampede import single_flight_call
 from .utils import make_buffer_key
 from .utils import get_timeout
 
 
 def cache_function( wrapped_fn, key, cache='default', timeout=None,
             version_key=None, buffered='local_large', buffer_timeout=None,
-            no_set=False, punch_through=False ):
+            no_set=False, punch_through=False, local=False,
+            single_flight=False, serve_stale=False ):
     """
     Calls 'wrapped_fn' and caches return value.
 
@@ -58,51 +65,74 @@ def cache_function( wrapped_fn, key, cache='default', timeout=None,
 
     timeout - override default lifetime in distributed
     buffer_timeout - overide default buffer lifetime
+    local - opt-in for buffered values that callers never modify, to also
+        keep them as objects in the per-process L1 cache (see l1.py)
+    single_flight - opt-in for expensive values, so misses are rebuilt
+        once instead of in every request (see stampede.py)
+    serve_stale - with single_flight, return the previous value while
+        another worker rebuilds it
     punch_through - skips cache/buffer gets and forces wrapped_fn call
     no_set - prevents distributed cache set; supports creation of
         cache only checks that look for value placed by another
         function and return default value if not there.
     """
+    cache_name = cache
     cache = caches[ cache ]
 
     # If version, get from version cache if active or create new
     version = cache_version( version_key ) if version_key else None
 
-    # If value is in local buffer, use it
+    # If value is in process L1 or local buffer, use it
+    local = local and buffered and L1_ENABLED
     if not punch_through:
-        buffered_value = _buffer_get( buffered, cache, key, version )
+        if local:
+            local_value = l1_get( make_buffer_key( cache, key ), version )
+            if local_value is not None:
+                log.debug_on() and log.cache2("L1 HIT(%s) %s", key, version)
+                return local_value
+        buffered_value = _buffer_get( buffered, cache, key, version, local,
+                                      buffer_timeout )
         if buffered_value:
             return buffered_value
 
     # "op" used with debug logging, but hit in prod is minimal
     op = "NOP"
 
-    # Values in both distributed cache and buffer are picled bytes;
+    # Values in both distributed cache and buffer are encoded bytes;
     # keep track of both to avoid unnecessary packing/unpacking
     packed_rv = ''
     rv = None
 
+    # Single-flight functions get or rebuild distributed value together
+    single_flight = single_flight and not no_set
+    if single_flight:
+        rv, packed_rv, op = single_flight_call( wrapped_fn, cache, cache_name,
+                    key, version, timeout, serve_stale, punch_through )
+
     # Does the cache have the current value for this version of the key?
-    if not punch_through:
+    elif not punch_through:
         try:
             packed_rv = cache.get( key, version=version )
             if packed_rv is not None:
                 op = "HIT"
-                rv = pickle.loads( packed_rv )
+                rv = cache_decode( packed_rv )
+                # Value may have been set by a single-flight function
+                if isinstance( rv, Stamped ):
+                    rv = rv.value
         except Exception:
             log.exception("CACHE get: %s, version=%s", key, version)
             if settings.MP_DEV_EXCEPTION:
                 raise
 
     # If not cached, execute call
-    if rv is None:
+    if rv is None and not single_flight:
 
         rv = wrapped_fn()
 
         # Set the value in the distributed cache
         if rv is not None and not no_set:
             try:
-                packed_rv = pickle.dumps( rv )
+                packed_rv = cache_encode( rv, cache_name )
                 timeout = get_timeout( cache, timeout )
 
                 cache.set( key, packed_rv, version=version, timeout=timeout )
@@ -115,9 +145,12 @@ def cache_function( wrapped_fn, key, cache='default', timeout=None,
                 if settings.MP_DEV_EXCEPTION:
                     raise
 
-    # Buffer value from distributed cache or wrapped_fn
-    if rv is not None:
+    # Buffer value from distributed cache or wrapped_fn; stale values
+    # are not buffered, so the new value is picked up when ready
+    if rv is not None and op != "STALE":
         _buffer_set( buffered, packed_rv, cache, key, version, buffer_timeout )
+        if local and packed_rv:
+            _l1_set( buffered, rv, packed_rv, cache, key, version, buffer_timeout )
 
     if log.debug_on():
         log.cache("CACHE %s %s %s( %s : %s ) %s",
@@ -126,16 +159,21 @@ def cache_function( wrapped_fn, key, cache='default', timeout=None,
             '-> %s...' % str(packed_rv)[:128] if log.debug_on() > 1 else '')
     return rv
 
-def _buffer_get( buffered, cache, key, version ):
+def _buffer_get( buffered, cache, key, version, local, timeout ):
     """
     Check the local buffer for the cache value
     """
     if buffered:
         buffer_key = make_buffer_key( cache, key, version )
         try:
-            value = caches[ buffered ].get( buffer_key )
-            if value is not None:
-                value = pickle.loads( value )
+            packed = caches[ buffered ].get( buffer_key )
+            value = None
+            if packed is not None:
+                value = cache_decode( packed )
+                if isinstance( value, Stamped ):
+                    value = value.value
+                if local and value:
+                    _l1_set( buffered, value, packed, cache, key, version, timeout )
 
             if log.debug_on():
                 log.cache2("BUFFER %s(%s) %s", "MISS" if value is None else "HIT",
@@ -148,6 +186,10 @@ def _buffer_get( buffered, cache, key, version ):
             if settings.MP_DEV_EXCEPTION:
                 raise
 
+def _l1_set( buffered, value, packed, cache, key, version, timeout ):
+    timeout = get_timeout( caches[ buffered ], timeout )
+    l1_set( make_buffer_key( cache, key ), version, value, len( packed ), timeout )
+
 def _buffer_set( buffered, value, cache, key, version, timeout ):
     """
     Add value to local buffer.
@@ -3,13 +3,19 @@
     Cache invalidation
 
     Local buffer delete is optimization for updates to reflect immediately
-    in a request cycle -- VALUE IS STILL BUFFERED ON OTHER SERVERS!
+    in a request cycle; other servers remove buffered values when the
+    invalidation bus message is received (see bus.py).
+    Process L1 entries are keyed without version, so their keys are
+    published with the buffer keys; L1 removes them in its handler.
 """
 from django.conf import settings
 from django.core.cache import caches
 
 from .. import log
 from . import cache_version
+from .version import version_memo_discard
+from .bus import publish_invalidation
+from .l1 import l1_clear
 from .utils import make_full_key
 from .utils import make_buffer_key
 
@@ -33,6 +39,7 @@ def invalidate_cache_group( version_key ):
     every cache lookup, allowing groups of items to be invalidated at once.
     """
     log.debug("Invalidate group: %s", version_key)
+    version_memo_discard( version_key )
     _remove_key( version_key, caches['version'], buffer='local_small' )
 
 def _remove_key( key, cache, version=None, buffer=None ):
@@ -40,6 +47,7 @@ def _remove_key( key, cache, version=None, buffer=None ):
     Remove the remote key and locally buffered copies.
     """
     buffer_key = make_buffer_key( cache, key, version )
+    local_key = make_buffer_key( cache, key )
     if buffer:
        caches[ buffer ].delete( buffer_key )
     else:
@@ -51,6 +59,9 @@ def _remove_key( key, cache, version=None, buffer=None ):
     log.cache("INVALIDATE( %s %s )", key, version)
     cache.delete( key, version=version )
 
+    # Remove buffered copies on other servers
+    publish_invalidation( [ buffer_key, local_key ], buffer )
+
 #--------------------------------------------------------------------
 # Invalidation of entire caches
 
@@ -74,3 +85,4 @@ def clear_local_buffer():
     caches['local_small'].clear()
     caches['local_medium'].clear()
     caches['local_large'].clear()
+    l1_clear()
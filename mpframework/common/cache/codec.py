@@ -0,0 +1,170 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Cache value codec
+
+    Values sent to distributed caches are encoded as:
+      - JSON for dicts with only JSON-safe content, which is more
+        compact than pickle for typical option and bootstrap dicts
+      - bytes passed through as-is and not counted (in either phase),
+        since they are values already encoded and counted by cache_rv
+      - pickle at the highest protocol for everything else
+    Encoded values over a size threshold are compressed if that saves
+    enough space.
+
+    The first byte of encoded values identifies the format.
+    Pickles at protocol 2+ start with the PROTO opcode, so they are stored
+    without a header, and values written before the codec (pickled by
+    django_redis or cache_rv) are still read during rollout.
+
+    Some caches are shared across code versions (sessions, versions,
+    tasks), so servers still running code without the codec would fail
+    to read the new formats during a rolling deploy. Until WRITE is set,
+    the codec reads all formats but only writes plain pickles, which
+    are the same values the earlier code wrote.
+
+    SECURE - See discussion of pickle in common/cache/call_cache.py
+
+    Encoded and raw sizes are counted per cache in each process,
+    to measure savings.
+"""
+import json
+import zlib
+import pickle
+from django.conf import settings
+from django_redis.serializers.base import BaseSerializer
+
+try:
+    import lz4.frame as _lz4
+except ImportError:
+    _lz4 = None
+
+
+_SETTINGS = settings.MP_TUNING.get( 'CACHE_CODEC', {} )
+
+# Smallest encoded value to try compressing, and the most compressed
+# size (as fraction of encoded) that is worth storing
+_COMPRESS_MIN = _SETTINGS.get( 'COMPRESS_MIN', 2048 )
+_COMPRESS_RATIO = _SETTINGS.get( 'COMPRESS_RATIO', 0.85 )
+_COMPRESS_LEVEL = _SETTINGS.get( 'COMPRESS_LEVEL', 1 )
+_USE_LZ4 = _SETTINGS.get( 'LZ4', True ) and _lz4 is not None
+_JSON = _SETTINGS.get( 'JSON', True )
+_WRITE = _SETTINGS.get( 'WRITE', False )
+
+# Header bytes; pickles start with PROTO opcode, 0x80
+_JSON_H = b'J'
+_BYTES_H = b'B'
+_ZLIB_H = b'Z'
+_LZ4_H = b'L'
+
+_JSON_SCALARS = ( str, int, float, bool, type(None) )
+
+
+def cache_encode( value, name=None ):
+    """
+    Encode value into bytes for cache storage
+    """
+    if not _WRITE:
+        rv = pickle.dumps( value, pickle.HIGHEST_PROTOCOL )
+        if name and not isinstance( value, bytes ):
+            _count( name, len( rv ), len( rv ) )
+        return rv
+    if isinstance( value, bytes ):
+        return _BYTES_H + value
+    if _JSON and type( value ) is dict and _json_safe( value ):
+        rv = _JSON_H + json.dumps( value, separators=( ',', ':' ),
+                                   ensure_ascii=False ).encode()
+    else:
+        rv = pickle.dumps( value, pickle.HIGHEST_PROTOCOL )
+    raw = len( rv )
+    if raw >= _COMPRESS_MIN:
+        if _USE_LZ4:
+            compressed = _LZ4_H + _lz4.compress( rv )
+        else:
+            compressed = _ZLIB_H + zlib.compress( rv, _COMPRESS_LEVEL )
+        if len( compressed ) < raw * _COMPRESS_RATIO:
+            rv = compressed
+    if name:
+        _count( name, raw, len( rv ) )
+    return rv
+
+def cache_decode( data ):
+    """
+    Decode cache bytes, including values from before the codec
+    """
+    if not data:
+        return data
+    header = data[:1]
+    if header == _ZLIB_H:
+        data = zlib.decompress( data[1:] )
+        header = data[:1]
+    elif header == _LZ4_H:
+        data = _lz4.decompress( data[1:] )
+        header = data[:1]
+    if header == _JSON_H:
+        return json.loads( data[1:] )
+    if header == _BYTES_H:
+        return data[1:]
+    return pickle.loads( data )
+
+def codec_stats():
+    """
+    Counts per cache of values encoded, and raw and stored bytes
+    """
+    rv = {}
+    for name, ( count, raw, stored ) in _stats.items():
+        rv[ name ] = {
+            'values': count,
+            'raw': raw,
+            'stored': stored,
+            'saved': '{:.0%}'.format( 1 - stored / raw ) if raw else '',
+            }
+    return rv
+
+_stats = {}
+
+def _count( name, raw, stored ):
+    # Counts are informational, so not locked
+    count, raw_total, stored_total = _stats.get( name, ( 0, 0, 0 ) )
+    _stats[ name ] = ( count + 1, raw_total + raw, stored_total + stored )
+
+def _json_safe( value ):
+    """
+    True if value round-trips through JSON unchanged
+    """
+    if type( value ) is str:
+        return _utf8_safe( value )
+    if type( value ) is dict:
+        return all( type( k ) is str and _utf8_safe( k ) and _json_safe( v )
+                    for k, v in value.items() )
+    if type( value ) is list:
+        return all( _json_safe( v ) for v in value )
+    if type( value ) is float:
+        return value == value and value not in ( float('inf'), float('-inf') )
+    return type( value ) in _JSON_SCALARS
+
+def _utf8_safe( text ):
+    # Strings with lone surrogates can't be encoded, so are pickled
+    if text.isascii():
+        return True
+    try:
+        text.encode()
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+class CacheSerializer( BaseSerializer ):
+    """
+    django_redis serializer using the codec; the cache name is set in
+    cache OPTIONS as CODEC_NAME for size stats
+    """
+
+    def __init__( self, options ):
+        super().__init__( options=options )
+        self.name = options.get( 'CODEC_NAME', 'redis' )
+
+    def dumps( self, value ):
+        return cache_encode( value, self.name )
+
+    def loads( self, value ):
+        return cache_decode( value )
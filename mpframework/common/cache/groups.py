@@ -27,15 +27,13 @@
         Group name      (e.g., Model cache_group() or other string)
         Upstream chain  (e.g, Sandbox is separete from Sandbox->Provider)
 
-    The tradeoff - CHAINING REQUIRES MULTIPLE VERSION LOOKUPS
-    For example, a Sandbox group chained to Provider group requires 2 cache lookups
-    to fully resolve version key, so each cache get of a value needs 3 lookups.
-    This is mitigated by using local_small for version lookups.
-
     Chaining is implemented by storing a random string as the cached value
-    of an upstream group version_key, and adding it to key immediately downstream.
-    Downstream cache groups repeat the process, creating the chain.
-    When an upstream group key is deleted all key names downstream are obsolete
+    of each group version_key in the chain; the version for a group is built
+    from its upstream group's version plus its own random value.
+    Group version keys only depend on ids and namespace (not upstream values),
+    so the whole chain is resolved with one get_many (see cache_version_chain),
+    and is memoized for the request.
+    When an upstream group key is deleted all versions downstream are obsolete
     (after any buffering is expired).
     There is a race condition in intitually setting the random names of the upstream
     version values, but whoever was last will win, and any caching based on
@@ -49,12 +47,13 @@
 from django.conf import settings
 
 from . import invalidate_cache_group
-from . import cache_version
+from .version import cache_version_chain
 from .utils import make_full_key
 
 
 _sys_buffer_age = settings.MP_CACHE_AGE['BUFFER_VERSION_SYSTEM']
 _prov_buffer_age = settings.MP_CACHE_AGE['BUFFER_VERSION_PROVIDER']
+_buffer_age = settings.MP_CACHE_AGE['BUFFER_VERSION']
 
 
 #--- Global system grouping
@@ -64,15 +63,21 @@ def cache_group_system( namespace ):
     System group namespaces can be used directly for system-wide values
     and for cascading invalidation of items that depend on system values.
     """
-    group_key = _system_key( namespace )
-    return cache_version( group_key, version_prefix=group_key,
-                buffered=_sys_buffer_age )
+    _, base, links = _system_chain( namespace, True )
+    return cache_version_chain( links, base )
 
 def _system_key( namespace ):
     return make_full_key( 'cgsys', namespace, '' )
 
-def _system_upstream( namespace, system ):
-    return cache_group_system( namespace ) if system else namespace
+def _system_chain( namespace, system ):
+    """
+    Returns ( scope, base, links ) for the system part of a chain;
+    scope is used in downstream group keys.
+    """
+    if system:
+        group_key = _system_key( namespace )
+        return group_key, '', [ ( group_key, group_key, _sys_buffer_age ) ]
+    return namespace, namespace, []
 
 #--- Provider / Sandbox tenant grouping
 
@@ -81,23 +86,22 @@ def cache_group_provider( provider_id, namespace='tg', system=False ):
     Get cache_group_provider key namespace that optionally chains to the
     system invalidation scope.
     """
-    upstream = _system_upstream( namespace, system )
-    group_key = _provider_key( provider_id, upstream )
-    version_prefix = _provider_namespace( provider_id,  upstream )
-    return cache_version( group_key, version_prefix=version_prefix,
-                buffered=_prov_buffer_age )
+    _, base, links = _provider_link( provider_id,
+                *_system_chain( namespace, system ) )
+    return cache_version_chain( links, base )
 
 def _provider_key( provider_id, upstream ):
     return make_full_key( 'cgp', provider_id, upstream )
 
-def _provider_namespace( provider_id, namespace ):
-    return 'p{}{}'.format( provider_id, namespace )
+def _provider_link( provider_id, scope, base, links ):
+    scope = _provider_key( provider_id, scope )
+    return scope, base, links + [
+                ( scope, 'p{}'.format( provider_id ), _prov_buffer_age ) ]
 
-def _provider_upstream( provider_id, namespace, system ):
+def _provider_chain( provider_id, namespace, system ):
+    rv = _system_chain( namespace, system )
     if provider_id:
-        rv = cache_group_provider( provider_id, namespace, system )
-    else:
-        rv = _system_upstream( namespace, system )
+        rv = _provider_link( provider_id, *rv )
     return rv
 
 def cache_group_sandbox( sandbox_id, provider_id=None,
@@ -106,17 +110,14 @@ def cache_group_sandbox( sandbox_id, provider_id=None,
     Get cache_group_sandbox key namespace that optionally chains upstream
     to provider and/or system scope.
     """
-    upstream = _provider_upstream( provider_id, namespace, system )
-    group_key = _sandbox_key( sandbox_id, upstream )
-    version_prefix = _sandbox_namespace( sandbox_id, upstream )
-    return cache_version( group_key, version_prefix=version_prefix )
+    scope, base, links = _provider_chain( provider_id, namespace, system )
+    group_key = _sandbox_key( sandbox_id, scope )
+    links = links + [ ( group_key, 's{}'.format( sandbox_id ), _buffer_age ) ]
+    return cache_version_chain( links, base )
 
 def _sandbox_key( sandbox_id, upstream ):
     return make_full_key( 'cgs', sandbox_id, upstream )
 
-def _sandbox_namespace( sandbox_id, namespace ):
-    return 's{}{}'.format( sandbox_id, namespace )
-
 """
     To invalidate each group, need to delete the system, provider, or
     sandbox key which stores version used to cache items downstream
@@ -130,15 +131,15 @@ def invalidate_group_system( namespace ):
     invalidate_cache_group( _system_key( namespace ) )
 
 def invalidate_group_provider( provider_id, namespace='tg' ):
-    down1 = _provider_key( provider_id, _system_upstream( namespace, True ) )
-    down2 = _provider_key( provider_id, _system_upstream( namespace, False ) )
+    down1 = _provider_key( provider_id, _system_chain( namespace, True )[0] )
+    down2 = _provider_key( provider_id, _system_chain( namespace, False )[0] )
     invalidate_cache_group( down1 )
     invalidate_cache_group( down2 )
 
 def invalidate_group_sandbox( sandbox_id, provider_id=None, namespace='tg' ):
     down1 = _sandbox_key( sandbox_id,
-                _provider_upstream( provider_id, namespace, True ) )
+                _provider_chain( provider_id, namespace, True )[0] )
     down2 = _sandbox_key( sandbox_id,
-                _provider_upstream( provider_id, namespace, False ) )
+                _provider_chain( provider_id, namespace, False )[0] )
     invalidate_cache_group( down1 )
     invalidate_cache_group( down2 )
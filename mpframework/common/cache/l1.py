@@ -0,0 +1,82 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Per-process L1 object cache
+
+    Values buffered by cache_rv are also kept in each process as live
+    objects, so buffer hits don't need a shared buffer get and unpickle.
+    The shared server buffers (uWSGI caches, or LocMem in dev) are then
+    the L2 tier between processes and the distributed cache.
+
+    All buffers share one LRU bounded by entries and total size, where
+    size is the length of the value's encoded bytes.
+
+    Entries are keyed without their cache version and hold the version
+    they were loaded with; a version mismatch is a miss and the entry is
+    replaced when the new version is loaded, so old versions don't use
+    up the LRU. Entry lifetime is the buffer timeout, capped by TIMEOUT.
+    Keys are removed by cache invalidation and bus messages.
+
+    Values are shared by all requests in the process, so L1 is only used
+    by cache_rv functions that opt in with local=True, for values callers
+    never modify. Hits return a shallow copy of mutable values (with any
+    stash cleared), which protects object attributes but NOT nested values.
+"""
+import time
+from copy import copy
+from django.conf import settings
+
+from ..utils.collections import LruCache
+from .bus import add_invalidation_handler
+from .stash import clear_stashed_methods
+
+
+_SETTINGS = settings.MP_TUNING.get( 'CACHE_L1', {} )
+
+L1_ENABLED = _SETTINGS.get( 'ENABLED', True )
+_TIMEOUT = _SETTINGS.get( 'TIMEOUT', 300 )
+
+_IMMUTABLE = ( str, bytes, int, float, bool, tuple, frozenset, type(None) )
+
+
+def l1_get( key, version ):
+    """
+    Returns value for key loaded with version, or None
+    """
+    entry = _l1.get( key )
+    if entry is not None:
+        entry_version, value, expires = entry
+        if entry_version == version and expires > time.time():
+            return value if isinstance( value, _IMMUTABLE ) else _copy( value )
+        _l1.pop( key )
+        _stats['stale'] += 1
+
+def l1_set( key, version, value, size, timeout ):
+    """
+    Add value, keeping a copy if the caller may change it
+    """
+    if not isinstance( value, _IMMUTABLE ):
+        value = _copy( value )
+    timeout = min( timeout or _TIMEOUT, _TIMEOUT )
+    _l1.set( key, ( version, value, time.time() + timeout ), size )
+
+def l1_delete_many( keys ):
+    for key in keys:
+        _l1.pop( key )
+
+def l1_clear():
+    _l1.clear()
+
+def l1_stats():
+    return dict( _l1.stats, **_stats )
+
+_stats = { 'stale': 0 }
+
+def _copy( value ):
+    rv = copy( value )
+    clear_stashed_methods( rv )
+    return rv
+
+_l1 = LruCache( _SETTINGS.get( 'ENTRIES', 4096 ),
+                _SETTINGS.get( 'SIZE', 64 * 1024 * 1024 ) )
+
+add_invalidation_handler( l1_delete_many )
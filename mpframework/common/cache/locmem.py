@@ -23,10 +23,10 @@ class mpLocMemCache( LocMemCache ):
             if matches and all( matches ):
                 yield key
 
-    def get_many( self, keys, **kwargs ):
+    def get_many( self, keys, version=None, **kwargs ):
         rv = {}
         for key in keys:
-            value = self._cache.get( key )
+            value = self.get( key, version=version )
             if value:
                 rv[ key ] = value
         return rv
@@ -0,0 +1,206 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Single-flight rebuilds for cache_rv
+
+    When a cache group is invalidated, every request that misses an
+    expensive value would rebuild it at the same time. Functions that
+    opt in with single_flight only rebuild in one place:
+      - threads in a process wait on a local lock, then use the value
+        set by the thread that rebuilt it
+      - processes and servers race for a short lock added in the
+        distributed cache; others poll for the value for a few seconds,
+        then rebuild anyway rather than fail
+    Locks are held briefly and expire, so a crash doesn't block rebuilds.
+
+    Values are stored with the time taken to compute them and their
+    expiration, so they can be refreshed early by one worker with
+    probability rising towards expiration (XFetch), before misses happen.
+
+    With serve_stale, the last value is also kept under a key without
+    the cache version, so while one worker rebuilds after invalidation,
+    others (including threads in the same process) return the previous
+    value instead of waiting.
+"""
+import os
+import math
+import time
+import random
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from django.conf import settings
+
+from .. import log
+from ..utils import get_random_key
+from .codec import cache_encode
+from .codec import cache_decode
+from .utils import get_timeout
+
+
+_SETTINGS = settings.MP_TUNING.get( 'CACHE_REBUILD', {} )
+_LOCK = _SETTINGS.get( 'LOCK_SECONDS', 10 )
+_WAIT = _SETTINGS.get( 'WAIT_SECONDS', 3 )
+_POLL = _SETTINGS.get( 'POLL_SECONDS', 0.05 )
+_BETA = _SETTINGS.get( 'EARLY_BETA', 1.0 )
+_STALE = _SETTINGS.get( 'STALE_SECONDS', 3600 )
+
+
+# Envelope for single-flight values in the distributed cache
+Stamped = namedtuple( 'Stamped', 'value delta expires' )
+
+
+def single_flight_call( wrapped_fn, cache, cache_name, key, version, timeout,
+                        serve_stale=False, punch_through=False ):
+    """
+    Get or rebuild value, returns ( rv, packed_rv, op )
+    """
+    if punch_through:
+        return _rebuild( wrapped_fn, cache, cache_name, key, version, timeout,
+                         serve_stale, "SET" )
+
+    stamped, packed = _get( cache, key, version )
+    if stamped is not None:
+        if not _refresh_due( stamped ) or not _lock( cache, key, version ):
+            return stamped.value, packed, "HIT"
+        try:
+            return _rebuild( wrapped_fn, cache, cache_name, key, version,
+                             timeout, serve_stale, "EARLY" )
+        finally:
+            _unlock( cache, key, version )
+
+    # Don't wait on a rebuild by another thread if stale value is available
+    if serve_stale and _local_busy( key, version ):
+        stamped, packed = _get( cache, _stale_key( key ) )
+        if stamped is not None:
+            return stamped.value, packed, "STALE"
+
+    with _local_lock( key, version ):
+        # Another thread may have rebuilt while waiting for local lock
+        stamped, packed = _get( cache, key, version )
+        if stamped is not None:
+            return stamped.value, packed, "LOCAL"
+
+        if _lock( cache, key, version ):
+            try:
+                return _rebuild( wrapped_fn, cache, cache_name, key, version,
+                                 timeout, serve_stale, "SET" )
+            finally:
+                _unlock( cache, key, version )
+
+        # Another process is rebuilding
+        if serve_stale:
+            stamped, packed = _get( cache, _stale_key( key ) )
+            if stamped is not None:
+                return stamped.value, packed, "STALE"
+        waited = 0
+        while waited < _WAIT:
+            time.sleep( _POLL )
+            waited += _POLL
+            stamped, packed = _get( cache, key, version )
+            if stamped is not None:
+                return stamped.value, packed, "WAIT"
+
+        log.info2("CACHE single flight wait expired: %s", key)
+        return _rebuild( wrapped_fn, cache, cache_name, key, version, timeout,
+                         serve_stale, "SET" )
+
+def _rebuild( wrapped_fn, cache, cache_name, key, version, timeout,
+              serve_stale, op ):
+    start = time.time()
+    rv = wrapped_fn()
+    if rv is None:
+        return None, '', "NOP"
+    packed = ''
+    try:
+        timeout = get_timeout( cache, timeout )
+        packed = cache_encode( Stamped( rv, time.time() - start,
+                                        time.time() + timeout ), cache_name )
+        cache.set( key, packed, version=version, timeout=timeout )
+        if serve_stale:
+            cache.set( _stale_key( key ), packed, timeout=timeout + _STALE )
+    except Exception:
+        log.exception("CACHE single flight set: %s -> %s", key, str(rv)[:256])
+        if settings.MP_DEV_EXCEPTION:
+            raise
+    return rv, packed, op
+
+def _get( cache, key, version=None ):
+    """
+    Returns ( stamped, packed ), upgrading values stored before opt-in
+    """
+    try:
+        packed = cache.get( key, version=version )
+        if packed is not None:
+            value = cache_decode( packed )
+            if not isinstance( value, Stamped ):
+                value = Stamped( value, 0, math.inf )
+            return value, packed
+    except Exception:
+        log.exception("CACHE single flight get: %s, version=%s", key, version)
+        if settings.MP_DEV_EXCEPTION:
+            raise
+    return None, None
+
+def _refresh_due( stamped ):
+    """
+    XFetch; early refresh is more likely closer to expiration and for
+    values that take longer to compute
+    """
+    if not stamped.delta:
+        return False
+    early = stamped.delta * _BETA * -math.log( 1.0 - random.random() )
+    return time.time() + early >= stamped.expires
+
+def _lock( cache, key, version ):
+    try:
+        return cache.add( _lock_key( key ), get_random_key( 8 ),
+                          timeout=_LOCK, version=version )
+    except Exception:
+        log.exception("CACHE single flight lock: %s", key)
+        return True
+
+def _unlock( cache, key, version ):
+    try:
+        cache.delete( _lock_key( key ), version=version )
+    except Exception:
+        log.exception("CACHE single flight unlock: %s", key)
+
+def _lock_key( key ):
+    return '{}|lock'.format( key )
+
+def _stale_key( key ):
+    return '{}|stale'.format( key )
+
+def _local_busy( key, version ):
+    with _locks_guard:
+        return ( key, version ) in _locks
+
+@contextmanager
+def _local_lock( key, version ):
+    """
+    Process lock for each key being rebuilt, removed when not in use
+    """
+    name = ( key, version )
+    with _locks_guard:
+        entry = _locks.get( name )
+        if entry is None:
+            entry = _locks[ name ] = [ threading.Lock(), 0 ]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                _locks.pop( name, None )
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _reset_after_fork():
+    global _locks_guard
+    _locks.clear()
+    _locks_guard = threading.Lock()
+
+os.register_at_fork( after_in_child=_reset_after_fork )
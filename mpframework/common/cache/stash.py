@@ -29,6 +29,7 @@
 from functools import wraps
 
 from .. import log
+from ..utils.fn import _arg_key
 from .utils import key_from_fn_sig
 
 
@@ -55,34 +56,77 @@ def stash_method_rv( func=None ):
     Methods that modify the state of the object in a way that will persist
     for the life of the object are ok, but be careful.
 
-    Stashing automatically turns args and kwargs into hashed keys; don't
-    use if there is a lot of variance, or that is expensive or unworkable.
+    Stash keys are made as cheaply as possible:
+      - methods called with no arguments use the method name
+      - hashable arguments are added to the name in a tuple, with
+        objects that have IDs (models, requests) reduced to the ID
+      - unhashable arguments are serialized and hashed, which has
+        overhead; don't use if there is a lot of variance, or that
+        is expensive or unworkable.
 
-    Stashed values are typically cleared before caching an object, but do
-    use stable sha1 hash so can be cached with object.
+    Stashed values are typically cleared before caching an object.
     """
     def decorator( fn ):
+        name = fn.__name__
+
         @wraps( fn )
         def wrapper( self, *args, **kwargs ):
-            op = "NOP"
-            stash = getattr( self, STASH_NAME, {} )
+            stash = getattr( self, STASH_NAME, None )
+            if stash is None:
+                stash = {}
+                setattr( self, STASH_NAME, stash )
 
-            stash_name = key_from_fn_sig( '', fn.__name__, args, kwargs )
-            rv = stash.get( stash_name )
+            if args or kwargs:
+                stash_name = _args_key( name, args, kwargs )
+            else:
+                stash_name = name
+                _stats['no_args'] += 1
 
+            rv = stash.get( stash_name )
             if rv is not None:
                 op = "GET"
+                _stats['hits'] += 1
             else:
+                op = "NOP"
+                _stats['misses'] += 1
                 rv = fn( self, *args, **kwargs )
                 if rv is not None:
                     op = "SET"
                     stash[ stash_name ] = rv
-                    setattr( self, STASH_NAME, stash )
 
             if log.debug_on():
-                log.cache3("STASH %s %s%s, addr:%s",
+                log.cache3("STASH %s %s.%s, addr:%s",
                        op, self.__class__.__name__, stash_name, id(self))
             return rv
         return wrapper
     return decorator( func ) if func else decorator
 
+def stash_stats():
+    """
+    Per-process counts of stash lookups and how keys were made
+    """
+    return dict( _stats )
+
+_stats = dict.fromkeys( ( 'hits', 'misses', 'no_args', 'hashed', 'serialized' ), 0 )
+
+def _args_key( name, args, kwargs ):
+    """
+    Tuple key if arguments are hashable, otherwise serialized hash
+    Arguments are reduced to IDs the same way as key_from_arguments, so
+    models and requests are not held in the stash; other values carry
+    their type so 1, True, and 1.0 don't share a key.
+    """
+    key = ( name, tuple( _tuple_arg( arg ) for arg in args ) )
+    if kwargs:
+        key += ( tuple( sorted( ( k, _tuple_arg( v ) ) for k, v in kwargs.items() ) ), )
+    try:
+        hash( key )
+        _stats['hashed'] += 1
+        return key
+    except TypeError:
+        _stats['serialized'] += 1
+        return key_from_fn_sig( '', name, args, kwargs )
+
+def _tuple_arg( arg ):
+    key = _arg_key( arg )
+    return ( type( arg ), key ) if key is arg else key
@@ -5,6 +5,7 @@
     MPF uses random strings as version keys for cache group invalidation.
     See call_cache.py for more details.
 """
+import threading
 from django.conf import settings
 from django.core.cache import caches
 
@@ -26,6 +27,31 @@ _buffer = caches['local_small']
 """
 VERSION_KEY_LEN = 8
 
+"""
+    Per-request version memo
+    Version values don't need to be fetched from buffer or distributed cache
+    more than once in a request cycle, so version lookups are memoized in
+    thread local storage between version_memo_start and version_memo_end.
+    Outside of a request (e.g., tasks) there is no memo.
+    Local invalidation removes memo entries so updates made in a request
+    are still reflected immediately in that request.
+"""
+_request = threading.local()
+
+def version_memo_start():
+    _request.versions = {}
+
+def version_memo_end():
+    _request.versions = None
+
+def version_memo_discard( key ):
+    memo = _memo()
+    if memo:
+        memo.pop( key, None )
+
+def _memo():
+    return getattr( _request, 'versions', None )
+
 
 def cache_version( key, version_prefix='', version_fn=None, force_set=False,
             buffered=settings.MP_CACHE_AGE['BUFFER_VERSION'], timeout=None ):
@@ -55,13 +81,23 @@ def cache_version( key, version_prefix='', version_fn=None, force_set=False,
     "timeout" changes the distributed cache version timeout from default.
     """
     assert key
+    memo = _memo() if buffered else None
     try:
+        # Only go to buffer or cache once per request
+        if memo and not force_set:
+            version = memo.get( key )
+            if version:
+                log.cache3("VERSION MEMO(%s) %s", key, version)
+                return version
+
         # First check local buffer (if not forcing set)
         if buffered:
             buffer_key = make_buffer_key( _cache, key )
             version = not force_set and _buffer.get( buffer_key )
             if version:
                 log.cache3("VERSION BUFFER(%s) %s", buffer_key, version)
+                if memo is not None:
+                    memo[ key ] = version
                 return version
 
         # Next try to get from distributed cache (if not forcing set)
@@ -90,6 +126,8 @@ def cache_version( key, version_prefix='', version_fn=None, force_set=False,
         # cache -- if set when from buffer would perpetuate infinitely
         if buffered and version:
             _buffer.set( buffer_key, version, timeout=buffered )
+            if memo is not None:
+                memo[ key ] = version
 
         return version
 
@@ -97,3 +135,74 @@ def cache_version( key, version_prefix='', version_fn=None, force_set=False,
         log.exception("CACHE VERSION: %s", key)
         if settings.MP_DEV_EXCEPTION:
             raise
+
+def cache_version_chain( links, base='' ):
+    """
+    Resolve a chain of version groups with at most one local buffer
+    get_many and one distributed get_many, instead of a round trip
+    for each link in the chain.
+
+    "links" are ( key, prefix, buffered ) tuples, upstream first. Link keys
+    DO NOT depend on upstream values, so all keys in the chain are known
+    up front; instead each link's version includes the upstream version,
+    so deleting any upstream key changes the version of every
+    downstream group in the chain:
+
+        prefix + upstream_version + '(' + random_value + ')'
+
+    "base" is used as the upstream version of the first link.
+
+    Returns version string for the last link in the chain.
+    """
+    assert links
+    memo = _memo()
+    values = {}
+    try:
+        if memo:
+            for key, _, _ in links:
+                value = memo.get( key )
+                if value:
+                    values[ key ] = value
+
+        # Check all buffered links with one local call
+        buffer_keys = { make_buffer_key( _cache, key ): key for
+                    key, _, buffered in links if buffered and key not in values }
+        if buffer_keys:
+            for buffer_key, value in _buffer.get_many( list(buffer_keys) ).items():
+                if value:
+                    values[ buffer_keys[ buffer_key ] ] = value
+
+        # Remaining links in one distributed call, creating any missing
+        missing = [ link for link in links if link[0] not in values ]
+        if missing:
+            found = _cache.get_many([ key for key, _, _ in missing ])
+            new_values = {}
+            for key, _, buffered in missing:
+                value = found.get( key )
+                if not value:
+                    value = get_random_key( VERSION_KEY_LEN )
+                    new_values[ key ] = value
+                values[ key ] = value
+                if buffered:
+                    _buffer.set( make_buffer_key( _cache, key ), value,
+                                timeout=buffered )
+            if new_values:
+                _cache.set_many( new_values, timeout=get_timeout( _cache, None ) )
+                log.debug_on() and log.debug("CACHE VERSION CHAIN new: %s",
+                                                new_values)
+
+        if memo is not None:
+            memo.update( values )
+
+        version = base
+        for key, prefix, _ in links:
+            version = '{}{}({})'.format( prefix, version, values[ key ] )
+
+        log.debug_on() and log.cache2("VERSION CHAIN(%s) %s%s", links[-1][0],
+                    version, " (%s remote)" % len(missing) if missing else '')
+        return version
+
+    except Exception:
+        log.exception("CACHE VERSION CHAIN: %s", links)
+        if settings.MP_DEV_EXCEPTION:
+            raise
@@ -65,6 +65,20 @@ def mp_atexit( *args ):
         _shutdown.exit_wait = True
         for thread in _shutdown.threads.values():
             thread.join()
+        for handler in reversed( _shutdown.handlers ):
+            try:
+                handler()
+            except Exception:
+                log.exception("SHUTDOWN handler: %s", handler)
+
+def add_shutdown_handler( fn ):
+    """
+    Register fn to call once when the process exits (including uwsgi
+    worker recycling), after threads have finished, e.g., to send
+    buffered work. Handlers are called in reverse order of registration,
+    so modules are flushed before the modules they depend on.
+    """
+    _shutdown.handlers.append( fn )
 
 @atexit.register
 def _python_exit( *args ):
@@ -76,6 +90,7 @@ class Shutdown:
         self._shutting_down = False
         self._shutdown_event = threading.Event()
         self.threads = {}
+        self.handlers = []
         self.exit_wait = False
 
     def started( self ):
@@ -11,10 +11,14 @@
     already exists in the DB.
     Option reads are cached in default cache, with invalidation
     controlled by the caller.
+    Each process holds all options as one read-only snapshot, so
+    option access is a dict read; the snapshot is reloaded with one
+    cache read when the system options group version changes.
 
     Options use MP_PLAYPEN_OPTIONS namespace. By default
     DEV SERVER OPTIONS ARE SEPARATE FROM PRODUCTION SERVERS.
 """
+from types import MappingProxyType
 from django.conf import settings
 
 from mpframework.common import log
@@ -55,6 +59,7 @@ def init_option_accessors( context, options ):
     """
     for option in options:
         log.detail3("Adding global option accessor: %s", option)
+        _defaults[ option[0] ] = option[1]
 
         def wrapper( value=None, name=option[0], default=option[1],
                         invalidate=False, root=None ):
@@ -69,6 +74,9 @@ def init_option_accessors( context, options ):
 
         context[ option[0] ] = wrapper
 
+# Names and defaults of all options in the snapshot
+_defaults = {}
+
 # Initialize options on module load, so they are available immediately
 # They may be overridden later
 init_option_accessors( globals(),
@@ -78,16 +86,31 @@ init_option_accessors( globals(),
 def _fixup( name ):
     return '%s_%s' % ( settings.MP_PLAYPEN_OPTIONS, name )
 
-@cache_rv( keyfn=lambda name, _:( _fixup(name),
-            cache_group_system( namespace='options' ) ),
-            buffered='local_medium' )
 def _get_option( name, default ):
     """
-    For caching option access assume names are unique; args are not needed.
+    Options are read from the process snapshot; values are shared
+    by all callers and should not be modified.
     """
-    name = _fixup( name )
-    rv = root().policy.get( name, default=default )
-    log.debug("Global option get %s: %s", name, rv)
+    global _snapshot
+    version = cache_group_system( namespace='options' )
+    snapshot = _snapshot
+    if snapshot[0] != version:
+        snapshot = ( version, MappingProxyType( _load_options( version ) ) )
+        _snapshot = snapshot
+    return snapshot[1].get( name, default )
+
+_snapshot = ( None, MappingProxyType({}) )
+
+@cache_rv( keyfn=lambda version:( _fixup('options_snapshot'), version ) )
+def _load_options( version ):
+    """
+    Load all options from root sandbox policy in one cached value
+    """
+    policy = root().policy
+    rv = {}
+    for name, default in _defaults.items():
+        rv[ name ] = policy.get( _fixup( name ), default=default )
+    log.debug("Global options loaded %s: %s", version, rv)
     return rv
 
 def _put_option( root_sandbox, name, value ):
@@ -10,6 +10,10 @@
     Regular expression matching is supported, but since the logic
     needs to be supported for DB searches, the scope of regex
     will be limited to the DB support.
+
+    Match expressions are compiled once into cached matchers, and sets
+    of expressions (e.g., a user's licenses) can be compiled into an
+    index to find which sets match content tags.
 """
 import re
 from django.db.models import Q
@@ -17,6 +21,7 @@ from django.core.validators import RegexValidator
 from django.conf import settings
 
 from . import log
+from .utils.collections import LruCache
 
 
 # Django validator for content item tags
@@ -36,61 +41,152 @@ def tag_match( tag, tag_matches ):
     rv = False
     tag = str( tag ).strip()
     if tag:
-        tag = tag.lower()
-        # Exact match
-        rv = tag in tag_matches
-        # Otherwise check case and wildcard matching
-        if not rv:
-            for tm in tag_matches:
-                rv = _tag_match( tm, tag )
-                if rv:
-                    break
+        rv = tag_matcher( tag_matches ).match( tag.lower() )
+    return rv
+
+def tag_matcher( tag_matches ):
+    """
+    Returns compiled matcher for the tag match expressions, which
+    is shared in the process
+    """
+    key = tuple( tag_matches )
+    rv = _matchers.get( key )
+    if rv is None:
+        rv = TagMatcher( key )
+        _matchers.set( key, rv )
     return rv
 
-def _tag_match( match_tag, item_tag ):
+def tag_index( tag_matches_list ):
+    """
+    Returns compiled index for a sequence of tag match tuples, which
+    is shared in the process
+    """
+    key = tuple( tuple( tm ) for tm in tag_matches_list )
+    rv = _indexes.get( key )
+    if rv is None:
+        rv = TagIndex( key )
+        _indexes.set( key, rv )
+    return rv
+
+_matchers = LruCache( settings.MP_TUNING['TAG_MATCH']['MATCHERS'] )
+_indexes = LruCache( settings.MP_TUNING['TAG_MATCH']['INDEXES'] )
+
+
+class TagMatcher:
+    """
+    Tag match expressions parsed once into test functions.
+    Match tags must be stripped and lower case.
+    """
+
+    def __init__( self, tag_matches ):
+        self.exact = frozenset( tag_matches )
+        self.tests = [ _compile_tag_match( tm ) for tm in tag_matches ]
+
+    def match( self, tag ):
+        # Exact match, otherwise check case and wildcard matching
+        return tag in self.exact or any( test( tag ) for test in self.tests )
+
+
+class TagIndex:
+    """
+    Answers which of a list of tag match sets match a tag, without
+    testing each set.
+    Exact, prefix ('abc*') and suffix ('*abc') expressions are looked up
+    in maps with the tag's prefixes and suffixes; other expressions
+    (contains, embedded wildcards, regex, negation) are tested directly.
+    """
+
+    def __init__( self, tag_matches_list ):
+        self.exact = {}
+        self.prefixes = {}
+        self.suffixes = {}
+        self.residual = []
+        for n, tag_matches in enumerate( tag_matches_list ):
+            for tm in tag_matches:
+                self.exact.setdefault( tm, set() ).add( n )
+                if tm.startswith(( NEGATION_DELIM, REGEX_DELIM )):
+                    self.residual.append( ( n, _compile_tag_match( tm ) ) )
+                elif '*' not in tm:
+                    continue
+                elif tm.endswith('*') and '*' not in tm[ :-1 ]:
+                    self.prefixes.setdefault( tm[ :-1 ], set() ).add( n )
+                elif tm.startswith('*') and '*' not in tm[ 1: ]:
+                    self.suffixes.setdefault( tm[ 1: ], set() ).add( n )
+                else:
+                    self.residual.append( ( n, _compile_tag_match( tm ) ) )
+
+    def match( self, tags ):
+        """
+        Returns sorted positions of tag match sets that match any of
+        the stripped, lower case tags
+        """
+        rv = set()
+        for tag in tags:
+            if not tag:
+                continue
+            rv.update( self.exact.get( tag, () ) )
+            for i in range( len( tag ) + 1 ):
+                if self.prefixes:
+                    rv.update( self.prefixes.get( tag[ :i ], () ) )
+                if self.suffixes:
+                    rv.update( self.suffixes.get( tag[ i: ], () ) )
+            for n, test in self.residual:
+                if n not in rv and test( tag ):
+                    rv.add( n )
+        return sorted( rv )
+
+def _compile_tag_match( match_tag ):
+    """
+    Returns function that tests an item tag against one match expression
+    """
     # EXACT MATCH ALREADY HANDLED
 
     # Setup for one return with negation
-    rv = False
     negative = False
     if match_tag.startswith( NEGATION_DELIM ):
         negative = True
         match_tag = match_tag.strip( NEGATION_DELIM )
 
     # Regular expression match
+    match_re = None
     if match_tag.startswith( REGEX_DELIM ):
         try:
             match_tag = match_tag.strip( REGEX_DELIM )
             match_re = re.compile( match_tag, re.IGNORECASE )
-            rv = match_re.match( item_tag )
         except Exception as e:
             log.info("CONFIG - Bad regex tag match: %s -> %s", match_tag, e)
             if settings.MP_DEV_EXCEPTION:
                 raise
 
-    if not rv:
-        # Embedded wildcard by checking for fragments between
-        # wildcards in the order they are presented by removing
-        # each match as it occurs
-        match_text = match_tag.strip('*')
-        frags = match_text.split('*')
-        if len( frags ) > 1:
-            rv = True
+    # Embedded wildcard by checking for fragments between
+    # wildcards in the order they are presented by removing
+    # each match as it occurs
+    match_text = match_tag.strip('*')
+    frags = match_text.split('*')
+    if len( frags ) > 1:
+        def wildcard( item_tag ):
             for frag in frags:
                 if frag in item_tag:
                     item_tag = item_tag.replace( frag, '', 1 )
                 else:
-                    rv = False
-                    break
-        # Check wildcards on the ends
-        elif match_tag.startswith('*') and match_tag.endswith('*'):
-            rv = match_text in item_tag
-        elif match_tag.startswith('*'):
-            rv = item_tag.endswith( match_text )
-        elif match_tag.endswith('*'):
-            rv = item_tag.startswith( match_text )
-
-    return bool(rv) ^ negative
+                    return False
+            return True
+    # Check wildcards on the ends
+    elif match_tag.startswith('*') and match_tag.endswith('*'):
+        wildcard = lambda item_tag: match_text in item_tag
+    elif match_tag.startswith('*'):
+        wildcard = lambda item_tag: item_tag.endswith( match_text )
+    elif match_tag.endswith('*'):
+        wildcard = lambda item_tag: item_tag.startswith( match_text )
+    else:
+        wildcard = lambda _: False
+
+    def test( item_tag ):
+        rv = match_re and match_re.match( item_tag )
+        if not rv:
+            rv = wildcard( item_tag )
+        return bool(rv) ^ negative
+    return test
 
 
 def tags_Q( tags, tag_field='tag' ):
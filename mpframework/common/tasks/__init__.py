@@ -25,6 +25,7 @@ def get_module_name( obj ):
 from .mp_async import mp_async
 from .queue_send import send_queue_task
 from .queue_send import run_queue_function
+from .queue_send import flush_queue_tasks
 from .poller import start_task_polling
 from .spooler import spool_handler
 from .spooler import spool_breathe
@@ -0,0 +1,332 @@
+#--- Mesa Platform, Copyright 2021 Vueocity, LLC
+"""
+    Local task executor
+
+    Optional replacement for uwsgi spool files as the local buffer for
+    tasks received by pollers. Tasks are held in memory in priority
+    lanes matching the SQS queues (HIGH, MED, LOW) and dispatched to a
+    bounded pool of worker processes forked from the polling process.
+    A worker always takes the oldest task from the highest lane.
+
+    Pending (waiting or running) tasks are counted for each lane, so
+    pollers check local capacity without reading spool folders, and
+    only receive as many messages as can be started soon, instead of
+    pulling messages that sit locally while their visibility runs out.
+
+    With no worker processes, tasks run on worker threads in the
+    polling process, which is used for dev and testing.
+
+    Worker processes restart after MAX_TASKS to release memory, and are
+    killed if a task runs longer than HARAKIRI, like the uwsgi spooler.
+    Workers are forked while other threads in the polling process are
+    running, so they drop the DB and Redis connections they inherit
+    and open their own; modules with locks or buffered state shared by
+    threads reset them with os.register_at_fork.
+    Async calls made inside a worker process are sent back to the
+    executor, so they are queued in the same lanes.
+"""
+import os
+import dill
+import threading
+import multiprocessing
+from collections import deque
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db import close_old_connections
+from django.db import reset_queries
+
+from .. import log
+from ..deploy.server import mp_shutdown
+from .spooler import ASYNC_RETRY
+from .spooler import finish_async_message
+
+
+LANES = ( 'HIGH', 'MED', 'LOW' )
+
+_SETTINGS = settings.MP_UWSGI.get( 'TASK_EXECUTOR', {} )
+
+# Seconds to wait before rechecking for shutdown
+_WAIT = 2
+
+_context = multiprocessing.get_context('fork')
+
+
+def get_executor():
+    """
+    Returns the executor running in this process, or None
+    """
+    return _executor
+
+def start_executor():
+    """
+    Start executor for this process if configured
+    """
+    global _executor
+    if _executor is None and _SETTINGS.get('ENABLED'):
+        # Capacity defaults to spooler thresholds for the queues
+        capacity = { name: queue.get( 'FULL_THRESHOLD', 1 ) for name, queue in
+                        settings.MP_UWSGI.get( 'SPOOL_QUEUES', {} ).items() }
+        capacity.update( _SETTINGS.get( 'CAPACITY', {} ) )
+        _executor = TaskExecutor(
+                    processes=_SETTINGS.get( 'PROCESSES', 0 ),
+                    threads=_SETTINGS.get( 'THREADS', 2 ),
+                    capacity=capacity,
+                    max_tasks=_SETTINGS.get( 'MAX_TASKS', 0 ),
+                    harakiri=_SETTINGS.get( 'HARAKIRI',
+                                settings.MP_UWSGI.get('SPOOL_HARAKIRI') ),
+                    )
+        _executor.start()
+    return _executor
+
+_executor = None
+
+def priority_lane( spool_priority ):
+    """
+    Map spool priority numbers onto executor lanes; MED is default
+    """
+    try:
+        return LANES[ int( spool_priority ) - 1 ]
+    except ( TypeError, ValueError, IndexError ):
+        return 'MED'
+
+
+class TaskExecutor:
+    """
+    Priority lanes with pending counts, and the worker pool that runs them
+    """
+
+    def __init__( self, processes=0, threads=2, capacity=None, max_tasks=0,
+                  harakiri=None ):
+        capacity = capacity or {}
+        self.capacity = { lane: capacity.get( lane, 1 ) for lane in LANES }
+        self._lanes = { lane: deque() for lane in LANES }
+        self._pending = dict.fromkeys( LANES, 0 )
+        self._changed = threading.Condition()
+        if processes:
+            self._workers = [ _ProcessWorker( self, max_tasks, harakiri )
+                                for _ in range( processes ) ]
+        else:
+            self._workers = [ _ThreadWorker() for _ in range( threads ) ]
+
+    def start( self ):
+        log.info("Starting task executor %s: %s workers -> %s", os.getpid(),
+                    len(self._workers), self.capacity)
+        for n, worker in enumerate( self._workers ):
+            thread = threading.Timer( 0, self._run, args=[ worker ] )
+            thread.name = 'executor{}'.format( n )
+            thread.start()
+
+    def submit( self, lane, fn, args, kwargs, message=None ):
+        """
+        Queue async call; pending counts include the task until it finishes
+        """
+        with self._changed:
+            self._lanes[ lane ].append( ( fn, args, kwargs, message ) )
+            self._pending[ lane ] += 1
+            self._changed.notify_all()
+        log.debug("EXECUTOR submit %s: %s", lane, fn)
+
+    def pending( self ):
+        """
+        Returns map of lanes to pending tasks at that lane AND any
+        higher priority lanes in front of it
+        """
+        rv = {}
+        total = 0
+        for lane in LANES:
+            total += self._pending[ lane ]
+            rv[ lane ] = total
+        return rv
+
+    def available( self, lane ):
+        """
+        Number of tasks the lane can take before local capacity is full
+        """
+        return max( 0, self.capacity[ lane ] - self.pending()[ lane ] )
+
+    def wait_available( self, lane, timeout ):
+        """
+        Block until lane has capacity or timeout; returns capacity
+        """
+        with self._changed:
+            self._changed.wait_for( lambda: self.available( lane ) or
+                                        mp_shutdown().started(), timeout )
+            return self.available( lane )
+
+    def _run( self, worker ):
+        # Register thread for shutdown join
+        mp_shutdown().wait( 0 )
+        while True:
+            item = self._next()
+            if not item:
+                break
+            self._execute( worker, *item )
+        worker.stop()
+        log.debug("Exiting task executor worker")
+
+    def _execute( self, worker, lane, task ):
+        fn, args, kwargs, message = task
+        status = None
+        try:
+            status = worker.run( fn, args, kwargs )
+            finish_async_message( status, message )
+        except Exception:
+            log.exception("TASK EXECUTOR: %s", fn)
+        finally:
+            with self._changed:
+                self._pending[ lane ] -= 1
+                self._changed.notify_all()
+        log.debug("EXECUTOR done %s: %s -> %s", lane, fn, status)
+
+    def _next( self ):
+        with self._changed:
+            while not mp_shutdown().started():
+                for lane in LANES:
+                    if self._lanes[ lane ]:
+                        return lane, self._lanes[ lane ].popleft()
+                self._changed.wait( _WAIT )
+
+
+class _ThreadWorker:
+    """
+    Run tasks on executor thread in this process
+    """
+
+    def run( self, fn, args, kwargs ):
+        return _call( fn, args, kwargs )
+
+    def stop( self ):
+        pass
+
+
+class _ProcessWorker:
+    """
+    Run tasks in a forked child process, one at a time
+    """
+
+    def __init__( self, executor, max_tasks, harakiri ):
+        self.executor = executor
+        self.max_tasks = max_tasks
+        self.harakiri = harakiri
+        self.process = None
+        self.conn = None
+        self.count = 0
+
+    def run( self, fn, args, kwargs ):
+        if not self.process or not self.process.is_alive():
+            self._start()
+        self.conn.send_bytes( dill.dumps( ( fn, args, kwargs ) ) )
+        try:
+            while True:
+                if not self.conn.poll( self.harakiri ):
+                    log.warning("EXECUTOR harakiri %s: %s", self.process.pid, fn)
+                    self.stop( kill=True )
+                    return ASYNC_RETRY
+                kind, value = self.conn.recv()
+                if kind == 'submit':
+                    self.executor.submit( value[0], *dill.loads( value[1] ) )
+                else:
+                    return value
+        except EOFError:
+            log.warning("EXECUTOR worker exited %s: %s", self.process.pid, fn)
+            self.stop( kill=True )
+            return ASYNC_RETRY
+        finally:
+            self.count += 1
+            if self.max_tasks and self.count >= self.max_tasks:
+                self.stop()
+
+    def stop( self, kill=False ):
+        if not self.process:
+            return
+        try:
+            if not kill:
+                self.conn.send_bytes( b'' )
+                self.process.join( _WAIT )
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join( _WAIT )
+            self.conn.close()
+        except Exception:
+            log.exception("EXECUTOR worker stop: %s", self.process.pid)
+        self.process = None
+
+    def _start( self ):
+        conn, child_conn = _context.Pipe()
+        self.process = _context.Process( target=_worker_main, args=( child_conn ,),
+                                         daemon=True )
+        self.process.start()
+        child_conn.close()
+        self.conn = conn
+        self.count = 0
+        log.info2("Started task executor worker: %s", self.process.pid)
+
+
+class _ChildExecutor:
+    """
+    Stands in for executor inside worker processes, passing async
+    calls back to the parent executor
+    """
+
+    def __init__( self, conn ):
+        self.conn = conn
+
+    def submit( self, lane, fn, args, kwargs, message=None ):
+        self.conn.send( ( 'submit', ( lane, dill.dumps(( fn, args, kwargs, message )) ) ) )
+
+def _worker_main( conn ):
+    global _executor
+    _reset_connections()
+    _executor = _ChildExecutor( conn )
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except ( EOFError, OSError ):
+            break
+        if not data:
+            break
+        fn, args, kwargs = dill.loads( data )
+        conn.send( ( 'status', _call( fn, args, kwargs ) ) )
+    # Skip parent process exit handling
+    os._exit( 0 )
+
+def _reset_connections():
+    """
+    Drop connections inherited from the parent WITHOUT closing them,
+    as closing would end the parent's DB sessions; references are kept
+    so the connections aren't closed when garbage collected.
+    """
+    for conn in connections.all():
+        if conn.connection is not None:
+            _inherited.append( conn.connection )
+            conn.connection = None
+    try:
+        from django_redis.pool import ConnectionFactory
+        ConnectionFactory._pools.clear()
+    except ImportError:
+        pass
+    for cache in caches.all():
+        client = getattr( cache, '_client', None )
+        clients = getattr( client, '_clients', None )
+        if clients:
+            _inherited.append( list( clients ) )
+            client._clients = [ None ] * len( clients )
+
+_inherited = []
+
+def _call( fn, args, kwargs ):
+    """
+    Execute async function as the spool handler does
+    """
+    status = None
+    try:
+        # Make logging count of DB calls accurate
+        reset_queries()
+        status = fn( *args, **kwargs )
+    except Exception:
+        log.exception_quiet("DURING EXECUTOR CALL: %s", fn)
+        if settings.MP_TESTING:
+            raise
+    close_old_connections()
+    return status
@@ -17,6 +17,8 @@
     The process_job_output_if_done function will check whether all registered sub
     tasks and jobs have completed and aggregate any cached output of tasks
     for each job -- but job hierarchies are not rolled up.
+    Completion is checked with counters the sub tasks update as they finish,
+    and the last task to finish runs the job task immediately.
     This can be replaced or specialized, for instance to do something with
     output from tasks incrementally or roll up information for job hierarchies.
 
@@ -37,6 +39,9 @@ from . import Task
 from . import send_queue_task
 from .output import get_task_output
 from .output import job_done
+from .output import job_progress
+from .output import start_job_progress
+from .output import task_dropped
 
 
 class Job( Task ):
@@ -107,6 +112,7 @@ class Job( Task ):
         Put ourselves on the queue last to process job done task.
         """
         self.cache_set( self.cache_key, self )
+        start_job_progress( self )
 
         for task_session in self.task_keys:
             task = self.cache.get( task_session )
@@ -116,11 +122,18 @@ class Job( Task ):
                 send_queue_task( task )
             else:
                 log.warning_quiet("TASK NOT IN CACHE: %s", task_session)
+                task_dropped( self.cache_info, task_session )
 
         send_queue_task( self )
 
         log.info2("JOB queuing done, starting: %s", self)
 
+    def progress( self ):
+        """
+        Returns dict with counts of total, done, failed, and remaining tasks
+        """
+        return job_progress( self.cache, self.cache_key )
+
     def process_output( self ):
         """
         Default functionality to complete job's output that returns accumulated
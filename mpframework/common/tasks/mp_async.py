@@ -2,8 +2,9 @@
 """
     Asynchronous call and signal support
 
-    Supports using uwsgi spooler (default) or threads to execute code
-    asynchronously (typically outside of request-response).
+    Supports using uwsgi spooler (default), the local task executor,
+    or threads to execute code asynchronously (typically outside of
+    request-response).
 
     uwsgi spooling will be used if available (server) but will fall back
     to threads if not (local dev).
@@ -80,8 +81,17 @@ def run_routine_async( fn, *args, **kwargs ):
 def _run_async( fn, force_thread, async_message, spool_priority, *args, **kwargs ):
     """
     All task calls eventually run through here to be executed
-    Verify whether spooler should and can be used to execute
+    Use local task executor if running in this process, otherwise
+    verify whether spooler should and can be used to execute
     """
+    from .executor import get_executor
+    executor = get_executor()
+    if executor and not force_thread:
+        from .executor import priority_lane
+        executor.submit( priority_lane( spool_priority ), fn, args, kwargs,
+                         async_message )
+        return
+
     use_spooler = uwsgi and not force_thread
     if use_spooler:
         if not _async_functions.get( fn.__name__ ):
@@ -6,8 +6,19 @@
     sub task and done functions. These methods support a default
     functionality that accumulates all sub task return values
     from cached output when all sub tasks have completed.
+
+    Job completion is tracked with atomic counters in the job's cache
+    (Redis INCR in cloud, locked local memory in dev); each sub task
+    adds a finished marker and increments done or failed once, so
+    checking completion only reads the job's counters.
+    Every path that drops a sub task session without finalizing it
+    (expired, missing at job start, failed queue send) counts it as
+    failed, or the job would wait on it until the job expires.
+    The job output is processed exactly once, by whichever caller
+    first claims the job's final marker.
 """
 from django.conf import settings
+from django.core.cache import caches
 
 from .. import log
 from ..utils import now
@@ -16,6 +27,7 @@ from .spooler import ASYNC_RETRY
 
 
 JOB_INCOMPLETE = '__MPF_JOB_RUNNING__'
+JOB_FINALIZED = '__MPF_JOB_FINALIZED__'
 DEV_LOCAL_POLL = 1
 
 
@@ -34,7 +46,8 @@ def process_job_output_if_done( **kwargs ):
     Generic synchronous completion function for a job.
     Provides implementation for the done_fn task function run when
     the job task is executed.
-    Returns job process_output if done, or JOB_COMPLETE if not.
+    Returns job process_output if done, JOB_INCOMPLETE if not, or
+    JOB_FINALIZED if output was already processed.
     """
     job = kwargs['my_task']
 
@@ -42,28 +55,107 @@ def process_job_output_if_done( **kwargs ):
     if now() > job.expires:
         log.warning("JOB EXPIRED: %s", job)
         job.expired = True
-        return job.process_output()
+        return _finalize_job( job )
 
     log.info2("Checking job done: %s", job)
-    remaining_tasks = job.cache.get_many( job.task_keys )
-
-    if not remaining_tasks:
+    if not _remaining_tasks( job ):
         log.debug("Job has no more tasks, so is complete: %s", job)
-        return job.process_output()
+        return _finalize_job( job )
 
     # DEV HACK - LOCAL thread simulation of SQS can't repost, so poll
     if not settings.MP_CLOUD:
         from time import sleep
         wait_count = 1
-        while job.cache.get_many( job.task_keys ) and wait_count < 10:
+        while _remaining_tasks( job ) and wait_count < 10:
             log.info("DEV - waiting for root job to complete: %s", job)
             sleep( DEV_LOCAL_POLL )
             wait_count += 1
         if wait_count < 10:
-            return job.process_output()
+            return _finalize_job( job )
 
     return JOB_INCOMPLETE
 
+def _remaining_tasks( job ):
+    progress = job_progress( job.cache, job.cache_key )
+    if progress:
+        return progress['remaining']
+    # Jobs started without progress counters check for task sessions
+    return len( job.cache.get_many( job.task_keys ) )
+
+def _finalize_job( job ):
+    if not job.cache.add( _progress_key( job.cache_key, 'final' ), 1,
+                          job.expire_seconds ):
+        log.info2("Job already finalized: %s", job)
+        return JOB_FINALIZED
+    return job.process_output()
+
+def start_job_progress( job ):
+    """
+    Set job counters before any sub tasks can finish
+    """
+    job.cache.set_many({
+        _progress_key( job.cache_key, 'total' ): len( job.task_keys ),
+        _progress_key( job.cache_key, 'done' ): 0,
+        _progress_key( job.cache_key, 'failed' ): 0,
+        }, job.expire_seconds )
+
+def job_progress( cache, job_key ):
+    """
+    Returns dict with total, done, failed, and remaining task counts
+    for the job, or None if the job's progress isn't available
+    """
+    names = ( 'total', 'done', 'failed' )
+    keys = [ _progress_key( job_key, name ) for name in names ]
+    values = cache.get_many( keys )
+    # Dev get_many drops falsy values, so get any zero counters
+    for key in keys:
+        if key not in values:
+            value = cache.get( key )
+            if value is None:
+                return
+            values[ key ] = value
+    rv = { name: values[ key ] for name, key in zip( names, keys ) }
+    rv['remaining'] = max( 0, rv['total'] - rv['done'] - rv['failed'] )
+    return rv
+
+def task_finished( task, failed=False ):
+    """
+    Count a job sub task as finished; a task is only counted once.
+    Returns True if this was the last of the job's tasks to finish.
+    """
+    return _count_finished( task.job_cache_info, task.cache_key, failed,
+                            task.expire_seconds )
+
+def task_dropped( job_cache_info, task_key ):
+    """
+    Count a job sub task whose session was lost without being finalized
+    as failed; job_cache_info may be empty for tasks not in jobs
+    The finished marker expires with the job, or the cache default
+    """
+    if job_cache_info:
+        log.info("Job task dropped: %s", task_key)
+        cache = caches[ job_cache_info['cache_name'] ]
+        timeout = job_cache_info.get( 'expire_seconds', cache.default_timeout )
+        return _count_finished( job_cache_info, task_key, True, timeout )
+
+def _count_finished( job_cache_info, task_key, failed, timeout ):
+    if not job_cache_info:
+        return
+    cache = caches[ job_cache_info['cache_name'] ]
+    job_key = job_cache_info['task_key']
+    if not cache.add( _progress_key( task_key, 'finished' ), 1, timeout ):
+        return
+    try:
+        cache.incr( _progress_key( job_key, 'failed' if failed else 'done' ) )
+    except ValueError:
+        log.info2("Job progress not available: %s", task_key)
+        return
+    progress = job_progress( cache, job_key )
+    return bool( progress and not progress['remaining'] )
+
+def _progress_key( key, name ):
+    return '{}_{}'.format( key, name )
+
 def task_output_key( session_key ):
     # Store sub task output based on task session key
     return '{}_output'.format( session_key )
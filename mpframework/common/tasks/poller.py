@@ -22,6 +22,10 @@
     with the SQS message deleted upon completion.
     TIMEOUTS FOR MESSAGE VISIBILITY NEED TO BE CONFIGURED APPROPRIATELY
 
+    If the local task executor is enabled, it replaces the spooler and
+    pollers only receive as many messages as it has capacity for,
+    waiting for capacity instead of polling when it is full.
+
     There is also an option to execute tasks immediately in these poller
     threads. This should be used sparingly, as it blocks the poller.
 
@@ -49,6 +53,8 @@ from ..aws import sqs
 from ..deploy.server import mp_shutdown
 from . import get_module_name
 from .spooler import spool_queue_task_count
+from .executor import start_executor
+from .executor import get_executor
 from .task import Task
 
 
@@ -84,6 +90,7 @@ def start_task_polling():
     When a task is received from distributed queue it may be executed within
     the poller thread, or placed on local spooler file queue.
     """
+    start_executor()
     pollers = settings.MP_UWSGI.get( 'SPOOL_POLLERS', {} )
     for name, poller in pollers.items():
         names = poller['QUEUES']
@@ -130,26 +137,44 @@ def _poll_worker( names, freq ):
     log.info2("Starting SQS poller: %s", names)
     log.debug("SQS poller: %s", queues)
 
+    executor = get_executor()
+
     while not mp_shutdown().started():
         try:
-            # Get spooler file lengths to determine whether to poll
+            # Get local capacity to determine whether to poll
             queues_to_poll = {}
-            task_counts = spool_queue_task_count()
-            for name, queue in queues.items():
-                if task_counts[ name ] < queue.get( 'FULL_THRESHOLD', 1 ):
-                    queues_to_poll[ name ] = queue
-                else:
-                    log.info3("SQS skipping poll, spooler full: %s -> %s",
-                                name, task_counts[ name ])
-
-            for name, queue in queues_to_poll.items():
+            if executor:
+                for name, queue in queues.items():
+                    available = executor.available( name )
+                    if not available and len( queues ) == 1:
+                        available = executor.wait_available( name, freq )
+                    if available:
+                        queues_to_poll[ name ] = min( available,
+                                    queue['receive_options']['MaxNumberOfMessages'] )
+                    else:
+                        log.info3("SQS skipping poll, executor full: %s -> %s",
+                                    name, executor.pending()[ name ])
+            else:
+                # Get spooler file lengths
+                task_counts = spool_queue_task_count()
+                for name, queue in queues.items():
+                    if task_counts[ name ] < queue.get( 'FULL_THRESHOLD', 1 ):
+                        queues_to_poll[ name ] = None
+                    else:
+                        log.info3("SQS skipping poll, spooler full: %s -> %s",
+                                    name, task_counts[ name ])
+
+            for name, max_messages in queues_to_poll.items():
                 if mp_shutdown().started():
                     continue
                 log.info4("Checking SQS queue: %s", name)
+                queue = queues[ name ]
+                options = queue['receive_options']
+                if max_messages:
+                    options = dict( options, MaxNumberOfMessages=max_messages )
 
                 # Handle messages - BLOCKS HERE if LONG_POLL over 0
-                messages = queue['client'].receive_messages(
-                            **queue['receive_options'] )
+                messages = queue['client'].receive_messages( **options )
                 if messages:
                     _process_messages( messages, queue )
 
@@ -3,13 +3,19 @@
     Post work to queue
     Support for posting tasks and wrapping a function call in a task.
 """
+import os
 import json
+import time
+import threading
+from hashlib import sha1
 from django.conf import settings
 
 from .. import log
+from ..deploy.server import add_shutdown_handler
 from ..utils import json_dump
 from ..utils import get_random_key
 from .task import Task
+from .output import task_dropped
 from .poller import get_queue
 
 
@@ -37,6 +43,12 @@ def run_queue_function( fn, group, *args, **kwargs ):
 def send_queue_task( task, resend=False ):
     """
     Send task message to SQS
+
+    Messages are buffered per queue and sent with send_messages in
+    batches, which are flushed when full, after a short delay, or at
+    the end of a request (see flush_queue_tasks).
+    Uncached tasks with the same function and arguments sent within
+    the coalesce window are only sent once.
     """
     # The message body will have cache session or message itself
     body = json_dump( task.put_info() )
@@ -47,28 +59,161 @@ def send_queue_task( task, resend=False ):
         Task.execute( handler_name, json.loads( body ) )
         return
 
-    queue = get_queue( task.priority )
-    if queue:
-        attr = {
-            'mpPriority': { 'StringValue': task.priority, 'DataType': 'String' },
-            'mpHandler': { 'StringValue': handler_name, 'DataType': 'String' },
-            'mpVersion': { 'StringValue': settings.MP_PLAYPEN_SQS['VERSION'], 'DataType': 'String' },
-            }
-
-        # Use task key, since semantics for duplicate are a task is
-        # only ever created once; if resend, force new one to be considered
-        dupe_id = get_random_key() if resend else task.key
-
-        options = {
-            'MessageBody': body,
-            'MessageAttributes': attr,
-            'MessageDeduplicationId': dupe_id,
-            'MessageGroupId': task.message_group,
-            }
-
-        response = queue.send_message( **options )
-
-        log.debug("Sent SQS message: %s -> %s",
-                    response.get('MessageId'), task)
-    else:
-        log.error_quiet("ERROR SQS SEND MESSAGE %s", task)
+    if not task.cache and not resend and _coalesce( task, body ):
+        log.debug("Coalesced SQS message: %s", task)
+        return
+
+    attr = {
+        'mpPriority': { 'StringValue': task.priority, 'DataType': 'String' },
+        'mpHandler': { 'StringValue': handler_name, 'DataType': 'String' },
+        'mpVersion': { 'StringValue': settings.MP_PLAYPEN_SQS['VERSION'], 'DataType': 'String' },
+        }
+
+    # Use task key, since semantics for duplicate are a task is
+    # only ever created once; if resend, force new one to be considered
+    dupe_id = get_random_key() if resend else task.key
+
+    entry = {
+        'MessageBody': body,
+        'MessageAttributes': attr,
+        'MessageDeduplicationId': dupe_id,
+        'MessageGroupId': task.message_group,
+        }
+    size = len( body.encode() ) + sum( len( k ) + len( v['StringValue'] ) +
+                len( v['DataType'] ) for k, v in attr.items() )
+
+    dropped = ( task.job_cache_info, task.cache_key ) if task.cache else None
+    _add_message( task.priority, entry, size, str( task ), dropped )
+
+def flush_queue_tasks():
+    """
+    Send any buffered messages for all queues
+    """
+    global _timer
+    with _lock:
+        batches = list( _pending.items() )
+        _pending.clear()
+        if _timer and _timer is not threading.current_thread():
+            _timer.cancel()
+        _timer = None
+    for priority, batch in batches:
+        _send_batch( priority, batch )
+
+"""--------------------------------------------------------------------
+    Message batching and coalescing
+"""
+
+_settings = settings.MP_TUNING['TASK_SEND']
+_RETRIES = _settings.get( 'RETRIES', 2 )
+_RETRY_SECONDS = _settings.get( 'RETRY_SECONDS', 0.2 )
+_BATCH_MAX = 10
+_BATCH_BYTES = 256 * 1024
+
+_pending = {}
+_lock = threading.Lock()
+_timer = None
+
+def _add_message( priority, entry, size, name, dropped=None ):
+    global _timer
+    send = None
+    with _lock:
+        batch = _pending.get( priority )
+        if batch and batch['size'] + size > _BATCH_BYTES:
+            send = _pending.pop( priority )
+            batch = None
+        if not batch:
+            batch = _pending[ priority ] = { 'entries': [], 'names': [],
+                                             'dropped': [], 'size': 0 }
+        batch['entries'].append( entry )
+        batch['names'].append( name )
+        batch['dropped'].append( dropped )
+        batch['size'] += size
+        full = len( batch['entries'] ) >= _BATCH_MAX
+        if full:
+            _pending.pop( priority )
+        elif not _timer:
+            _timer = threading.Timer( _settings['FLUSH_SECONDS'], flush_queue_tasks )
+            _timer.name = 'sqs_send'
+            _timer.daemon = True
+            _timer.start()
+    if send:
+        _send_batch( priority, send )
+    if full:
+        _send_batch( priority, batch )
+
+def _send_batch( priority, batch ):
+    """
+    Send batch, retrying entries that fail for reasons other than
+    the message itself; entries that can't be sent are dropped
+    """
+    names = batch['names']
+    todo = list( range( len( batch['entries'] ) ) )
+    lost = []
+    for attempt in range( _RETRIES + 1 ):
+        if attempt:
+            time.sleep( _RETRY_SECONDS * attempt )
+            log.info("SQS SEND retry %s %s: %s", attempt, priority,
+                        [ names[ n ] for n in todo ])
+        try:
+            queue = get_queue( priority )
+            if not queue:
+                log.error_quiet("ERROR SQS SEND MESSAGE no queue %s: %s", priority, names)
+                break
+            response = queue.send_messages( Entries=[
+                        dict( batch['entries'][ n ], Id=str( n ) ) for n in todo ] )
+            retry = []
+            for failed in response.get( 'Failed', [] ):
+                n = int( failed['Id'] )
+                log.error_quiet("ERROR SQS SEND MESSAGE %s: %s -> %s", priority,
+                            names[ n ], failed.get('Message'))
+                ( lost if failed.get('SenderFault') else retry ).append( n )
+            todo = retry
+        except Exception:
+            log.exception("SQS SEND MESSAGES %s: %s", priority, names)
+        if not todo:
+            break
+    lost.extend( todo )
+    for n in lost:
+        _dropped( batch['dropped'][ n ] )
+    log.debug("Sent SQS messages %s: %s, %s lost", priority, names, len(lost))
+
+def _dropped( dropped ):
+    # Job tasks that won't be run are counted as failed in their job
+    if dropped:
+        task_dropped( *dropped )
+
+def _reset_after_fork():
+    # Forked workers start with no buffered messages or held lock
+    global _lock, _timer
+    _lock = threading.Lock()
+    _pending.clear()
+    _timer = None
+
+os.register_at_fork( after_in_child=_reset_after_fork )
+
+# Send messages buffered when the process exits; the timer is a daemon
+# thread so exit doesn't wait on it
+add_shutdown_handler( flush_queue_tasks )
+
+_recent = {}
+
+def _coalesce( task, body ):
+    """
+    True if the same message was sent within the window
+    """
+    window = _settings['COALESCE_SECONDS']
+    if not window:
+        return False
+    key = sha1( '{}{}{}{}'.format( task.priority, task.message_group,
+                                task.handler_name, body ).encode() ).digest()
+    time_now = time.monotonic()
+    with _lock:
+        last = _recent.get( key )
+        if last and time_now - last < window:
+            return True
+        _recent[ key ] = time_now
+        if len( _recent ) > _settings['COALESCE_MAX']:
+            for old, sent in list( _recent.items() ):
+                if time_now - sent >= window:
+                    _recent.pop( old )
+    return False
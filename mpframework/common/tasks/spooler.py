@@ -142,6 +142,17 @@ def spool_breathe( loop_counter=None ):
             log.debug2("Spool breathe: %s", sleep_time)
             sleep( sleep_time )
 
+def finish_async_message( status, message ):
+    """
+    Functions should return ASYNC_RETRY if they want a retry,
+    otherwise the message is removed from the queue
+    """
+    if status != ASYNC_RETRY and message:
+        delete_fn = message.get('delete_message_fn')
+        if delete_fn:
+            delete_fn = load_module_attr( delete_fn )
+            delete_fn( message )
+
 @db_connection_retry
 def spool_handler( task ):
     """
@@ -164,15 +175,7 @@ def spool_handler( task ):
 
         status = fn( *body.get('_args_'), **body.get('_kwargs_') )
 
-        # Functions should return ASYNC_RETRY if they want a retry,
-        # otherwise the message is removed from the queue
-        if status != ASYNC_RETRY:
-            message = body.get('_message_')
-            if message:
-                delete_fn = message.get('delete_message_fn')
-                if delete_fn:
-                    delete_fn = load_module_attr( delete_fn )
-                    delete_fn( message )
+        finish_async_message( status, body.get('_message_') )
 
         log.debug("ASYNC spool %s -> %s", name, status)
 
@@ -21,6 +21,8 @@ from ..utils import timedelta_seconds
 from ..utils import get_random_key
 from . import get_module_name
 from .output import task_output_key
+from .output import task_finished
+from .output import task_dropped
 from .mp_async import is_async_fn
 from .mp_async import run_routine_async
 from .mp_async import mp_async
@@ -37,6 +39,7 @@ def async_task_wrapper( retry=True, **kwargs ):
     """
     task = kwargs['my_task']
     output = "TASK EMPTY"
+    failed = False
     try:
         fn = kwargs.pop('my_task_fn')
         log.debug2("Executing wrapped task fn: %s, retry %s", fn, retry)
@@ -56,9 +59,10 @@ def async_task_wrapper( retry=True, **kwargs ):
             raise
         log.exception("TASK ASYNC: %s", task)
         output = "Task exception: %s" % e
+        failed = True
 
     if task.cache:
-        return task.finalize( output )
+        return task.finalize( output, failed )
 
 
 class Task:
@@ -77,6 +81,7 @@ class Task:
     """
     DEFAULT_PRIORITY = 'MS'
     HIGH_SPOOL = ['HS']
+    LOW_SPOOL = ['LS']
 
     # Tasks are partitioned into SQS MessageGroups within each priority queue.
     # For normal priorities, only one Task per group is processed at a time,
@@ -187,20 +192,31 @@ class Task:
         """
         if self.cache:
             self.cache_set( self.cache_key, self )
-            return { 'cached_task': self.cache_info }
+            rv = { 'cached_task': self.cache_info }
+            # Job info lets a lost session be counted in the job's progress
+            if self.job_cache_info:
+                rv['job_task'] = self.job_cache_info
+            return rv
         else:
             return self.kwargs
 
-    def finalize( self, output ):
+    def finalize( self, output, failed=False ):
         """
         Place output from a task function into cache for future use by
         get_task_output or custom job completion, and indicate
         the task processing is done by removing session from cache.
+        If this is the last task of a job, run the job task now instead
+        of waiting for its next retry.
         """
         if self.cache:
             log.debug("Finalizing: %s", self)
             self.cache_set( task_output_key( self.cache_key ), output )
             self.cache.delete( self.cache_key )
+            if task_finished( self, failed ):
+                job = self.job
+                if job:
+                    log.info2("Last job task finished, running job: %s", job)
+                    self.execute( job.handler_name, job.put_info() )
 
     def cache_set( self, key, value ):
         expire_seconds = getattr( self, 'expire_seconds', self.cache.default_timeout )
@@ -225,6 +241,7 @@ class Task:
             return {
                 'cache_name': self.cache_name,
                 'task_key': self.cache_key,
+                'expire_seconds': self.expire_seconds,
                 }
         else:
             return {}
@@ -260,6 +277,10 @@ class Task:
                 if not task or getattr( task, 'expired', False ):
                     log.warning("{} EXPIRED, skipping execution".format( key ))
                     cache.delete( key )
+                    if task:
+                        task_finished( task, failed=True )
+                    else:
+                        task_dropped( payload.get('job_task'), key )
                     return
 
                 # Load the kwargs for task fn and add task object
@@ -289,6 +310,8 @@ class Task:
                 kwargs['async_message'] = message
             if kwargs['my_task'].priority in cls.HIGH_SPOOL:
                 kwargs['spool_priority'] = 1
+            elif kwargs['my_task'].priority in cls.LOW_SPOOL:
+                kwargs['spool_priority'] = 3
             # Normally task calls are wrapped in standard error handling
             wrapper = payload.get( 'async_task_wrapper', async_task_wrapper )
             if wrapper:
@@ -310,6 +333,8 @@ class Task:
                     task = cache.get( cached['task_key'] )
                     cache.set( 'ERROR_LOG_{}'.format( cached['task_key'] ), task )
                     cache.delete( cached['task_key'] )
+                    if task:
+                        task_finished( task, failed=True )
                     extra_log += " -> %s" % task
             log.exception("TASK %s -> %s %s", fn_name, payload, extra_log,
                         logger='mp.direct_mail')
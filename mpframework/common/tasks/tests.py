@@ -10,6 +10,7 @@ from . import run_queue_function
 from .job import Job
 from .output import process_job_output_if_done
 from .output import JOB_INCOMPLETE
+from .output import JOB_FINALIZED
 from .spooler import ASYNC_RETRY
 
 
@@ -84,9 +85,32 @@ def _test_job_done( message, **kwargs ):
     output = process_job_output_if_done( **kwargs )
     if output == JOB_INCOMPLETE:
         return ASYNC_RETRY
+    if output == JOB_FINALIZED:
+        return
     log.info("====>  TEST JOB COMPLETED: %s  <====", message )
     log.info( output )
 
+"""--------------------------------------------------------------------
+    Job progress unit test support
+"""
+progress_results = []
+
+@mp_async
+def progress_job_task( value, fail=False, **kwargs ):
+    kwargs['my_task'].finalize( [ value ], failed=fail )
+
+@mp_async
+def progress_job_done( **kwargs ):
+    progress_results.append( process_job_output_if_done( **kwargs ) )
+
+"""--------------------------------------------------------------------
+    Task executor unit test support
+"""
+deleted_messages = []
+
+def delete_test_message( message ):
+    deleted_messages.append( message['id'] )
+
 def _attr_setup( **kwargs ):
     priority = kwargs.pop( 'p', 'HS' )
     cache = kwargs.pop( 'c', 'session' )
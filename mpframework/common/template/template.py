@@ -3,11 +3,14 @@
     MPF base template
 """
 import re
+from hashlib import sha1
+from django.conf import settings
 from django.template import Template
 from django.template import Context
 from django.template.context import make_context
 
 from .. import log
+from ..utils.collections import LruCache
 
 
 class mpTemplate( Template ):
@@ -49,11 +52,29 @@ class mpTemplate( Template ):
 
         return code
 
+    def compile_nodelist( self ):
+        """
+        Reuse compiled node lists for the same source and option.
+        Django nodes don't hold render state, so as with Django's cached
+        template loader, the compiled tree is shared between template objects.
+        Keys are based on the template source, so changes to templates
+        invalidated through sandbox/provider cache groups get new keys.
+        """
+        key = sha1( '{}|{}'.format( self.option, self.source
+                    ).encode( 'utf-8', 'replace' ) ).hexdigest()
+        nodelist = _compiled.get( key )
+        if nodelist is None:
+            nodelist = super().compile_nodelist()
+            _compiled.set( key, nodelist, len( self.source ) )
+            log.detail3("Compiled template: %s -> %s", self, _compiled.stats)
+        return nodelist
+
     def __getstate__( self ):
         """
         Rebuild template from source to avoid trying to pickle template node
-        objects. This saves a DB hit for custom templates, but still has
-        expensive template rendering, so cache as much rendered HTML as possible.
+        objects. This saves a DB hit for custom templates, and unpickling
+        reuses compiled nodes from the process LRU, but still has expensive
+        template rendering, so cache as much rendered HTML as possible.
         """
         log.detail3("Pickling template: %s", self)
         state = [ self.source, self.option ]
@@ -73,6 +94,13 @@ class mpTemplate( Template ):
             code = '\n'.join( code )
         return code
 
+# Compiled node lists shared in process
+_compiled = LruCache( settings.MP_TUNING['TEMPLATE_COMPILED']['ENTRIES'],
+            settings.MP_TUNING['TEMPLATE_COMPILED']['SOURCE_BYTES'] )
+
+def compiled_template_stats():
+    return _compiled.stats
+
 _template_parts = {
     'CSS_LINKS_ONLY': re.compile(
         r'<link \b .*? >', re.DOTALL | re.VERBOSE ),
@@ -84,6 +84,370 @@ class CommonTestCases( unittest.TestCase ):
         self.assertTrue( a.pop('A.B.name') == 'Nest1' )
         self.assertTrue( a.get('A.B', 'test') == 'test' )
 
+    def test_lru( self ):
+
+        print("LruCache")
+        from mpframework.common.utils.collections import LruCache
+
+        lru = LruCache( 3, max_size=10 )
+        for n in range( 5 ):
+            lru.set( n, str(n), size=2 )
+        self.assertTrue( len( lru ) == 3 )
+        self.assertFalse( 0 in lru )
+        self.assertTrue( lru.get( 2 ) == '2' )
+        self.assertTrue( lru.get( 0, 'missing' ) == 'missing' )
+
+        # Size bound evicts least recently used first
+        lru.set( 'big', 'value', size=6 )
+        self.assertTrue( 2 in lru and 'big' in lru )
+        self.assertFalse( 3 in lru )
+        self.assertTrue( lru.size <= 10 )
+
+        # Items larger than the bound are not stored
+        lru.set( 'too_big', 'value', size=11 )
+        self.assertFalse( 'too_big' in lru )
+        self.assertTrue( lru.stats['hits'] == 1 and lru.stats['misses'] == 1 )
+
+        # Eviction callback
+        evicted = []
+        lru = LruCache( 2, on_evict=lambda key, value: evicted.append( key ) )
+        for n in range( 4 ):
+            lru.set( n, n )
+        self.assertTrue( evicted == [ 0, 1 ] )
+
+    def test_stash_keys( self ):
+
+        print("Stash keys")
+        from mpframework.common.cache.stash import stash_method_rv
+        from mpframework.common.cache.stash import STASH_NAME
+
+        class Model:
+            def __init__( self, id ):
+                self.id = id
+
+        class Owner:
+            calls = 0
+            @stash_method_rv
+            def value( self, *args, **kwargs ):
+                self.calls += 1
+                return self.calls
+
+        owner = Owner()
+        model = Model( 7 )
+        self.assertTrue( owner.value( model ) == 1 )
+        self.assertTrue( owner.value( Model( 7 ) ) == 1 )
+
+        # Models are keyed by ID, not held in the stash
+        for key in getattr( owner, STASH_NAME ):
+            self.assertFalse( model in key[1] )
+
+        # Equal scalars of different types have their own keys
+        self.assertTrue( owner.value( 1 ) == 2 )
+        self.assertTrue( owner.value( True ) == 3 )
+        self.assertTrue( owner.value( 1.0 ) == 4 )
+        self.assertTrue( owner.value( flag=1 ) == 5 )
+        self.assertTrue( owner.value( flag=True ) == 6 )
+        self.assertTrue( owner.value( [ 1 ] ) == 7 )
+        self.assertTrue( owner.value( [ 1 ] ) == 7 )
+
+    def test_cache_codec( self ):
+
+        print("Cache codec")
+        import pickle
+        from mpframework.common.cache import codec
+        from mpframework.common.cache.codec import cache_encode
+        from mpframework.common.cache.codec import cache_decode
+
+        values = [ { 'a': [ 1, 2.5, None, True ], 'b': { 'c': 'text' } },
+                   { 1: 'int key' }, ( 1, 2 ), b'packed', 'x' * 10000, 42,
+                   { 'bad': 'lone \udc80 surrogate' } ]
+
+        # Until writes are enabled, only plain pickles are written
+        write = codec._WRITE
+        try:
+            codec._WRITE = False
+            for value in values:
+                encoded = cache_encode( value, 'test' )
+                self.assertTrue( pickle.loads( encoded ) == value )
+
+            codec._WRITE = True
+            for value in values:
+                self.assertTrue( cache_decode( cache_encode( value, 'test' ) ) == value )
+
+            # JSON-safe dicts use JSON, large values are compressed
+            self.assertTrue( cache_encode( values[0] )[:1] == b'J' )
+            self.assertTrue( len( cache_encode( values[4] ) ) < 1000 )
+
+            # Strings that can't be UTF-8 encoded are pickled
+            self.assertTrue( cache_encode( values[6] )[:1] == b'\x80' )
+
+            # Values already encoded by cache_rv aren't counted again
+            for codec._WRITE in ( False, True ):
+                cache_encode( 'value', 'test_count' )
+                cache_encode( b'value', 'test_count' )
+            self.assertTrue( codec.codec_stats()['test_count']['values'] == 2 )
+        finally:
+            codec._WRITE = write
+
+        # Values pickled before the codec are still read
+        self.assertTrue( cache_decode( pickle.dumps( values[2] ) ) == values[2] )
+
+    def test_s3_bulk( self ):
+
+        print("BulkS3")
+        from botocore.exceptions import ClientError
+        from mpframework.common.aws.s3_bulk import BulkS3
+
+        class LocalS3:
+            """
+            In-memory stand-in for the boto3 client calls used by BulkS3
+            """
+            def __init__( self, keys ):
+                self.objects = { ( 'b', key ): b'x' for key in keys }
+                self.throttle = 1
+
+            def list_objects_v2( self, Bucket, Prefix, ContinuationToken=None ):
+                keys = sorted( k for b, k in self.objects if b == Bucket and k.startswith( Prefix ) )
+                start = int( ContinuationToken or 0 )
+                page = keys[ start:start + 2 ]
+                return { 'Contents': [ { 'Key': k, 'Size': 1 } for k in page ],
+                         'IsTruncated': start + 2 < len( keys ),
+                         'NextContinuationToken': str( start + 2 ) }
+
+            def copy_object( self, CopySource, Bucket, Key ):
+                if self.throttle:
+                    self.throttle -= 1
+                    raise ClientError( { 'Error': { 'Code': 'SlowDown' } }, 'CopyObject' )
+                self.objects[ ( Bucket, Key ) ] = self.objects[
+                            ( CopySource['Bucket'], CopySource['Key'] ) ]
+
+            def delete_objects( self, Bucket, Delete ):
+                for obj in Delete['Objects']:
+                    self.objects.pop( ( Bucket, obj['Key'] ) )
+                return {}
+
+        client = LocalS3([ 'src/1', 'src/2', 'src/sub/3', 'other/4' ])
+
+        # Dry run only records manifest
+        bulk = BulkS3( 'b', parallel=2, dry_run=True, client=client )
+        bulk.delete_prefix('src/')
+        self.assertTrue( len( bulk.manifest ) == 3 and len( client.objects ) == 4 )
+
+        # Copies are retried after throttling
+        bulk = BulkS3( 'b', parallel=2, client=client )
+        bulk.copy_prefix( 'src/', 'dest/' )
+        self.assertTrue( ( 'b', 'dest/sub/3' ) in client.objects )
+        self.assertTrue( bulk.counts['copied'] == 3 and bulk.counts['retries'] == 1 )
+
+        # Copies to another bucket
+        bulk.copy_prefix( 'src/sub/', 'dest/', target_bucket='b2' )
+        self.assertTrue( ( 'b2', 'dest/3' ) in client.objects )
+        client.objects.pop( ( 'b2', 'dest/3' ) )
+
+        bulk.delete_prefix('src/')
+        self.assertTrue( bulk.counts['deleted'] == 3 and not bulk.counts['failed'] )
+        self.assertTrue( sorted( k for _b, k in client.objects ) ==
+                    [ 'dest/1', 'dest/2', 'dest/sub/3', 'other/4' ] )
+
+        # Empty prefix is refused
+        self.assertTrue( bulk.delete_prefix('/') is None )
+
+    def test_job_progress( self ):
+
+        print("Job progress")
+        from mpframework.common.tasks.job import Job
+        from mpframework.common.tasks.output import JOB_FINALIZED
+        from mpframework.common.tasks.tests import progress_job_task
+        from mpframework.common.tasks.tests import progress_job_done
+        from mpframework.common.tasks.tests import progress_results
+
+        progress_results.clear()
+        job = Job( 'TEST_JOB', done_fn=progress_job_done )
+        dropped = job.add_task( progress_job_task, value=1 )
+        job.add_task( progress_job_task, value=2 )
+        job.add_task( progress_job_task, value=3 )
+        job.add_task( progress_job_task, value=4, fail=True )
+
+        # Task session lost before start is counted as failed
+        job.cache.delete( dropped.cache_key )
+        job.start()
+
+        self.assertTrue( job.progress() ==
+                    { 'total': 4, 'done': 2, 'failed': 2, 'remaining': 0 } )
+
+        # Last task runs the job, so the job's own run finds it finalized
+        self.assertTrue( len( progress_results ) == 2 )
+        self.assertTrue( progress_results[0] != JOB_FINALIZED )
+        self.assertTrue( progress_results[1] == JOB_FINALIZED )
+
+    def test_task_executor( self ):
+
+        print("Task executor")
+        from mpframework.common.tasks.spooler import ASYNC_RETRY
+        from mpframework.common.tasks.executor import TaskExecutor
+        from mpframework.common.tasks.executor import priority_lane
+        from mpframework.common.tasks.tests import deleted_messages
+
+        self.assertTrue( priority_lane( 1 ) == 'HIGH' and priority_lane( None ) == 'MED' )
+
+        executor = TaskExecutor( threads=1,
+                    capacity={ 'HIGH': 2, 'MED': 3, 'LOW': 4 } )
+        calls = []
+        def task( name, status=None ):
+            calls.append( name )
+            return status
+        message = lambda id: { 'id': id,
+                    'delete_message_fn': 'mpframework.common.tasks.tests.delete_test_message' }
+
+        executor.submit( 'LOW', task, ( 'low', ), {}, message('low') )
+        executor.submit( 'MED', task, ( 'med', ASYNC_RETRY ), {}, message('med') )
+        executor.submit( 'HIGH', task, ( 'high', ), {}, message('high') )
+
+        # Lanes are counted with the lanes in front of them
+        self.assertTrue( executor.pending() == { 'HIGH': 1, 'MED': 2, 'LOW': 3 } )
+        self.assertTrue( [ executor.available( lane ) for lane in ( 'HIGH', 'MED', 'LOW' ) ]
+                    == [ 1, 1, 1 ] )
+        executor.submit( 'HIGH', task, ( 'high2', ), {} )
+        self.assertTrue( executor.available('MED') == 0 and executor.available('HIGH') == 0 )
+        self.assertTrue( executor.wait_available( 'LOW', 0.01 ) == 0 )
+
+        # Highest lane first, oldest first in each lane
+        deleted_messages.clear()
+        worker = executor._workers[0]
+        for _ in range( 4 ):
+            executor._execute( worker, *executor._next() )
+        self.assertTrue( calls == [ 'high', 'high2', 'med', 'low' ] )
+        self.assertTrue( executor.pending()['LOW'] == 0 and executor.available('LOW') == 4 )
+
+        # Messages are deleted unless the task asks for a retry
+        self.assertTrue( deleted_messages == [ 'high', 'low' ] )
+
+    def test_cache_l1( self ):
+
+        print("Cache L1")
+        from time import sleep
+        from mpframework.common.cache.bus import publish_invalidation
+        from mpframework.common.cache.l1 import l1_get
+        from mpframework.common.cache.l1 import l1_set
+
+        value = { 'a': 1 }
+        l1_set( 'l1test', 'v1', value, 10, 60 )
+        self.assertTrue( l1_get( 'l1test', 'v1' ) == value )
+
+        # Hits are copies of mutable values
+        l1_get( 'l1test', 'v1' )['a'] = 2
+        value['a'] = 3
+        self.assertTrue( l1_get( 'l1test', 'v1' ) == { 'a': 1 } )
+
+        # Version mismatch is a miss and removes the entry
+        self.assertTrue( l1_get( 'l1test', 'v2' ) is None )
+        self.assertTrue( l1_get( 'l1test', 'v1' ) is None )
+
+        # Entries expire with the buffer timeout
+        l1_set( 'l1test', 'v1', 'text', 4, 0.01 )
+        sleep( 0.02 )
+        self.assertTrue( l1_get( 'l1test', 'v1' ) is None )
+
+        # Invalidation removes keys in this process
+        l1_set( 'l1test', 'v1', 'text', 4, 60 )
+        publish_invalidation([ 'l1test' ])
+        self.assertTrue( l1_get( 'l1test', 'v1' ) is None )
+
+    def test_cache_rebuild( self ):
+
+        print("Cache single-flight rebuild")
+        import math
+        import time
+        import threading
+        from django.core.cache import caches
+        from mpframework.common.cache import stampede
+        from mpframework.common.cache.codec import cache_encode
+        from mpframework.common.cache.call_cache import cache_function
+
+        cache = caches['default']
+        calls = []
+        def build():
+            calls.append( 1 )
+            return 'v{}'.format( len( calls ) )
+        def call( version, serve_stale=False ):
+            rv, _packed, op = stampede.single_flight_call( build, cache, 'default',
+                        'sftest', version, 60, serve_stale )
+            return rv, op
+
+        # Miss rebuilds once, then hits
+        self.assertTrue( call( 1, True ) == ( 'v1', 'SET' ) )
+        self.assertTrue( call( 1, True ) == ( 'v1', 'HIT' ) )
+
+        # XFetch refresh is more likely close to expiration
+        Stamped = stampede.Stamped
+        self.assertFalse( stampede._refresh_due( Stamped( 'x', 0, time.time() ) ) )
+        self.assertFalse( stampede._refresh_due( Stamped( 'x', 0.001, time.time() + 1000 ) ) )
+        self.assertTrue( stampede._refresh_due( Stamped( 'x', 1, time.time() - 1 ) ) )
+
+        # While another worker holds rebuild lock, stale value is served
+        self.assertTrue( stampede._lock( cache, 'sftest', 2 ) )
+        self.assertFalse( stampede._lock( cache, 'sftest', 2 ) )
+        self.assertTrue( call( 2, True ) == ( 'v1', 'STALE' ) )
+
+        # Threads in this process also get stale value during rebuild
+        with stampede._local_lock( 'sftest', 3 ):
+            self.assertTrue( call( 3, True ) == ( 'v1', 'STALE' ) )
+        self.assertTrue( len( calls ) == 1 )
+
+        wait = stampede._WAIT
+        try:
+            # Without stale, wait for value from other worker
+            stampede._WAIT = 2
+            stampede._lock( cache, 'sftest', 4 )
+            threading.Timer( 0.1, lambda: cache.set( 'sftest', cache_encode(
+                        Stamped( 'other', 0, math.inf ) ), version=4 ) ).start()
+            self.assertTrue( call( 4 ) == ( 'other', 'WAIT' ) )
+
+            # Rebuild anyway if other worker doesn't finish
+            stampede._WAIT = 0.1
+            stampede._lock( cache, 'sftest', 5 )
+            self.assertTrue( call( 5 ) == ( 'v2', 'SET' ) )
+        finally:
+            stampede._WAIT = wait
+
+        # Readers that aren't single-flight get the value, not the envelope
+        stampede.single_flight_call( build, cache, 'default', 'sfplain', None, 60 )
+        self.assertTrue( cache_function( build, 'sfplain', buffered=None,
+                    no_set=True ) == 'v3' )
+
+    def test_api_encoded( self ):
+
+        print("Encoded API responses")
+        from django.test import RequestFactory
+        from mpframework.common.api import encode_api_response
+        from mpframework.common.api import respond_api_encoded
+
+        encoded = encode_api_response({ 'data': 'x' * 2000 })
+        etag = encoded['etag']
+        self.assertTrue( etag.startswith('W/"') )
+
+        request = RequestFactory().get( '/', HTTP_ACCEPT_ENCODING='gzip' )
+        response = respond_api_encoded( request, encoded )
+        self.assertTrue( response['content-encoding'] == 'gzip' )
+        self.assertTrue( response['etag'] == etag )
+
+        # Codings refused with q=0 aren't used
+        for header, coding in ( ( 'br;q=0, gzip', 'gzip' ), ( 'gzip;q=0', None ),
+                                ( '*;q=0.5, br;q=0', 'gzip' ) ):
+            request = RequestFactory().get( '/', HTTP_ACCEPT_ENCODING=header )
+            response = respond_api_encoded( request, encoded )
+            self.assertTrue( response.get('content-encoding') == coding )
+
+        # If-None-Match is a list with weak comparison; 304 also varies
+        for header in ( '"other", ' + etag, etag[2:], '*' ):
+            request = RequestFactory().get( '/', HTTP_IF_NONE_MATCH=header )
+            response = respond_api_encoded( request, encoded )
+            self.assertTrue( response.status_code == 304 )
+            self.assertTrue( response['vary'] == 'Accept-Encoding' )
+
+        request = RequestFactory().get( '/', HTTP_IF_NONE_MATCH=etag[:-3] + '"' )
+        self.assertTrue( respond_api_encoded( request, encoded ).status_code == 200 )
+
 
 if __name__ == '__main__':
 
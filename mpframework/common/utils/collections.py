@@ -2,6 +2,10 @@
 """
     Utility code for working with collections and aggregations
 """
+import os
+from weakref import WeakSet
+from collections import OrderedDict
+from threading import Lock
 
 
 def accumulate_values( accumulator, new ):
@@ -22,3 +26,98 @@ def accumulate_values( accumulator, new ):
             accumulator += new
 
     return accumulator
+
+
+class LruCache:
+    """
+    Thread-safe, per-process LRU mapping for live Python objects.
+
+    Used for process memory caching where re-creating values is expensive
+    but values don't need to be shared across processes (compiled templates,
+    object registries, etc.).
+    Bounded by number of entries and optionally by total size, where
+    size_fn or the set call provides an approximate size for each value.
+    Hit and miss counts support tuning the bounds.
+    If on_evict is provided it is called with key and value for items
+    removed to stay within bounds (e.g., to release external resources).
+    Locks are replaced in forked processes, in case another thread
+    held one at the time of the fork.
+    """
+    _instances = WeakSet()
+
+    def __init__( self, max_entries, max_size=None, size_fn=None, on_evict=None ):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size_fn = size_fn or ( lambda _: 0 )
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+        self._instances.add( self )
+
+    def __len__( self ):
+        return len( self._items )
+
+    def __contains__( self, key ):
+        return key in self._items
+
+    def get( self, key, default=None ):
+        with self._lock:
+            item = self._items.get( key )
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end( key )
+            self.hits += 1
+            return item[0]
+
+    def set( self, key, value, size=None ):
+        size = self.size_fn( value ) if size is None else size
+        if self.max_size and size > self.max_size:
+            return
+        evicted = []
+        with self._lock:
+            old = self._items.pop( key, None )
+            if old is not None:
+                self.size -= old[1]
+            self._items[ key ] = ( value, size )
+            self.size += size
+            while self._items and ( len( self._items ) > self.max_entries or
+                        ( self.max_size and self.size > self.max_size ) ):
+                old_key, ( old_value, old_size ) = self._items.popitem( last=False )
+                self.size -= old_size
+                evicted.append( ( old_key, old_value ) )
+        if self.on_evict:
+            for old_key, old_value in evicted:
+                self.on_evict( old_key, old_value )
+
+    def pop( self, key, default=None ):
+        with self._lock:
+            item = self._items.pop( key, None )
+            if item is None:
+                return default
+            self.size -= item[1]
+            return item[0]
+
+    def clear( self ):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    @property
+    def stats( self ):
+        return {
+            'entries': len( self._items ),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            }
+
+    @classmethod
+    def _after_fork( cls ):
+        for lru in cls._instances:
+            lru._lock = Lock()
+
+os.register_at_fork( after_in_child=LruCache._after_fork )
@@ -6,6 +6,8 @@
     after delta time, send empty values to override blanked values,
     and get retired items to overide recently retired items.
 """
+from bisect import bisect_left
+from bisect import bisect_right
 
 from mpframework.common import log
 
@@ -97,7 +99,6 @@ def get_trees( request, **kwargs ):
     when there are a large number of tree nodes. Unlike items, every tree
     node needs to be processed twice, so just loop array.
     """
-    rv = []
     if log.debug_on():
         rt = request.mptiming
         rt.mark()
@@ -111,8 +112,10 @@ def get_trees( request, **kwargs ):
 
     # Map tree node values and doing some first-pass processing on
     # the tree list to allow lookups to reduce DB hits
+    trees = []
     tree_node_ids = []
     tree_roots = {}
+    root_nodes = []
 
     for node in qs.iterator():
         log.detail3("Tree node: %s -> %s, %s", node.pk, node.tag, node.name)
@@ -130,14 +133,19 @@ def get_trees( request, **kwargs ):
         tree['my_root'] = tree_id
         if not node.parent_id:
             tree_roots[ tree_id ] = node.pk
+            root_nodes.append(( tree, tree_id, node._mpttfield('left'),
+                    node._mpttfield('right'), node._provider_id ))
 
-            # Add any descendant node ids to the values
-            tree['all_nodes'] = node.get_descendant_ids
+        trees.append( tree )
 
-        rv.append( tree )
+    # Add all descendant node ids to the root values; intervals come from
+    # every node in the root trees (not only those in the request's query),
+    # so full loads and deltas send the same descendants
+    if root_nodes:
+        _add_descendant_ids( root_nodes, _tree_intervals( root_nodes ) )
 
     log.debug_on() and log.debug2("%s %s - Loading trees part 1: %s tree nodes",
-                                    rt.pk, rt, len(rv))
+                                    rt.pk, rt, len(trees))
 
     # Now get every tree_item for the tree nodes into a dict indexed by
     # the tree id; so one DB fetch for all item ids associated with the trees
@@ -154,7 +162,7 @@ def get_trees( request, **kwargs ):
     treecat_ids = _get_categories( tree_node_ids )
 
     # Then add tree node information and tree_items
-    for tree in rv:
+    for tree in trees:
         tree_id = tree['id']
 
         # Add the root for this tree from the root nodes stored on first pass
@@ -178,13 +186,46 @@ def get_trees( request, **kwargs ):
 
         # For root collections, send all descendant ids
         if not tree.get('parent'):
-            all_items = node_treeitems_ids.get( tree_id, [] )
+            all_items = list( node_treeitems_ids.get( tree_id, [] ) )
             for node_id in tree['all_nodes']:
                 all_items.extend( node_treeitems_ids.get( node_id, [] ) )
             tree['all_items'] = all_items
 
     log.debug_on() and log.debug("%s FINISHED LOADING TREES(%s) %s: %s trees",
-                                    rt.pk, rt.log_recent(), rt, len(rv))
+                                    rt.pk, rt.log_recent(), rt, len(trees))
+    return trees
+
+def _add_descendant_ids( root_nodes, intervals ):
+    """
+    MPTT descendants of a node are the nodes in the same tree whose
+    left value is inside the node's left/right interval, so with nodes
+    sorted by left, descendants are a contiguous slice.
+    """
+    sorted_intervals = {}
+    for tree_id, nodes in intervals.items():
+        nodes.sort()
+        sorted_intervals[ tree_id ] = ( [ n[0] for n in nodes ], nodes )
+
+    for tree, tree_id, left, right, provider_id in root_nodes:
+        lefts, nodes = sorted_intervals.get( ( tree_id, provider_id ), ( [], [] ) )
+        start = bisect_right( lefts, left )
+        end = bisect_left( lefts, right )
+        tree['all_nodes'] = [ n[2] for n in nodes[ start:end ] ]
+
+def _tree_intervals( root_nodes ):
+    """
+    Get MPTT intervals for all nodes in root trees in one DB hit,
+    keyed by MPTT tree id and provider, as get_descendant_ids does
+    """
+    rv = {}
+    tree_ids = [ root[1] for root in root_nodes ]
+    provider_ids = { root[4] for root in root_nodes }
+    for node in Tree.objects.mpusing('read_replica')\
+                    .filter( mptt_id__in=tree_ids, _provider_id__in=provider_ids )\
+                    .values_list( 'mptt_id', '_provider_id', 'mptt_left',
+                                  'mptt_right', 'id' )\
+                    .iterator():
+        rv.setdefault( node[:2], [] ).append( node[2:] )
     return rv
 
 def _get_categories( ids ):
@@ -24,7 +24,7 @@ class BaseAttr( BaseContentFields, BaseContentVisibility,
         abstract = True
 
     @property
-    @cache_rv( keyfn=ProviderModel.provider_keyfn, buffered='local_small' )
+    @cache_rv( keyfn=ProviderModel.provider_keyfn, buffered='local_small', local=True )
     def isolate_sandbox( self ):
         """
         Returns None if content is not assigned to any isolated sandbox, or
@@ -5,6 +5,9 @@
 import re
 
 from mpframework.common import log
+from mpframework.common.cache.codec import codec_stats
+from mpframework.common.cache.stash import stash_stats
+from mpframework.common.cache.l1 import l1_stats
 
 
 class mpDebugMiddleware:
@@ -43,9 +46,13 @@ class mpDebugMiddleware:
                 stat_comment = re.compile(r'<!--MPSTATS-->')
                 match = stat_comment.search( html )
                 if match:
-                    stat_html = "<b>Server: %s</b>" % str( request.mptiming )
+                    stash = stash_stats()
+                    stat_html = "<b>Server: %s</b> stash %s/%s" % ( str( request.mptiming ),
+                                    stash['hits'], stash['hits'] + stash['misses'] )
                     new_html = html[ :match.start() ] + stat_html + html[ match.end(): ]
                     response.content = new_html
 
             log.timing2("START RESPONSE MIDDLEWARE: %s", request.mptiming)
+            log.timing3("Cache codec: %s, stash: %s, L1: %s", codec_stats(),
+                            stash_stats(), l1_stats())
         return response
@@ -8,7 +8,10 @@ from django.views.defaults import bad_request
 
 from mpframework.common import log
 from mpframework.common import sys_options
+from mpframework.common.cache.version import version_memo_start
+from mpframework.common.cache.version import version_memo_end
 from mpframework.common.ip_throttle import check_ip_limiting
+from mpframework.common.tasks import flush_queue_tasks
 from mpframework.common.middleware import mpMiddlewareBase
 from mpframework.common.db.connections import open_connections
 from mpframework.common.logging.timing import mpTiming
@@ -84,6 +87,7 @@ class mpFirstLastMiddleware( mpMiddlewareBase ):
 
         # Per-request stash, temporary data during request not worth caching
         request.mpstash = {}
+        version_memo_start()
 
         # Malformed IPs won't be accepted; shouldn't happen in legit cases
         if not request.ip:
@@ -155,6 +159,8 @@ class mpFirstLastMiddleware( mpMiddlewareBase ):
           - Add any supported request headings
           - Timing logging for requests
         """
+        version_memo_end()
+
         if request.is_healthcheck or request.is_bad:
             return response
 
@@ -181,6 +187,9 @@ class mpFirstLastMiddleware( mpMiddlewareBase ):
         # Support for request/response tracking/debugging
         _add_mpinfo( request, response )
 
+        # Send any task messages from the request
+        flush_queue_tasks()
+
         _log_end( request, response )
         return response
 
@@ -8,6 +8,7 @@ import threading
 from django.conf import settings
 
 from mpframework.common import log
+from mpframework.common.cache.bus import start_invalidation_listener
 from mpframework.common.tasks import start_task_polling
 from mpframework.common.tasks import start_bots
 
@@ -28,6 +29,9 @@ def process_startup():
         for item in BaseItem.objects.filter():
             item.downcast_type
 
+    # Listen for cache invalidation from other servers
+    start_invalidation_listener()
+
     # uWSGI specific setup for spooler
     _setup_uwsgi( thread )
 
@@ -4,11 +4,27 @@
 
     The sandbox for a given host is cached and attached to all
     request objects in middleware.
+
+    Each process keeps a registry of sandbox objects by host name so
+    most requests don't need distributed cache gets to setup the sandbox.
+    Registry entries are checked against the sandbox cache group version
+    each request and reloaded when it changes.
+
+    Sandbox and provider objects have mutable state (option and policy
+    dicts, Django related object caches, stashes) that requests may change,
+    so each request gets a shallow copy of the registry objects with that
+    state reset; only the small dict fields are unpickled per request.
 """
+import pickle
+from copy import copy
+from django.conf import settings
 from django.http import Http404
 
 from mpframework.common import log
 from mpframework.common.cache import cache_rv
+from mpframework.common.cache import clear_stashed_methods
+from mpframework.common.cache.groups import cache_group_sandbox
+from mpframework.common.utils.collections import LruCache
 from mpframework.common.utils.hosts import fixup_host_name
 
 from .models.sandbox import Sandbox
@@ -19,21 +35,119 @@ def get_sandbox( request, hostname=None ):
     Returns a cached sandbox object for the hostname
     Treats non-existent hosts as a 404
     """
-    if not hostname:
-        hostname = request.host
+    return get_tenant( request, hostname ).request_sandbox()
+
+def get_tenant( request, hostname=None ):
+    """
+    Returns registry entry for the hostname, loading or refreshing
+    from cache as needed.
+    """
+    hostname = hostname or request.host
+    registry_name = fixup_host_name( hostname )
+    tenant = _registry.get( registry_name )
+    if tenant and tenant.is_current():
+        return tenant
+
     host_ids = _get_sandbox_and_provider_ids( hostname )
     if host_ids:
         sandbox_id, provider_id = host_ids
+        # Get version first, so a change during the load isn't missed
+        version = _tenant_version( sandbox_id, provider_id )
         sandbox = Sandbox.objects.get_sandbox_from_id( sandbox_id, provider_id )
         if sandbox:
-            return sandbox
+            tenant = TenantEntry( sandbox, version )
+            _registry.set( registry_name, tenant )
+            log.debug_on() and log.cache2("TENANT registry load: %s -> %s, %s",
+                                    registry_name, sandbox, _registry.stats)
+            return tenant
         request.mperror = "SUSPECT BAD_SANDBOX"
     else:
         request.mperror = "SUSPECT NO_SANDBOX"
     raise Http404
 
+def clear_tenant_registry():
+    _registry.clear()
+
+def tenant_registry_stats():
+    return _registry.stats
+
+
+class TenantEntry:
+    """
+    Sandbox, provider, and host objects for one host name in a process.
+    The registry sandbox (and its provider) is never handed to requests
+    directly; each request gets copies so request changes don't leak.
+    """
+
+    def __init__( self, sandbox, version ):
+        self.sandbox = sandbox
+        self.version = version
+        self.sandbox_id = sandbox.pk
+        self.provider_id = sandbox._provider_id
+        self._hosts = {}
+
+        # Load provider now so it is shared by request copies
+        self.provider = sandbox._provider
+        clear_stashed_methods( sandbox )
+        clear_stashed_methods( self.provider )
+        self._sandbox_dicts = _dict_snapshot( sandbox )
+        self._provider_dicts = _dict_snapshot( self.provider )
+
+    def is_current( self ):
+        return self.version == _tenant_version( self.sandbox_id, self.provider_id )
+
+    def request_sandbox( self ):
+        sandbox = _request_copy( self.sandbox, self._sandbox_dicts )
+        sandbox._provider = _request_copy( self.provider, self._provider_dicts )
+        return sandbox
+
+    def get_host( self, **host_filter ):
+        """
+        Returns registry copy of SandboxHost that matches filter
+        """
+        key = tuple( sorted( host_filter.items() ) )
+        try:
+            return self._hosts[ key ]
+        except KeyError:
+            host = self.sandbox.get_host( **host_filter )
+            self._hosts[ key ] = host
+            return host
+
+def _dict_snapshot( obj ):
+    """
+    Pickle the dict attributes (YAML options, policy, etc.) that requests
+    may change, so they can be restored without unpickling the model
+    """
+    return { name: pickle.dumps( value, pickle.HIGHEST_PROTOCOL )
+                for name, value in vars( obj ).items()
+                if isinstance( value, dict ) and not name.startswith('_prefetched') }
+
+def _request_copy( obj, dicts ):
+    """
+    Shallow copy of registry model with its own dicts, no stash, and
+    an empty related object cache
+    """
+    rv = copy( obj )
+    clear_stashed_methods( rv )
+    rv._state = copy( obj._state )
+    rv._state.fields_cache = {}
+    rv.__dict__.pop( '_prefetched_objects_cache', None )
+    for name, value in dicts.items():
+        rv.__dict__[ name ] = pickle.loads( value )
+    return rv
+
+def _tenant_version( sandbox_id, provider_id ):
+    """
+    The full sandbox chain includes provider and system, so changes to any
+    of these refresh registry sandbox and hosts
+    """
+    return cache_group_sandbox( sandbox_id, provider_id, system=True )
+
+_registry = LruCache( settings.MP_TUNING['TENANT_REGISTRY']['ENTRIES'] )
+
+
 @cache_rv( keyfn=lambda hostname: ( fixup_host_name( hostname ), '' ),
-            buffered='local_small' )
+            buffered='local_small', local=True )
 def _get_sandbox_and_provider_ids( hostname ):
     """
     Try to get sandbox based on host xxx.root.com or no-host ID and
@@ -12,7 +12,7 @@ from mpframework.common.utils import SafeNestedDict
 from mpframework.common.utils.hosts import fixup_host_name
 from mpframework.common.delivery import DELIVERY_DEFAULT
 
-from .cache import get_sandbox
+from .cache import get_tenant
 
 
 _sts_header = settings.MP_HTTP_SECURITY.get('STS_HEADER')
@@ -67,7 +67,8 @@ class SandboxMiddleware( mpMiddlewareBase ):
                 no_host_id = request.GET.get( 'no_host_id', request.mppathsegs[1] )
 
         # If getting sandbox fails here, a 404 will be raised
-        sandbox = get_sandbox( request, no_host_id )
+        tenant = get_tenant( request, no_host_id )
+        sandbox = tenant.request_sandbox()
 
         # If normal host request, redirect hosts if needed
         redirect = None
@@ -78,7 +79,7 @@ class SandboxMiddleware( mpMiddlewareBase ):
             host_filter = { '_host_name': fixup_host_name( request.host ) }
             if request.is_secure():
                 host_filter['https'] = True
-            host = sandbox.get_host( **host_filter )
+            host = tenant.get_host( **host_filter )
 
             # Handle invalid or redirect hosts
             if not host or host.redirect_to_main:
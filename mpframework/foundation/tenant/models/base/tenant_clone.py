@@ -182,16 +182,16 @@ def _copy_s3_files( **kwargs ):
         raise Exception("S3 Resource copy with no file data")
     t = mpTiming()
 
+    # Copy resources for each bucket concurrently
+    copies = {}
     for name, info in data.items():
+        log.debug("%s Copying field resources: %s, %s, %s -> %s",
+                     t, name, info['bucket'], info['source'], info['target'])
+        copies.setdefault( info['bucket'], [] ).append(
+                    ( info['source'], info['target'] ) )
+    for bucket, items in copies.items():
         try:
-            bucket = info['bucket']
-            source = info['source']
-            target = info['target']
-            log.debug("%s Copying field resources: %s, %s, %s -> %s",
-                         t, name, bucket, source, target)
-
-            s3.copy_file( bucket, source, target )
-
+            s3.BulkS3( bucket ).copy_keys( items )
         except Exception:
             log.exception("S3 Resource copy error: %s", kwargs)
 
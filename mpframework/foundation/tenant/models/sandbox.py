@@ -268,7 +268,7 @@ class Sandbox( TenantCloneMixin, ThemeMixin, FrameSelectMixin,
                          template_type if template_type else '' ])
         return key, self.cache_group
 
-    @cache_rv( keyfn=_template_keyfn, cache='template' )
+    @cache_rv( keyfn=_template_keyfn, cache='template', single_flight=True )
     def get_template( self, path, use_dev=False, option=None, template_type=None ):
         """
         Called for all mp_include tags and some backend code.
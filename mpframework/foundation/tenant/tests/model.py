@@ -5,6 +5,7 @@
 
 from mpframework.testing.framework import ModelTestCase
 
+from ..cache import TenantEntry
 from ..models.sandbox import Sandbox
 from ..models.provider import Provider
 from ..models.sandbox_host import SandboxHost
@@ -44,4 +45,20 @@ class ModelTests( ModelTestCase ):
         s2 = Sandbox.objects.clone_sandbox( s, p2, 'NewTestSandS2', 'new_sand' )
         self.assertTrue( s2.name == 'NewTestSandS2' )
 
+    def test_tenant_entry( self ):
 
+        sandbox = Sandbox.objects.get( id=1 )
+        tenant = TenantEntry( sandbox, 1 )
+
+        # Request sandboxes share no mutable state with each other
+        s1 = tenant.request_sandbox()
+        s1.options['test_option'] = 'changed'
+        s1.provider.policy['test_policy'] = 'changed'
+        s1.policy
+        s2 = tenant.request_sandbox()
+        self.assertTrue( s2 is not s1 and s2.provider is not s1.provider )
+        self.assertTrue( s2.provider is not tenant.provider )
+        self.assertFalse( 'test_option' in s2.options )
+        self.assertFalse( 'test_policy' in s2.provider.policy )
+        self.assertFalse( 'test_option' in tenant.sandbox.options )
+        self.assertTrue( s2.pk == sandbox.pk and s2.provider.pk == sandbox._provider_id )
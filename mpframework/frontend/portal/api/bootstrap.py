@@ -9,15 +9,19 @@
     risk of conflict related to long browser cache times. To make the URL
     match the timeout of the underlying timewin could calculate the seconds
     remaining at the time of the call, but that shouldn't be needed.
+
+    Timewin calls send cached JSON bytes with ETag, so conditional
+    requests get a 304 without any encoding.
 """
 
 from django.conf import settings
 
 from mpframework.common import log
 from mpframework.common.api import respond_api_call
+from mpframework.common.api import respond_api_encoded_call
 
-from ..bootstrap import bootstrap_dict_content_timewin
-from ..bootstrap import bootstrap_dict_user_timewin
+from ..bootstrap import bootstrap_encoded_content_timewin
+from ..bootstrap import bootstrap_encoded_user_timewin
 from ..bootstrap import bootstrap_dict_nocache
 from ..bootstrap import bootstrap_dict_embed
 
@@ -40,18 +44,18 @@ def edge_bootstrap_content( request, no_host_id, cache_url=None ):
     Served through edge servers to share through edge caching
     """
     log.debug("API Bootstrap Content edge: %s, %s", request.sandbox, cache_url)
-    def handler( _get ):
-        return bootstrap_dict_content_timewin( request )
-    return respond_api_call( request, handler, cache=_content_age, methods=['GET'] )
+    def handler():
+        return bootstrap_encoded_content_timewin( request )
+    return respond_api_encoded_call( request, handler, cache=_content_age )
 
 def bootstrap_user( request, cache_url=None ):
     """
     Core user data based on time window cache
     """
     log.debug("API Bootstrap User: %s, %s", request.user, cache_url)
-    def handler( _get ):
-        return bootstrap_dict_user_timewin( request )
-    return respond_api_call( request, handler, cache=_user_age, methods=['GET'] )
+    def handler():
+        return bootstrap_encoded_user_timewin( request )
+    return respond_api_encoded_call( request, handler, cache=_user_age )
 
 def bootstrap_nocache( request ):
     """
@@ -68,7 +72,7 @@ def bootstrap_content( request, cache_url=None ):
     Direct link for core content data based on time window cache
     """
     log.debug("API Bootstrap Content direct: %s, %s", request.sandbox, cache_url)
-    def handler( _get ):
-        return bootstrap_dict_content_timewin( request )
-    return respond_api_call( request, handler, cache=_content_age, methods=['GET'] )
+    def handler():
+        return bootstrap_encoded_content_timewin( request )
+    return respond_api_encoded_call( request, handler, cache=_content_age )
 
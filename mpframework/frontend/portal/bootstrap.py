@@ -26,6 +26,7 @@ from django.conf import settings
 
 from mpframework import mpf_function_group_call
 from mpframework.common import log
+from mpframework.common.api import encode_api_response
 from mpframework.common.cache import cache_rv
 from mpframework.user.mpuser.cache import user_timewin_get
 from mpframework.user.mpuser.cache import user_timewin_start
@@ -53,6 +54,20 @@ def bootstrap_dict_nocache( request ):
     rv.update( _user_deltas( request ) )
     return rv
 
+#--- Pre-encoded API responses
+# Cache JSON bytes with compressed variants for bootstrap API calls, so
+# cache hits don't unpickle bootstrap dicts or re-encode JSON
+
+@cache_rv( keyfn=cache_keyfn_content_timewin, single_flight=True, serve_stale=True,
+           local=True )
+def bootstrap_encoded_content_timewin( request ):
+    return encode_api_response( _content_timewin( request ) )
+
+@cache_rv( keyfn=lambda _:( '', user_timewin_start ), single_flight=True,
+           local=True )
+def bootstrap_encoded_user_timewin( request ):
+    return encode_api_response( _user_timewin( request ) )
+
 #--- Content data caching
 # Most content uses time window and delta caching, but some does not
 # The delta and notime caching uses content cache groups
@@ -74,7 +89,7 @@ def _content_deltas( request ):
     else:
         return _content_timewin( request )
 
-@cache_rv( keyfn=cache_keyfn_content_timewin )
+@cache_rv( keyfn=cache_keyfn_content_timewin, single_flight=True, serve_stale=True )
 def _content_timewin( request ):
     # Get or setup timewin version date in call to cache version,
     # then get content
@@ -98,7 +113,7 @@ def _content_delta_values( request, delta_start ):
 #--- User data caching
 # User data caching uses a time window and no other caching
 
-@cache_rv( keyfn=lambda _:( '', user_timewin_start ) )
+@cache_rv( keyfn=lambda _:( '', user_timewin_start ), single_flight=True )
 def _user_timewin( request ):
     # Get or setup timewin version date in cache call, get user data if not cached
     return _bootstrap_dict( 'bootstrap_user_timewin', request )
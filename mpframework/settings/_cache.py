@@ -37,11 +37,13 @@ _shared = {
     'VERSION': '',
     }
 
-def _cache_options( location=None ):
+def _cache_options( location=None, name=None ):
     """
     Shared values for setting up cache locations.
     In local dev/test, all caches share key namespace, while in production
     different caches otherwise.
+    Redis values are encoded with the MPF cache codec; name is used
+    for the codec's size stats.
     """
     rv = _shared.copy()
     _location = ''
@@ -51,6 +53,8 @@ def _cache_options( location=None ):
         _location = location
         _options = {
             'IGNORE_EXCEPTIONS': False,
+            'SERIALIZER': 'mpframework.common.cache.codec.CacheSerializer',
+            'CODEC_NAME': name,
             }
     else:
         """
@@ -78,7 +82,7 @@ def _cache_options( location=None ):
 """
 
 # Version cache, supports chained invalidation of version groups
-_version = _cache_options( env.MP_ROOT_CACHE['VERSION'] )
+_version = _cache_options( env.MP_ROOT_CACHE['VERSION'], 'version' )
 _version.update({
     # Versioning shares information across code versions, since invalidation
     # signals need to be available to all servers.
@@ -87,21 +91,21 @@ _version.update({
     })
 
 # Main temporary performance cache with versioning
-_default = _cache_options( env.MP_ROOT_CACHE['DEFAULT'] )
+_default = _cache_options( env.MP_ROOT_CACHE['DEFAULT'], 'default' )
 _default.update({
     'KEY_PREFIX': '{}{}'.format( env.MP_PLAYPEN_CACHE, env.MP_CODE_CURRENT ),
     'TIMEOUT': env.MP_CACHE_AGE['DEFAULT'],
     })
 
 # Template caching separate for easier management
-_template = _cache_options( env.MP_ROOT_CACHE['TEMPLATE'] )
+_template = _cache_options( env.MP_ROOT_CACHE['TEMPLATE'], 'template' )
 _template.update({
     'KEY_PREFIX': '{}{}'.format( env.MP_PLAYPEN_CACHE, env.MP_CODE_CURRENT ),
     'TIMEOUT': env.MP_CACHE_AGE['TEMPLATE'],
     })
 
 # Persisting performance separate, not tied to code version
-_persist = _cache_options( env.MP_ROOT_CACHE['PERSIST'] )
+_persist = _cache_options( env.MP_ROOT_CACHE['PERSIST'], 'persist' )
 _persist.update({
     'KEY_PREFIX': 'per:{}'.format( env.MP_PLAYPEN_CACHE ),
     'TIMEOUT': env.MP_CACHE_AGE['PERSIST'],
@@ -115,7 +119,7 @@ _persist.update({
 """
 
 # Django user sessions
-_user_session = _cache_options( env.MP_ROOT_CACHE['USER'] )
+_user_session = _cache_options( env.MP_ROOT_CACHE['USER'], 'user' )
 if env.MP_WSGI:
     _user_session.update({
         'KEY_PREFIX': '{}'.format( env.MP_PLAYPEN_CACHE_USER ),
@@ -130,14 +134,14 @@ elif env.MP_IS_DJ_SERVER:
         }
 
 # Session blackboard
-_session = _cache_options( env.MP_ROOT_CACHE['SESSION'] )
+_session = _cache_options( env.MP_ROOT_CACHE['SESSION'], 'session' )
 _session.update({
     'KEY_PREFIX': 'ses:{}'.format( env.MP_PLAYPEN_CACHE ),
     'TIMEOUT': env.MP_CACHE_AGE['SESSION'],
     })
 
 # Information tracked for requests
-_request = _cache_options( env.MP_ROOT_CACHE['REQUEST'] )
+_request = _cache_options( env.MP_ROOT_CACHE['REQUEST'], 'request' )
 _request.update({
     'KEY_PREFIX': 'req:{}'.format( env.MP_PLAYPEN_CACHE ),
     'TIMEOUT': env.MP_CACHE_AGE['REQUEST'],